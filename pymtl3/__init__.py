@@ -1,5 +1,21 @@
-from .datatypes import *
-from .datatypes import _bitwidths
+from .datatypes import (
+    Bits,
+    __getattr__,
+    _bitwidths,
+    bitstruct,
+    clog2,
+    concat,
+    is_bitstruct_class,
+    is_bitstruct_inst,
+    mk_bits,
+    mk_bitstruct,
+    reduce_and,
+    reduce_or,
+    reduce_xor,
+    sext,
+    trunc,
+    zext,
+)
 from .dsl.Component import Component
 from .dsl.ComponentLevel1 import update
 from .dsl.ComponentLevel2 import update_ff
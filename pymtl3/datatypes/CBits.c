@@ -0,0 +1,1192 @@
+/*
+========================================================================
+CBits.c
+========================================================================
+CPython extension implementation of the fixed-bitwidth data type. It
+has exactly the same semantics (including error messages) as the
+pure-Python implementation in PythonBits.py, but keeps values of at most
+64 bits in a machine word, so that operators, slicing and assignments
+don't allocate Python ints and are dispatched through type slots.
+Values wider than 64 bits are kept as Python ints.
+
+This module is an optional build. Select it with PYMTL_BITS=c.
+*/
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+#include <stdio.h>
+
+#define MAX_NBITS 8192
+
+typedef struct {
+  PyObject_HEAD
+  int       nbits;
+  int       has_next;
+  uint64_t  u;     /* value if nbits <= 64 */
+  uint64_t  nu;    /* next value if nbits <= 64 */
+  PyObject *big;   /* value if nbits > 64 */
+  PyObject *nbig;  /* next value if nbits > 64 */
+} BitsObject;
+
+static PyTypeObject *BitsType;
+
+#define Bits_Check(o) PyObject_TypeCheck( (o), BitsType )
+#define IS_SMALL(b)   ( (b)->nbits <= 64 )
+
+static inline uint64_t mask64( int n ) {
+  return n >= 64 ? ~(uint64_t)0 : ( ((uint64_t)1 << n) - 1 );
+}
+
+//------------------------------------------------------------------------
+// Cached Python ints for bounds: lower <= value <= upper
+//------------------------------------------------------------------------
+
+static PyObject *py_zero;
+static PyObject *py_upper_cache[ MAX_NBITS+1 ];
+static PyObject *py_lower_cache[ MAX_NBITS+1 ];
+
+static PyObject *py_one_shl( int n ) {
+  PyObject *one = PyLong_FromLong( 1 );
+  PyObject *sh  = PyLong_FromLong( n );
+  PyObject *ret = NULL;
+  if ( one && sh ) ret = PyNumber_Lshift( one, sh );
+  Py_XDECREF( one );
+  Py_XDECREF( sh );
+  return ret;
+}
+
+/* Borrowed reference */
+static PyObject *py_upper( int n ) {
+  PyObject *r = py_upper_cache[n];
+  if ( !r ) {
+    PyObject *one = PyLong_FromLong( 1 );
+    PyObject *t   = py_one_shl( n );
+    if ( one && t ) r = PyNumber_Subtract( t, one );
+    Py_XDECREF( one );
+    Py_XDECREF( t );
+    py_upper_cache[n] = r;
+  }
+  return r;
+}
+
+/* Borrowed reference */
+static PyObject *py_lower( int n ) {
+  PyObject *r = py_lower_cache[n];
+  if ( !r ) {
+    if ( n == 0 ) {
+      r = PyLong_FromLong( 0 );
+    } else {
+      PyObject *t = py_one_shl( n-1 );
+      if ( t ) r = PyNumber_Negative( t );
+      Py_XDECREF( t );
+    }
+    py_lower_cache[n] = r;
+  }
+  return r;
+}
+
+//------------------------------------------------------------------------
+// Helpers
+//------------------------------------------------------------------------
+
+static BitsObject *alloc_bits( PyTypeObject *type, int nbits ) {
+  BitsObject *b = (BitsObject *) type->tp_alloc( type, 0 );
+  if ( !b ) return NULL;
+  b->nbits    = nbits;
+  b->has_next = 0;
+  b->u        = 0;
+  b->nu       = 0;
+  b->big      = NULL;
+  b->nbig     = NULL;
+  return b;
+}
+
+static PyObject *new_small( int nbits, uint64_t u ) {
+  BitsObject *b = alloc_bits( BitsType, nbits );
+  if ( b ) b->u = u;
+  return (PyObject *) b;
+}
+
+/* Steals a reference to v, which must be in [0, upper] */
+static PyObject *new_big( int nbits, PyObject *v ) {
+  BitsObject *b;
+  if ( !v ) return NULL;
+  b = alloc_bits( BitsType, nbits );
+  if ( !b ) { Py_DECREF( v ); return NULL; }
+  b->big = v;
+  return (PyObject *) b;
+}
+
+/* Steals a reference to v, which must be in [0, upper] */
+static PyObject *new_from_pylong( int nbits, PyObject *v ) {
+  uint64_t u;
+  if ( !v ) return NULL;
+  if ( nbits > 64 ) return new_big( nbits, v );
+  u = PyLong_AsUnsignedLongLongMask( v );
+  Py_DECREF( v );
+  if ( u == (uint64_t)-1 && PyErr_Occurred() ) return NULL;
+  return new_small( nbits, u );
+}
+
+/* New reference */
+static PyObject *bits_pyvalue( BitsObject *b ) {
+  if ( IS_SMALL(b) ) return PyLong_FromUnsignedLongLong( b->u );
+  Py_INCREF( b->big );
+  return b->big;
+}
+
+/* Store v & upper into the current or next value. v is a Python int. */
+static int store_masked( BitsObject *self, PyObject *v, int next ) {
+  if ( IS_SMALL(self) ) {
+    uint64_t x = PyLong_AsUnsignedLongLongMask( v );
+    if ( x == (uint64_t)-1 && PyErr_Occurred() ) return -1;
+    x &= mask64( self->nbits );
+    if ( next ) self->nu = x;
+    else        self->u  = x;
+  }
+  else {
+    PyObject *m = PyNumber_And( v, py_upper( self->nbits ) );
+    if ( !m ) return -1;
+    if ( next ) Py_XSETREF( self->nbig, m );
+    else        Py_XSETREF( self->big,  m );
+  }
+  return 0;
+}
+
+/* Copy the value of src into the current or next value of self. */
+static void store_bits( BitsObject *self, BitsObject *src, int next ) {
+  if ( IS_SMALL(self) ) {
+    if ( next ) self->nu = src->u;
+    else        self->u  = src->u;
+  }
+  else {
+    Py_INCREF( src->big );
+    if ( next ) Py_XSETREF( self->nbig, src->big );
+    else        Py_XSETREF( self->big,  src->big );
+  }
+}
+
+/* Returns 1 if lower <= v <= upper (or 0 <= v <= upper if !allow_neg),
+   0 if not, and -1 on error. v is a Python int. */
+static int in_range( PyObject *v, int n, int allow_neg ) {
+  int overflow, r;
+  long long x = PyLong_AsLongLongAndOverflow( v, &overflow );
+  if ( x == -1 && PyErr_Occurred() ) return -1;
+
+  if ( !overflow && n <= 62 ) {
+    long long up = ((long long)1 << n) - 1;
+    long long lo = allow_neg ? -((long long)1 << (n-1)) : 0;
+    return lo <= x && x <= up;
+  }
+
+  r = PyObject_RichCompareBool( v, allow_neg ? py_lower(n) : py_zero, Py_GE );
+  if ( r != 1 ) return r;
+  return PyObject_RichCompareBool( v, py_upper(n), Py_LE );
+}
+
+static PyObject *py_hex( PyObject *v ) {
+  return PyNumber_ToBase( v, 16 );
+}
+
+enum {
+  RANGE_INIT,
+  RANGE_ILSHIFT,
+  RANGE_IMATMUL,
+  RANGE_SLICE,
+  RANGE_BINOP,
+};
+
+static void range_error( int kind, PyObject *v, int n ) {
+  PyObject *hv = py_hex( v );
+  PyObject *hl = py_hex( py_lower(n) );
+  PyObject *hu = py_hex( py_upper(n) );
+
+  if ( hv && hl && hu ) {
+    switch ( kind ) {
+      case RANGE_INIT:
+        PyErr_Format( PyExc_ValueError, "Value %S is too wide for Bits%d!\n"
+                      "(Bits%d only accepts %S <= value <= %S)", hv, n, n, hl, hu );
+        break;
+      case RANGE_ILSHIFT:
+        PyErr_Format( PyExc_ValueError, "RHS value %S of <<= is too wide for LHS Bits%d!\n"
+                      "(Bits%d only accepts %S <= value <= %S)", hv, n, n, hl, hu );
+        break;
+      case RANGE_IMATMUL:
+        PyErr_Format( PyExc_ValueError, "RHS value %S of @= is too wide for LHS Bits%d!\n"
+                      "(Bits%d only accepts %S <= value <= %S)", hv, n, n, hl, hu );
+        break;
+      case RANGE_SLICE:
+        PyErr_Format( PyExc_ValueError, "Cannot fit %S into a Bits%d slice\n"
+                      "(Bits%d only accepts %S <= value <= %S)", v, n, n, hl, hu );
+        break;
+      default:
+        PyErr_Format( PyExc_ValueError, "Integer %S is not a valid binop operand with Bits%d!\n"
+                      "Suggestion: 0 <= x <= %S", hv, n, hu );
+    }
+  }
+  Py_XDECREF( hv );
+  Py_XDECREF( hl );
+  Py_XDECREF( hu );
+}
+
+/* Convert o to a Python int the way int(o) does. New reference. */
+static PyObject *to_pylong( PyObject *o ) {
+  if ( PyLong_CheckExact( o ) ) { Py_INCREF( o ); return o; }
+  return PyNumber_Long( o );
+}
+
+static int clear_attribute_error( void ) {
+  if ( PyErr_ExceptionMatches( PyExc_AttributeError ) ) {
+    PyErr_Clear();
+    return 1;
+  }
+  return 0;
+}
+
+//------------------------------------------------------------------------
+// Construction
+//------------------------------------------------------------------------
+
+static int bits_init_value( BitsObject *self, PyObject *v, int trunc_int ) {
+  int n = self->nbits;
+
+  if ( !v ) {
+    if ( !IS_SMALL(self) ) {
+      Py_INCREF( py_zero );
+      self->big = py_zero;
+    }
+    return 0;
+  }
+
+  if ( Bits_Check(v) ) {
+    BitsObject *o = (BitsObject *) v;
+    if ( o->nbits != n ) {
+      if ( n < o->nbits )
+        PyErr_Format( PyExc_ValueError, "The Bits%d object on RHS is too wide to be used to construct Bits%d!\n"
+                      "- Suggestion: directly use trunc( value, %d/Bits%d )", o->nbits, n, n, n );
+      else
+        PyErr_Format( PyExc_ValueError, "The Bits%d object on RHS is too narrow to be used to construct Bits%d!\n"
+                      "- Suggestion: directly use zext/sext(value, %d/Bits%d )", o->nbits, n, n, n );
+      return -1;
+    }
+    store_bits( self, o, 0 );
+    return 0;
+  }
+
+  {
+    int r = 0;
+    PyObject *iv = to_pylong( v );
+    if ( !iv ) return -1;
+
+    if ( !trunc_int ) {
+      r = in_range( iv, n, 1 );
+      if ( r == 0 ) range_error( RANGE_INIT, iv, n );
+      r = r == 1 ? 0 : -1;
+    }
+    if ( r == 0 ) r = store_masked( self, iv, 0 );
+    Py_DECREF( iv );
+    return r;
+  }
+}
+
+static PyObject *bits_new( PyTypeObject *type, PyObject *args, PyObject *kwds ) {
+  PyObject   *nbits_obj = NULL, *v = NULL;
+  int         trunc_int = 0, overflow = 0;
+  long        n;
+  BitsObject *self;
+
+  // BitsN subclasses carry nbits as a class attribute and only take the
+  // value, i.e., BitsN( v=0, *, trunc_int=False )
+  if ( type != BitsType ) {
+    PyObject *cls_nbits = PyObject_GetAttrString( (PyObject *) type, "nbits" );
+    if ( !cls_nbits ) return NULL;
+    if ( PyLong_Check( cls_nbits ) ) {
+      static char *kwlist[] = { "v", "trunc_int", NULL };
+      if ( !PyArg_ParseTupleAndKeywords( args, kwds, "|O$p", kwlist, &v, &trunc_int ) ) {
+        Py_DECREF( cls_nbits );
+        return NULL;
+      }
+      nbits_obj = cls_nbits;
+    }
+    else
+      Py_DECREF( cls_nbits );
+  }
+
+  if ( !nbits_obj ) {
+    static char *kwlist[] = { "nbits", "v", "trunc_int", NULL };
+    if ( !PyArg_ParseTupleAndKeywords( args, kwds, "O|Op", kwlist, &nbits_obj, &v, &trunc_int ) )
+      return NULL;
+    nbits_obj = to_pylong( nbits_obj );
+    if ( !nbits_obj ) return NULL;
+  }
+
+  n = PyLong_AsLongAndOverflow( nbits_obj, &overflow );
+  if ( n == -1 && PyErr_Occurred() ) { Py_DECREF( nbits_obj ); return NULL; }
+  if ( overflow || n < 1 || n >= MAX_NBITS+1 ) {
+    PyErr_Format( PyExc_ValueError, "Only support 1 <= nbits < 8193, not %S", nbits_obj );
+    Py_DECREF( nbits_obj );
+    return NULL;
+  }
+  Py_DECREF( nbits_obj );
+
+  self = alloc_bits( type, (int) n );
+  if ( !self ) return NULL;
+
+  if ( bits_init_value( self, v, trunc_int ) < 0 ) {
+    Py_DECREF( self );
+    return NULL;
+  }
+  return (PyObject *) self;
+}
+
+static void bits_dealloc( BitsObject *self ) {
+  PyTypeObject *type = Py_TYPE(self);
+  Py_CLEAR( self->big );
+  Py_CLEAR( self->nbig );
+  type->tp_free( (PyObject *) self );
+  Py_DECREF( type );
+}
+
+//------------------------------------------------------------------------
+// PyMTL simulation specific
+//------------------------------------------------------------------------
+
+/* Shared implementation of <<= (next=1) and @= (next=0) */
+static PyObject *bits_assign( BitsObject *self, PyObject *v, int next ) {
+  int n = self->nbits;
+  const char *desc = next ? "<<= non-blocking" : "@= blocking";
+
+  if ( Bits_Check(v) ) {
+    BitsObject *o = (BitsObject *) v;
+    if ( o->nbits != n ) {
+      if ( o->nbits < n )
+        PyErr_Format( PyExc_ValueError, "Bitwidth of LHS must be equal to RHS during %s assignment, "
+                      "but here LHS Bits%d > RHS Bits%d.\n"
+                      "- Suggestion: LHS @= zext/sext(RHS, nbits/Type)", desc, n, o->nbits );
+      else
+        PyErr_Format( PyExc_ValueError, "Bitwidth of LHS must be equal to RHS during %s assignment, "
+                      "but here LHS Bits%d < RHS Bits%d.\n"
+                      "- Suggestion: LHS @= trunc(RHS, nbits/Type)", desc, n, o->nbits );
+      return NULL;
+    }
+    store_bits( self, o, next );
+  }
+  else {
+    // Bitstruct, or anything else that has nbits and to_bits
+    PyObject *v_nbits = PyObject_GetAttrString( v, "nbits" );
+    PyObject *iv      = NULL;
+
+    if ( v_nbits ) {
+      PyObject *py_n = PyLong_FromLong( n );
+      int lt, ne;
+      if ( !py_n ) { Py_DECREF( v_nbits ); return NULL; }
+      ne = PyObject_RichCompareBool( v_nbits, py_n, Py_NE );
+      lt = ne == 1 ? PyObject_RichCompareBool( v_nbits, py_n, Py_LT ) : 0;
+      Py_DECREF( py_n );
+      if ( ne < 0 || lt < 0 ) { Py_DECREF( v_nbits ); return NULL; }
+      if ( ne ) {
+        if ( lt )
+          PyErr_Format( PyExc_ValueError, "Bitwidth of LHS must be equal to RHS during %s assignment, "
+                        "but here LHS Bits%d > RHS Bits%S.\n"
+                        "- Suggestion: LHS @= zext/sext(RHS, nbits/Type)", desc, n, v_nbits );
+        else
+          PyErr_Format( PyExc_ValueError, "Bitwidth of LHS must be equal to RHS during %s assignment, "
+                        "but here LHS Bits%d < RHS Bits%S.\n"
+                        "- Suggestion: LHS @= trunc(RHS, nbits/Type)", desc, n, v_nbits );
+        Py_DECREF( v_nbits );
+        return NULL;
+      }
+      Py_DECREF( v_nbits );
+
+      {
+        PyObject *b = PyObject_CallMethod( v, "to_bits", NULL );
+        if ( b ) {
+          if ( Bits_Check(b) ) {
+            store_bits( self, (BitsObject *) b, next );
+            Py_DECREF( b );
+            goto done;
+          }
+          iv = PyObject_GetAttrString( b, "_uint" );
+          Py_DECREF( b );
+        }
+        if ( !iv && !clear_attribute_error() ) return NULL;
+      }
+    }
+    else if ( !clear_attribute_error() )
+      return NULL;
+
+    if ( iv ) {
+      int r = store_masked( self, iv, next );
+      Py_DECREF( iv );
+      if ( r < 0 ) return NULL;
+    }
+    else {
+      // Cast to int
+      int r;
+      iv = to_pylong( v );
+      if ( !iv ) return NULL;
+      r = in_range( iv, n, 1 );
+      if ( r == 0 ) range_error( next ? RANGE_ILSHIFT : RANGE_IMATMUL, iv, n );
+      if ( r == 1 ) r = store_masked( self, iv, next ) < 0 ? -1 : 1;
+      Py_DECREF( iv );
+      if ( r != 1 ) return NULL;
+    }
+  }
+
+done:
+  if ( next ) self->has_next = 1;
+  Py_INCREF( self );
+  return (PyObject *) self;
+}
+
+static PyObject *bits_ilshift( PyObject *self, PyObject *v ) {
+  return bits_assign( (BitsObject *) self, v, 1 );
+}
+
+static PyObject *bits_imatmul( PyObject *self, PyObject *v ) {
+  return bits_assign( (BitsObject *) self, v, 0 );
+}
+
+static PyObject *bits_flip( BitsObject *self, PyObject *Py_UNUSED(ignored) ) {
+  if ( !self->has_next ) {
+    PyErr_Format( PyExc_AttributeError, "'%s' object has no attribute '_next'",
+                  Py_TYPE(self)->tp_name );
+    return NULL;
+  }
+  if ( IS_SMALL(self) ) self->u = self->nu;
+  else {
+    Py_INCREF( self->nbig );
+    Py_XSETREF( self->big, self->nbig );
+  }
+  Py_RETURN_NONE;
+}
+
+static PyObject *bits_clone( BitsObject *self, PyObject *Py_UNUSED(ignored) ) {
+  if ( IS_SMALL(self) ) return new_small( self->nbits, self->u );
+  Py_INCREF( self->big );
+  return new_big( self->nbits, self->big );
+}
+
+static PyObject *bits_deepcopy( BitsObject *self, PyObject *memo ) {
+  return bits_clone( self, NULL );
+}
+
+static PyObject *bits_to_bits( PyObject *self, PyObject *Py_UNUSED(ignored) ) {
+  Py_INCREF( self );
+  return self;
+}
+
+//------------------------------------------------------------------------
+// Indexing and slicing
+//------------------------------------------------------------------------
+
+/* Parse a slice as Bits does. Returns 0 on success, -1 with IndexError */
+static int parse_slice( BitsObject *self, PyObject *idx, long long *start, long long *stop ) {
+  PySliceObject *sl = (PySliceObject *) idx;
+  int n = self->nbits, step, valid = 0;
+
+  step = PyObject_IsTrue( sl->step );
+  if ( step < 0 ) PyErr_Clear();
+  if ( step > 0 ) {
+    PyErr_SetString( PyExc_IndexError, "Index cannot contain step" );
+    return -1;
+  }
+
+  // start, stop = int(idx.start or 0), int(idx.stop or nbits)
+  {
+    int t, overflow;
+    PyObject *o;
+
+    t = PyObject_IsTrue( sl->start );
+    if ( t < 0 ) goto invalid;
+    if ( t ) {
+      o = to_pylong( sl->start );
+      if ( !o ) goto invalid;
+      *start = PyLong_AsLongLongAndOverflow( o, &overflow );
+      Py_DECREF( o );
+      if ( overflow || (*start == -1 && PyErr_Occurred()) ) goto invalid;
+    }
+    else *start = 0;
+
+    t = PyObject_IsTrue( sl->stop );
+    if ( t < 0 ) goto invalid;
+    if ( t ) {
+      o = to_pylong( sl->stop );
+      if ( !o ) goto invalid;
+      *stop = PyLong_AsLongLongAndOverflow( o, &overflow );
+      Py_DECREF( o );
+      if ( overflow || (*stop == -1 && PyErr_Occurred()) ) goto invalid;
+    }
+    else *stop = n;
+
+    valid = 0 <= *start && *start < *stop && *stop <= n;
+  }
+
+invalid:
+  if ( valid ) return 0;
+
+  PyErr_Clear();
+  PyErr_Format( PyExc_IndexError, "Invalid access: [%S:%S] in a Bits%d instance",
+                sl->start, sl->stop, n );
+  return -1;
+}
+
+/* Parse a single index as Bits does. Returns 0 on success, -1 on error */
+static int parse_index( BitsObject *self, PyObject *idx, long long *i ) {
+  int overflow;
+  PyObject *o = to_pylong( idx );
+  if ( !o ) return -1;
+
+  *i = PyLong_AsLongLongAndOverflow( o, &overflow );
+  if ( *i == -1 && PyErr_Occurred() ) { Py_DECREF( o ); return -1; }
+
+  if ( overflow || *i >= self->nbits || *i < 0 ) {
+    PyErr_Format( PyExc_IndexError, "Invalid access: [%S] in a Bits%d instance", o, self->nbits );
+    Py_DECREF( o );
+    return -1;
+  }
+  Py_DECREF( o );
+  return 0;
+}
+
+/* (value >> start) & upper[width] */
+static PyObject *extract( BitsObject *self, long long start, int width ) {
+  if ( IS_SMALL(self) )
+    return new_small( width, (self->u >> start) & mask64( width ) );
+
+  {
+    PyObject *sh = PyLong_FromLongLong( start ), *t, *r = NULL;
+    if ( !sh ) return NULL;
+    t = PyNumber_Rshift( self->big, sh );
+    Py_DECREF( sh );
+    if ( !t ) return NULL;
+    r = PyNumber_And( t, py_upper( width ) );
+    Py_DECREF( t );
+    return new_from_pylong( width, r );
+  }
+}
+
+static PyObject *bits_subscript( BitsObject *self, PyObject *idx ) {
+  long long start, stop, i;
+
+  if ( PySlice_Check( idx ) ) {
+    if ( parse_slice( self, idx, &start, &stop ) < 0 ) return NULL;
+    return extract( self, start, (int)(stop - start) );
+  }
+
+  if ( parse_index( self, idx, &i ) < 0 ) return NULL;
+  return extract( self, i, 1 );
+}
+
+/* Old-style sequence protocol so that Bits is iterable like the Python
+   implementation that only defines __getitem__ */
+static PyObject *bits_sq_item( BitsObject *self, Py_ssize_t i ) {
+  if ( i < 0 || i >= self->nbits ) {
+    PyErr_Format( PyExc_IndexError, "Invalid access: [%zd] in a Bits%d instance", i, self->nbits );
+    return NULL;
+  }
+  return extract( self, i, 1 );
+}
+
+/* self = (self & ~((1 << stop) - (1 << start))) | ((v & upper[stop-start]) << start)
+   v is a Python int, or NULL with vu holding the value if self is small */
+static int insert( BitsObject *self, long long start, long long stop, PyObject *v, uint64_t vu ) {
+  int width = (int)(stop - start);
+
+  if ( IS_SMALL(self) ) {
+    uint64_t m = mask64( width ) << start;
+    if ( v ) {
+      vu = PyLong_AsUnsignedLongLongMask( v );
+      if ( vu == (uint64_t)-1 && PyErr_Occurred() ) return -1;
+    }
+    self->u = (self->u & ~m) | ((vu << start) & m);
+    return 0;
+  }
+
+  {
+    PyObject *sh = NULL, *hole = NULL, *t = NULL, *r = NULL, *inv = NULL;
+    int ret = -1;
+
+    sh = PyLong_FromLongLong( start );
+    if ( !sh ) goto out;
+    // hole = upper[width] << start
+    hole = PyNumber_Lshift( py_upper( width ), sh );
+    if ( !hole ) goto out;
+    inv = PyNumber_Invert( hole );
+    if ( !inv ) goto out;
+    r = PyNumber_And( self->big, inv );
+    if ( !r ) goto out;
+    t = PyNumber_And( v, py_upper( width ) );
+    if ( !t ) goto out;
+    Py_SETREF( t, PyNumber_Lshift( t, sh ) );
+    if ( !t ) goto out;
+    Py_SETREF( r, PyNumber_Or( r, t ) );
+    if ( !r ) goto out;
+    Py_XSETREF( self->big, r );
+    r = NULL;
+    ret = 0;
+out:
+    Py_XDECREF( sh );
+    Py_XDECREF( hole );
+    Py_XDECREF( inv );
+    Py_XDECREF( t );
+    Py_XDECREF( r );
+    return ret;
+  }
+}
+
+static int bits_ass_subscript( BitsObject *self, PyObject *idx, PyObject *v ) {
+  long long start, stop, i;
+
+  if ( !v ) {
+    PyErr_SetString( PyExc_AttributeError, "__delitem__" );
+    return -1;
+  }
+
+  if ( PySlice_Check( idx ) ) {
+    int slice_nbits;
+    if ( parse_slice( self, idx, &start, &stop ) < 0 ) return -1;
+    slice_nbits = (int)(stop - start);
+
+    if ( Bits_Check(v) ) {
+      BitsObject *o = (BitsObject *) v;
+      PyObject   *ov;
+      int         r;
+      if ( o->nbits != slice_nbits ) {
+        if ( o->nbits < slice_nbits )
+          PyErr_Format( PyExc_ValueError, "Cannot fit a Bits%d object into a %d-bit slice [%lld:%lld]\n"
+                        "- Suggestion: sext/zext the RHS", o->nbits, slice_nbits, start, stop );
+        else
+          PyErr_Format( PyExc_ValueError, "Cannot fit a Bits%d object into a %d-bit slice [%lld:%lld]\n"
+                        "- Suggestion: trunc the RHS", o->nbits, slice_nbits, start, stop );
+        return -1;
+      }
+      if ( IS_SMALL(self) ) return insert( self, start, stop, NULL, o->u );
+      ov = bits_pyvalue( o );
+      if ( !ov ) return -1;
+      r = insert( self, start, stop, ov, 0 );
+      Py_DECREF( ov );
+      return r;
+    }
+    else {
+      // Cast to int
+      int r;
+      PyObject *iv = to_pylong( v );
+      if ( !iv ) return -1;
+      r = in_range( iv, slice_nbits, 1 );
+      if ( r == 0 ) range_error( RANGE_SLICE, iv, slice_nbits );
+      if ( r == 1 ) r = insert( self, start, stop, iv, 0 ) < 0 ? -1 : 1;
+      Py_DECREF( iv );
+      return r == 1 ? 0 : -1;
+    }
+  }
+
+  if ( parse_index( self, idx, &i ) < 0 ) return -1;
+
+  if ( Bits_Check(v) ) {
+    BitsObject *o = (BitsObject *) v;
+    uint64_t bit;
+    if ( o->nbits > 1 ) {
+      PyErr_Format( PyExc_ValueError, "Cannot fit a Bits%d object into the 1-bit slice", o->nbits );
+      return -1;
+    }
+    bit = o->u & 1;
+    if ( IS_SMALL(self) ) return insert( self, i, i+1, NULL, bit );
+    {
+      PyObject *ov = PyLong_FromUnsignedLongLong( bit );
+      int r;
+      if ( !ov ) return -1;
+      r = insert( self, i, i+1, ov, 0 );
+      Py_DECREF( ov );
+      return r;
+    }
+  }
+  else {
+    int overflow, r;
+    long long x;
+    PyObject *iv = to_pylong( v );
+    if ( !iv ) return -1;
+
+    x = PyLong_AsLongLongAndOverflow( iv, &overflow );
+    if ( x == -1 && PyErr_Occurred() ) { Py_DECREF( iv ); return -1; }
+    if ( overflow || x > 1 || x < -1 ) {
+      PyObject *hv = py_hex( iv );
+      if ( hv ) {
+        PyErr_Format( PyExc_ValueError, "Value %S is too big for the 1-bit slice!\n", hv );
+        Py_DECREF( hv );
+      }
+      Py_DECREF( iv );
+      return -1;
+    }
+    r = insert( self, i, i+1, iv, 0 );
+    Py_DECREF( iv );
+    return r;
+  }
+}
+
+//------------------------------------------------------------------------
+// Arithmetics
+//------------------------------------------------------------------------
+
+enum {
+  OP_ADD, OP_SUB, OP_MUL, OP_AND, OP_OR, OP_XOR,
+  OP_FLOORDIV, OP_MOD, OP_LSHIFT, OP_RSHIFT,
+};
+
+static const char *binop_desc[] = {
+  "'+' (add)", "'-' (sub)", "'*' (mul)", "'&' (and)", "'|' (or)", "'^' (xor)",
+  "'//' (div)", "'%' (mod)", "'<<' (lshift)", "'>>' (rshift)",
+};
+
+/* Get the other operand of a binop the way Bits does.
+
+   If check_bits, other may be Bits (or anything that has nbits) whose
+   bitwidth must match. Otherwise, or if other has no nbits, other is
+   cast to int and must be in [0, upper].
+
+   Returns 0 with *ou (small self) or *obig (new reference, big self)
+   set. Returns -1 on error, or 1 if eq_mode and other cannot be cast to
+   int. */
+static int binop_operand( BitsObject *self, PyObject *other, const char *desc, int check_bits,
+                          int eq_mode, uint64_t *ou, PyObject **obig ) {
+  int n = self->nbits, r;
+  PyObject *iv = NULL;
+
+  if ( check_bits ) {
+    if ( Bits_Check(other) ) {
+      BitsObject *o = (BitsObject *) other;
+      if ( o->nbits != n ) {
+        PyErr_Format( PyExc_ValueError, "Operands of %s operation must have matching bitwidth, "
+                      "but here Bits%d != Bits%d.\n", desc, n, o->nbits );
+        return -1;
+      }
+      if ( IS_SMALL(self) ) *ou = o->u;
+      else { Py_INCREF( o->big ); *obig = o->big; }
+      return 0;
+    }
+    else {
+      PyObject *o_nbits = PyObject_GetAttrString( other, "nbits" );
+      if ( o_nbits ) {
+        PyObject *py_n = PyLong_FromLong( n );
+        int ne;
+        if ( !py_n ) { Py_DECREF( o_nbits ); return -1; }
+        ne = PyObject_RichCompareBool( o_nbits, py_n, Py_NE );
+        Py_DECREF( py_n );
+        if ( ne ) {
+          if ( ne > 0 )
+            PyErr_Format( PyExc_ValueError, "Operands of %s operation must have matching bitwidth, "
+                          "but here Bits%d != Bits%S.\n", desc, n, o_nbits );
+          Py_DECREF( o_nbits );
+          return -1;
+        }
+        Py_DECREF( o_nbits );
+
+        iv = PyObject_GetAttrString( other, "_uint" );
+        if ( iv ) goto have_value;
+      }
+      if ( !clear_attribute_error() ) return -1;
+    }
+  }
+
+  iv = to_pylong( other );
+  if ( !iv ) {
+    if ( eq_mode ) { PyErr_Clear(); return 1; }
+    return -1;
+  }
+  r = in_range( iv, n, 0 );
+  if ( r != 1 ) {
+    if ( r == 0 ) range_error( RANGE_BINOP, iv, n );
+    Py_DECREF( iv );
+    return -1;
+  }
+
+have_value:
+  if ( IS_SMALL(self) ) {
+    *ou = PyLong_AsUnsignedLongLongMask( iv );
+    Py_DECREF( iv );
+    if ( *ou == (uint64_t)-1 && PyErr_Occurred() ) return -1;
+  }
+  else *obig = iv;
+  return 0;
+}
+
+/* Let Python raise the ZeroDivisionError with the same message */
+static PyObject *zero_division( int op ) {
+  PyObject *r;
+  if ( op == OP_MOD ) r = PyNumber_Remainder( py_zero, py_zero );
+  else                r = PyNumber_FloorDivide( py_zero, py_zero );
+  Py_XDECREF( r );
+  return NULL;
+}
+
+static PyObject *big_binop( BitsObject *self, PyObject *sv, PyObject *ov, int op, int reflected ) {
+  int n = self->nbits;
+  PyObject *r = NULL;
+
+  switch ( op ) {
+    case OP_ADD: r = PyNumber_Add( sv, ov ); break;
+    case OP_SUB: r = reflected ? PyNumber_Subtract( ov, sv ) : PyNumber_Subtract( sv, ov ); break;
+    case OP_MUL: r = PyNumber_Multiply( sv, ov ); break;
+    case OP_AND: r = PyNumber_And( sv, ov ); break;
+    case OP_OR:  r = PyNumber_Or( sv, ov ); break;
+    case OP_XOR: r = PyNumber_Xor( sv, ov ); break;
+    case OP_FLOORDIV:
+      r = reflected ? PyNumber_FloorDivide( ov, sv ) : PyNumber_FloorDivide( sv, ov ); break;
+    case OP_MOD:
+      r = reflected ? PyNumber_Remainder( ov, sv ) : PyNumber_Remainder( sv, ov ); break;
+    case OP_LSHIFT: {
+      PyObject *py_n = PyLong_FromLong( n );
+      int ge;
+      if ( !py_n ) return NULL;
+      ge = PyObject_RichCompareBool( ov, py_n, Py_GE );
+      Py_DECREF( py_n );
+      if ( ge < 0 ) return NULL;
+      if ( ge ) { Py_INCREF( py_zero ); return new_big( n, py_zero ); }
+      r = PyNumber_Lshift( sv, ov );
+      break;
+    }
+    case OP_RSHIFT: r = PyNumber_Rshift( sv, ov ); break;
+  }
+  if ( !r ) return NULL;
+
+  // Results of and/or/xor/div/mod/rshift never exceed upper
+  if ( op == OP_ADD || op == OP_SUB || op == OP_MUL || op == OP_LSHIFT )
+    Py_SETREF( r, PyNumber_And( r, py_upper( n ) ) );
+  return new_big( n, r );
+}
+
+static PyObject *bits_binop( PyObject *a, PyObject *b, int op ) {
+  BitsObject *self;
+  PyObject   *other, *obig = NULL;
+  uint64_t    ou = 0, u, m, r;
+  int         reflected, n;
+
+  if ( Bits_Check(a) ) { self = (BitsObject *) a; other = b; reflected = 0; }
+  else                 { self = (BitsObject *) b; other = a; reflected = 1; }
+
+  // Bits doesn't define __rlshift__ and __rrshift__
+  if ( reflected && ( op == OP_LSHIFT || op == OP_RSHIFT ) )
+    Py_RETURN_NOTIMPLEMENTED;
+
+  // __rsub__, __rfloordiv__ and __rmod__ only take ints
+  if ( binop_operand( self, other, binop_desc[op],
+                      !( reflected && ( op == OP_SUB || op == OP_FLOORDIV || op == OP_MOD ) ),
+                      0, &ou, &obig ) < 0 )
+    return NULL;
+
+  n = self->nbits;
+
+  if ( !IS_SMALL(self) ) {
+    PyObject *ret = big_binop( self, self->big, obig, op, reflected );
+    Py_DECREF( obig );
+    return ret;
+  }
+
+  u = self->u;
+  m = mask64( n );
+
+  switch ( op ) {
+    case OP_ADD: r = (u + ou) & m; break;
+    case OP_SUB: r = ( reflected ? ou - u : u - ou ) & m; break;
+    case OP_MUL: r = (u * ou) & m; break;
+    case OP_AND: r = u & ou; break;
+    case OP_OR:  r = u | ou; break;
+    case OP_XOR: r = u ^ ou; break;
+    case OP_FLOORDIV:
+      if ( reflected ) { if ( !u  ) return zero_division( op ); r = ou / u; }
+      else             { if ( !ou ) return zero_division( op ); r = u / ou; }
+      break;
+    case OP_MOD:
+      if ( reflected ) { if ( !u  ) return zero_division( op ); r = ou % u; }
+      else             { if ( !ou ) return zero_division( op ); r = u % ou; }
+      break;
+    case OP_LSHIFT: r = ou >= (uint64_t) n ? 0 : (u << ou) & m; break;
+    case OP_RSHIFT: r = ou >= 64 ? 0 : u >> ou; break;
+    default: r = 0;
+  }
+  return new_small( n, r );
+}
+
+static PyObject *bits_add( PyObject *a, PyObject *b )      { return bits_binop( a, b, OP_ADD ); }
+static PyObject *bits_sub( PyObject *a, PyObject *b )      { return bits_binop( a, b, OP_SUB ); }
+static PyObject *bits_mul( PyObject *a, PyObject *b )      { return bits_binop( a, b, OP_MUL ); }
+static PyObject *bits_and( PyObject *a, PyObject *b )      { return bits_binop( a, b, OP_AND ); }
+static PyObject *bits_or( PyObject *a, PyObject *b )       { return bits_binop( a, b, OP_OR ); }
+static PyObject *bits_xor( PyObject *a, PyObject *b )      { return bits_binop( a, b, OP_XOR ); }
+static PyObject *bits_floordiv( PyObject *a, PyObject *b ) { return bits_binop( a, b, OP_FLOORDIV ); }
+static PyObject *bits_mod( PyObject *a, PyObject *b )      { return bits_binop( a, b, OP_MOD ); }
+static PyObject *bits_lshift( PyObject *a, PyObject *b )   { return bits_binop( a, b, OP_LSHIFT ); }
+static PyObject *bits_rshift( PyObject *a, PyObject *b )   { return bits_binop( a, b, OP_RSHIFT ); }
+
+static PyObject *bits_invert( BitsObject *self ) {
+  PyObject *r;
+  if ( IS_SMALL(self) ) return new_small( self->nbits, ~self->u & mask64( self->nbits ) );
+  r = PyNumber_Invert( self->big );
+  if ( !r ) return NULL;
+  Py_SETREF( r, PyNumber_And( r, py_upper( self->nbits ) ) );
+  return new_big( self->nbits, r );
+}
+
+static int bits_bool( BitsObject *self ) {
+  if ( IS_SMALL(self) ) return self->u != 0;
+  return PyObject_IsTrue( self->big );
+}
+
+static PyObject *bits_int( BitsObject *self ) {
+  return bits_pyvalue( self );
+}
+
+//------------------------------------------------------------------------
+// Comparisons
+//------------------------------------------------------------------------
+
+static PyObject *bits_richcompare( PyObject *a, PyObject *b, int op ) {
+  static const char *desc[] = { "'<' (lt)", "'<=' (le)", "'==' (eq)", "", "'>' (gt)", "'>=' (ge)" };
+  BitsObject *self = (BitsObject *) a;
+  PyObject   *obig = NULL;
+  uint64_t    ou   = 0;
+  int         cmp_op = op == Py_NE ? Py_EQ : op;
+  int         r, res;
+
+  // No need for __ne__: the default one returns "not (self == other)"
+  r = binop_operand( self, b, desc[cmp_op], 1, cmp_op == Py_EQ, &ou, &obig );
+  if ( r < 0 ) return NULL;
+
+  if ( r == 1 ) res = 0;
+  else if ( IS_SMALL(self) ) {
+    uint64_t u = self->u;
+    switch ( cmp_op ) {
+      case Py_LT: res = u <  ou; break;
+      case Py_LE: res = u <= ou; break;
+      case Py_EQ: res = u == ou; break;
+      case Py_GT: res = u >  ou; break;
+      default:    res = u >= ou; break;
+    }
+  }
+  else {
+    res = PyObject_RichCompareBool( self->big, obig, cmp_op );
+    Py_DECREF( obig );
+    if ( res < 0 ) return NULL;
+  }
+
+  if ( op == Py_NE ) return PyBool_FromLong( !res );
+  return new_small( 1, res );
+}
+
+static Py_hash_t bits_hash( BitsObject *self ) {
+  Py_hash_t h;
+  PyObject *v = bits_pyvalue( self ), *t;
+  if ( !v ) return -1;
+  t = Py_BuildValue( "(iN)", self->nbits, v );
+  if ( !t ) return -1;
+  h = PyObject_Hash( t );
+  Py_DECREF( t );
+  return h;
+}
+
+//------------------------------------------------------------------------
+// Methods
+//------------------------------------------------------------------------
+
+static PyObject *bits_get_nbits( BitsObject *self, void *closure ) {
+  return PyLong_FromLong( self->nbits );
+}
+
+static PyObject *bits_uint( BitsObject *self, PyObject *Py_UNUSED(ignored) ) {
+  return bits_pyvalue( self );
+}
+
+static PyObject *bits_signed_int( BitsObject *self, PyObject *Py_UNUSED(ignored) ) {
+  int n = self->nbits;
+
+  if ( IS_SMALL(self) ) {
+    if ( n < 64 && ( self->u >> (n-1) ) )
+      return PyLong_FromLongLong( (long long) self->u - ((long long)1 << n) );
+    if ( n == 64 ) return PyLong_FromLongLong( (long long) self->u );
+    return PyLong_FromUnsignedLongLong( self->u );
+  }
+
+  {
+    PyObject *sh = PyLong_FromLong( n-1 ), *t;
+    int neg;
+    if ( !sh ) return NULL;
+    t = PyNumber_Rshift( self->big, sh );
+    Py_DECREF( sh );
+    if ( !t ) return NULL;
+    neg = PyObject_IsTrue( t );
+    Py_DECREF( t );
+    if ( neg < 0 ) return NULL;
+    if ( !neg ) { Py_INCREF( self->big ); return self->big; }
+
+    t = py_one_shl( n );
+    if ( !t ) return NULL;
+    Py_SETREF( t, PyNumber_Subtract( self->big, t ) );
+    return t;
+  }
+}
+
+/* format( value, spec ).zfill( width ) with prefix */
+static PyObject *format_value( BitsObject *self, char spec, int width, const char *prefix ) {
+  if ( IS_SMALL(self) && spec != 'b' ) {
+    char buf[32];
+    snprintf( buf, sizeof(buf), spec == 'x' ? "%s%0*llx" : "%s%0*llo",
+              prefix, width, (unsigned long long) self->u );
+    return PyUnicode_FromString( buf );
+  }
+
+  if ( IS_SMALL(self) ) {
+    char buf[80];
+    int  plen = (int) strlen( prefix ), i;
+    memcpy( buf, prefix, plen );
+    for ( i = 0; i < width; i++ )
+      buf[plen+i] = ( self->u >> (width-1-i) ) & 1 ? '1' : '0';
+    buf[plen+width] = 0;
+    return PyUnicode_FromString( buf );
+  }
+
+  {
+    char fmt[2] = { spec, 0 };
+    PyObject *f = PyUnicode_FromString( fmt ), *s, *z;
+    if ( !f ) return NULL;
+    s = PyObject_Format( self->big, f );
+    Py_DECREF( f );
+    if ( !s ) return NULL;
+    z = PyObject_CallMethod( s, "zfill", "i", width );
+    Py_DECREF( s );
+    if ( !z || !prefix[0] ) return z;
+    Py_SETREF( z, PyUnicode_FromFormat( "%s%U", prefix, z ) );
+    return z;
+  }
+}
+
+static PyObject *bits_repr( BitsObject *self ) {
+  PyObject *s = format_value( self, 'x', ((self->nbits-1)/4)+1, "" ), *r;
+  if ( !s ) return NULL;
+  r = PyUnicode_FromFormat( "Bits%d(0x%U)", self->nbits, s );
+  Py_DECREF( s );
+  return r;
+}
+
+static PyObject *bits_str( BitsObject *self ) {
+  return format_value( self, 'x', ((self->nbits-1)/4)+1, "" );
+}
+
+static PyObject *bits_bin( BitsObject *self, PyObject *Py_UNUSED(ignored) ) {
+  return format_value( self, 'b', self->nbits, "0b" );
+}
+
+static PyObject *bits_oct( BitsObject *self, PyObject *Py_UNUSED(ignored) ) {
+  return format_value( self, 'o', ((self->nbits-1)/3)+1, "0o" );
+}
+
+static PyObject *bits_hex( BitsObject *self, PyObject *Py_UNUSED(ignored) ) {
+  return format_value( self, 'x', ((self->nbits-1)/4)+1, "0x" );
+}
+
+static PyObject *bits_reduce( BitsObject *self, PyObject *Py_UNUSED(ignored) ) {
+  PyObject *v = bits_pyvalue( self );
+  if ( !v ) return NULL;
+  if ( Py_TYPE(self) == BitsType )
+    return Py_BuildValue( "(O(iN))", (PyObject *) BitsType, self->nbits, v );
+  return Py_BuildValue( "(O(N))", (PyObject *) Py_TYPE(self), v );
+}
+
+static PyMethodDef bits_methods[] = {
+  { "_flip",        (PyCFunction) bits_flip,       METH_NOARGS, NULL },
+  { "clone",        (PyCFunction) bits_clone,      METH_NOARGS, NULL },
+  { "__deepcopy__", (PyCFunction) bits_deepcopy,   METH_O,      NULL },
+  { "to_bits",      (PyCFunction) bits_to_bits,    METH_NOARGS, NULL },
+  { "int",          (PyCFunction) bits_signed_int, METH_NOARGS, NULL },
+  { "uint",         (PyCFunction) bits_uint,       METH_NOARGS, NULL },
+  { "bin",          (PyCFunction) bits_bin,        METH_NOARGS, NULL },
+  { "oct",          (PyCFunction) bits_oct,        METH_NOARGS, NULL },
+  { "hex",          (PyCFunction) bits_hex,        METH_NOARGS, NULL },
+  { "__reduce__",   (PyCFunction) bits_reduce,     METH_NOARGS, NULL },
+  { NULL }
+};
+
+static PyGetSetDef bits_getset[] = {
+  { "nbits", (getter) bits_get_nbits, NULL, NULL, NULL },
+  { NULL }
+};
+
+// A heap type, because resetting the __name__ of a heap type also resets
+// its tp_name, so that error messages name it 'Bits' like the Python
+// implementation does instead of 'pymtl3.datatypes.CBits.Bits' 
+
+static PyType_Slot bits_slots[] = {
+  { Py_tp_new,                   bits_new },
+  { Py_tp_dealloc,               bits_dealloc },
+  { Py_tp_repr,                  bits_repr },
+  { Py_tp_str,                   bits_str },
+  { Py_tp_hash,                  bits_hash },
+  { Py_tp_richcompare,           bits_richcompare },
+  { Py_tp_methods,               bits_methods },
+  { Py_tp_getset,                bits_getset },
+  { Py_nb_add,                   bits_add },
+  { Py_nb_subtract,              bits_sub },
+  { Py_nb_multiply,              bits_mul },
+  { Py_nb_remainder,             bits_mod },
+  { Py_nb_floor_divide,          bits_floordiv },
+  { Py_nb_lshift,                bits_lshift },
+  { Py_nb_rshift,                bits_rshift },
+  { Py_nb_and,                   bits_and },
+  { Py_nb_xor,                   bits_xor },
+  { Py_nb_or,                    bits_or },
+  { Py_nb_invert,                bits_invert },
+  { Py_nb_bool,                  bits_bool },
+  { Py_nb_int,                   bits_int },
+  { Py_nb_index,                 bits_int },
+  { Py_nb_inplace_lshift,        bits_ilshift },
+  { Py_nb_inplace_matrix_multiply, bits_imatmul },
+  { Py_mp_subscript,             bits_subscript },
+  { Py_mp_ass_subscript,         bits_ass_subscript },
+  { Py_sq_item,                  bits_sq_item },
+  { 0, NULL },
+};
+
+static PyType_Spec bits_spec = {
+  .name      = "pymtl3.datatypes.CBits.Bits",
+  .basicsize = sizeof(BitsObject),
+  .flags     = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE,
+  .slots     = bits_slots,
+};
+
+static struct PyModuleDef cbits_module = {
+  PyModuleDef_HEAD_INIT,
+  .m_name = "pymtl3.datatypes.CBits",
+  .m_doc  = "CPython extension implementation of PyMTL Bits",
+  .m_size = -1,
+};
+
+PyMODINIT_FUNC PyInit_CBits( void ) {
+  PyObject *m, *name;
+
+  py_zero = PyLong_FromLong( 0 );
+  if ( !py_zero ) return NULL;
+
+  m = PyModule_Create( &cbits_module );
+  if ( !m ) return NULL;
+
+  name = PyUnicode_FromString( "Bits" );
+  if ( !name ) { Py_DECREF( m ); return NULL; }
+
+  BitsType = (PyTypeObject *) PyType_FromSpec( &bits_spec );
+  if ( !BitsType ||
+       PyObject_SetAttrString( (PyObject *) BitsType, "__name__", name ) < 0 ) {
+    Py_XDECREF( BitsType );
+    Py_DECREF( name );
+    Py_DECREF( m );
+    return NULL;
+  }
+  Py_DECREF( name );
+
+  Py_INCREF( BitsType );
+  if ( PyModule_AddObject( m, "Bits", (PyObject *) BitsType ) < 0 ) {
+    Py_DECREF( BitsType );
+    Py_DECREF( m );
+    return NULL;
+  }
+  return m;
+}
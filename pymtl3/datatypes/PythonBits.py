@@ -8,7 +8,7 @@ Author : Shunning Jiang
 Date   : Oct 31, 2017
 """
 
-from ..energy.energy_plugin import *
+import os
 
 # lower <= value <= upper
 _upper = [ 0,  1 ]
@@ -18,6 +18,20 @@ for i in range(2, 8193):
   _upper.append( (_upper[i-1] << 1) + 1 )
   _lower.append(  _lower[i-1] << 1      )
 
+def _binop_operand( nbits, other, op ):
+  try:
+    if other.nbits != nbits:
+      raise ValueError( f"Operands of {op} operation must have matching bitwidth, "\
+                        f"but here Bits{nbits} != Bits{other.nbits}.\n" )
+    return other._uint
+  except AttributeError:
+    other = int(other)
+    up = _upper[ nbits ]
+    if other < 0 or other > up:
+      raise ValueError( f"Integer {hex(other)} is not a valid binop operand with Bits{nbits}!\n"
+                        f"Suggestion: 0 <= x <= {hex(up)}" )
+    return other
+
 object_new = object.__new__
 def _new_valid_bits( nbits, uint):
   ret = object_new( Bits )
@@ -25,8 +39,17 @@ def _new_valid_bits( nbits, uint):
   ret._uint  = uint
   return ret
 
+# _version counts how many times the value of a Bits object has been
+# changed by @=, <<= (at _flip) or a slice assignment, which are the ways
+# to update a signal in place. Checking whether a signal changed is then
+# an integer comparison instead of cloning and comparing the value, and
+# the counter doubles as the toggle count of the signal. Only objects
+# created by the constructor start from 0 since it is not worth a store
+# in every arithmetic operation; the other ones start counting at their
+# first change.
+
 class Bits:
-  __slots__ = ( "_nbits", "_uint", "_next" )
+  __slots__ = ( "_nbits", "_uint", "_next", "_version" )
 
   @property
   def nbits( self ):
@@ -37,6 +60,7 @@ class Bits:
     if nbits < 1 or nbits >= 8193: raise ValueError(f"Only support 1 <= nbits < 8193, not {nbits}")
 
     self._nbits = nbits
+    self._version = 0
 
     if isinstance( v, Bits ):
       if nbits != v.nbits:
@@ -88,7 +112,13 @@ class Bits:
     return self
 
   def _flip( self ):
-    self._uint = self._next
+    uint = self._next
+    if self._uint != uint:
+      self._uint = uint
+      try:
+        self._version += 1
+      except AttributeError:
+        self._version = 1
 
   def clone( self ):
     return _new_valid_bits( self._nbits, self._uint)
@@ -109,7 +139,7 @@ class Bits:
           raise ValueError( f"Bitwidth of LHS must be equal to RHS during @= blocking assignment, " \
                             f"but here LHS Bits{nbits} < RHS Bits{v.nbits}.\n"
                             f"- Suggestion: LHS @= trunc(RHS, nbits/Type)" )
-      self._uint = v.to_bits()._uint
+      uint = v.to_bits()._uint
     except AttributeError:
       # Cast to int
       v = int(v)
@@ -120,7 +150,14 @@ class Bits:
       if v < lo or v > up:
         raise ValueError( f"RHS value {hex(v)} of @= is too wide for LHS Bits{nbits}!\n" \
                           f"(Bits{nbits} only accepts {hex(lo)} <= value <= {hex(up)})" )
-      self._uint = v & up
+      uint = v & up
+
+    if self._uint != uint:
+      self._uint = uint
+      try:
+        self._version += 1
+      except AttributeError:
+        self._version = 1
 
     return self
 
@@ -172,8 +209,8 @@ class Bits:
             raise ValueError( f"Cannot fit a Bits{v.nbits} object into a {slice_nbits}-bit slice [{start}:{stop}]\n"
                               f"- Suggestion: trunc the RHS")
 
-        self._uint = (sv & (~((1 << stop) - (1 << start)))) | \
-                     ((v._uint & _upper[slice_nbits]) << start)
+        uint = (sv & (~((1 << stop) - (1 << start)))) | \
+               ((v._uint & _upper[slice_nbits]) << start)
       else:
         # Cast to int
         v = int(v)
@@ -184,23 +221,29 @@ class Bits:
           raise ValueError( f"Cannot fit {v} into a Bits{slice_nbits} slice\n" \
                             f"(Bits{slice_nbits} only accepts {hex(lo)} <= value <= {hex(up)})" )
 
-        self._uint = (sv & (~((1 << stop) - (1 << start)))) | \
-                     ((v & _upper[slice_nbits]) << start)
-      return
+        uint = (sv & (~((1 << stop) - (1 << start)))) | \
+               ((v & _upper[slice_nbits]) << start)
+    else:
+      i = int(idx)
+      if i >= self._nbits or i < 0:
+        raise IndexError( f"Invalid access: [{i}] in a Bits{self._nbits} instance" )
 
-    i = int(idx)
-    if i >= self._nbits or i < 0:
-      raise IndexError( f"Invalid access: [{i}] in a Bits{self._nbits} instance" )
+      if isinstance( v, Bits ):
+        if v.nbits > 1:
+          raise ValueError( f"Cannot fit a Bits{v.nbits} object into the 1-bit slice" )
+        uint = (sv & ~(1 << i)) | ((v._uint & 1) << i)
+      else:
+        v = int(v)
+        if abs(v) > 1:
+          raise ValueError( f"Value {hex(v)} is too big for the 1-bit slice!\n" )
+        uint = (sv & ~(1 << i)) | ((int(v) & 1) << i)
 
-    if isinstance( v, Bits ):
-      if v.nbits > 1:
-        raise ValueError( f"Cannot fit a Bits{v.nbits} object into the 1-bit slice" )
-      self._uint = (sv & ~(1 << i)) | ((v._uint & 1) << i)
-    else:
-      v = int(v)
-      if abs(v) > 1:
-        raise ValueError( f"Value {hex(v)} is too big for the 1-bit slice!\n" )
-      self._uint = (sv & ~(1 << i)) | ((int(v) & 1) << i)
+    if sv != uint:
+      self._uint = uint
+      try:
+        self._version += 1
+      except AttributeError:
+        self._version = 1
 
   def __add__( self, other ):
     nbits = self._nbits
@@ -208,85 +251,32 @@ class Bits:
       if other.nbits != nbits:
         raise ValueError( f"Operands of '+' (add) operation must have matching bitwidth, "\
                           f"but here Bits{nbits} != Bits{other.nbits}.\n" )
-
-
-      result = (self._uint + other._uint) & _upper[nbits]
-
-      if self._uint != 0 and other._uint != 0:
-        valid_bits = 0
-        max_value = 2 ** (nbits-1)
-        result_tmp = result if result < max_value else max_value*2-result
-        while result_tmp != 0:
-          result_tmp = int(result_tmp / 2)
-          valid_bits += 1
-
-        update_energy("add", valid_bits)
-
-      return _new_valid_bits( nbits, result )
+      return _new_valid_bits( nbits, (self._uint + other._uint) & _upper[nbits] )
     except AttributeError:
       other = int(other)
       up = _upper[ nbits ]
       if other < 0 or other > up:
         raise ValueError( f"Integer {hex(other)} is not a valid binop operand with Bits{nbits}!\n"
                           f"Suggestion: 0 <= x <= {hex(up)}" )
-
-      result = (self._uint + other) & up
-
-      if self._uint != 0 and other != 0:
-
-        valid_bits = 0
-        max_value = 2 ** (nbits-1)
-        result_tmp = result if result < max_value else max_value*2-result
-        while result_tmp != 0:
-          result_tmp = int(result_tmp / 2)
-          valid_bits += 1
-
-        update_energy("add", valid_bits)
-
-      return _new_valid_bits( nbits, result)
+      return _new_valid_bits( nbits, (self._uint + other) & up )
 
   def __radd__( self, other ):
     return self.__add__( other )
 
   def __sub__( self, other ):
     nbits = self._nbits
-
     try:
       if other.nbits != nbits:
         raise ValueError( f"Operands of '-' (sub) operation must have matching bitwidth, "\
                           f"but here Bits{nbits} != Bits{other.nbits}.\n" )
-
-      result = (self._uint - other._uint) & _upper[nbits]
-
-      if self._uint != 0 and other._uint != 0:
-        valid_bits = 0
-        max_value = 2 ** (nbits-1)
-        result_tmp = result if result < max_value else max_value*2-result
-        while result_tmp != 0:
-          result_tmp = int(result_tmp / 2)
-          valid_bits += 1
-        update_energy("sub", valid_bits)
-
-      return _new_valid_bits( nbits, result )
+      return _new_valid_bits( nbits, (self._uint - other._uint) & _upper[nbits] )
     except AttributeError:
       other = int(other)
       up = _upper[ nbits ]
       if other < 0 or other > up:
         raise ValueError( f"Integer {hex(other)} is not a valid binop operand with Bits{nbits}!\n"
                           f"Suggestion: 0 <= x <= {hex(up)}" )
-
-      result = (self._uint - other) & up
-
-      if self._uint != 0 and other != 0:
-        valid_bits = 0
-        max_value = 2 ** (nbits-1)
-        result_tmp = result if result < max_value else max_value*2-result
-        while result_tmp != 0:
-          result_tmp = int(result_tmp / 2)
-          valid_bits += 1
-        update_energy("sub", valid_bits)
-
-      return _new_valid_bits( nbits, result )
+      return _new_valid_bits( nbits, (self._uint - other) & up )
 
   def __rsub__( self, other ):
     nbits = self._nbits
@@ -300,45 +290,18 @@ class Bits:
 
   def __mul__( self, other ):
     nbits = self._nbits
-
     try:
       if other.nbits != nbits:
         raise ValueError( f"Operands of '*' (mul) operation must have matching bitwidth, "\
                           f"but here Bits{nbits} != Bits{other.nbits}.\n" )
-
-      result = (self._uint * other._uint) & _upper[nbits]
-
-      if self._uint != 0 and other._uint != 0:
-        valid_bits = 0
-        max_value = 2 ** (nbits-1)
-        result_tmp = result if result < max_value else max_value*2-result
-        while result_tmp != 0:
-          result_tmp = int(result_tmp / 2)
-          valid_bits += 1
-
-        update_energy("mul", valid_bits)
-
-      return _new_valid_bits( nbits, result)
+      return _new_valid_bits( nbits, (self._uint * other._uint) & _upper[nbits] )
     except AttributeError:
       other = int(other)
       up = _upper[ nbits ]
       if other < 0 or other > up:
         raise ValueError( f"Integer {hex(other)} is not a valid binop operand with Bits{nbits}!\n"
                           f"Suggestion: 0 <= x <= {hex(up)}" )
-
-      result = (self._uint * other) & up
-
-      if self._uint != 0 and other != 0:
-        valid_bits = 0
-        max_value = 2 ** (nbits-1)
-        result_tmp = result if result < max_value else max_value*2-result
-        while result_tmp != 0:
-          result_tmp = int(result_tmp / 2)
-          valid_bits += 1
-
-        update_energy("mul", valid_bits)
-
-      return _new_valid_bits( nbits, result)
+      return _new_valid_bits( nbits, (self._uint * other) & up )
 
   def __rmul__( self, other ):
     return self.__mul__( other )
@@ -383,7 +346,7 @@ class Bits:
     nbits = self._nbits
     try:
       if other.nbits != nbits:
-        raise ValueError( f"Operands of  '^' (xor) operation must have matching bitwidth, "\
+        raise ValueError( f"Operands of '^' (xor) operation must have matching bitwidth, "\
                           f"but here Bits{nbits} != Bits{other.nbits}.\n" )
       return _new_valid_bits( nbits, self._uint ^ other._uint )
     except AttributeError:
@@ -479,6 +442,69 @@ class Bits:
                           f"Suggestion: 0 <= x <= {hex(_upper[ nbits ])}" )
       return _new_valid_bits( nbits, self._uint >> other )
 
+  # In-place operators reuse self instead of allocating a new Bits when
+  # self is an unshared temporary, i.e. nothing else but the target of
+  # the augmented assignment refers to it (see _inplace_refcnt below).
+  # Otherwise they fall back to the regular operators. <<= and @= are
+  # assignments in PyMTL so there is no in-place lshift.
+
+  def __iadd__( self, other ):
+    if _getrefcount( self ) > _inplace_refcnt:
+      return self.__add__( other )
+    nbits = self._nbits
+    self._uint = (self._uint + _binop_operand( nbits, other, "'+' (add)" )) & _upper[nbits]
+    return self
+
+  def __isub__( self, other ):
+    if _getrefcount( self ) > _inplace_refcnt:
+      return self.__sub__( other )
+    nbits = self._nbits
+    self._uint = (self._uint - _binop_operand( nbits, other, "'-' (sub)" )) & _upper[nbits]
+    return self
+
+  def __imul__( self, other ):
+    if _getrefcount( self ) > _inplace_refcnt:
+      return self.__mul__( other )
+    nbits = self._nbits
+    self._uint = (self._uint * _binop_operand( nbits, other, "'*' (mul)" )) & _upper[nbits]
+    return self
+
+  def __iand__( self, other ):
+    if _getrefcount( self ) > _inplace_refcnt:
+      return self.__and__( other )
+    self._uint &= _binop_operand( self._nbits, other, "'&' (and)" )
+    return self
+
+  def __ior__( self, other ):
+    if _getrefcount( self ) > _inplace_refcnt:
+      return self.__or__( other )
+    self._uint |= _binop_operand( self._nbits, other, "'|' (or)" )
+    return self
+
+  def __ixor__( self, other ):
+    if _getrefcount( self ) > _inplace_refcnt:
+      return self.__xor__( other )
+    self._uint ^= _binop_operand( self._nbits, other, "'^' (xor)" )
+    return self
+
+  def __ifloordiv__( self, other ):
+    if _getrefcount( self ) > _inplace_refcnt:
+      return self.__floordiv__( other )
+    self._uint //= _binop_operand( self._nbits, other, "'//' (div)" )
+    return self
+
+  def __imod__( self, other ):
+    if _getrefcount( self ) > _inplace_refcnt:
+      return self.__mod__( other )
+    self._uint %= _binop_operand( self._nbits, other, "'%' (mod)" )
+    return self
+
+  def __irshift__( self, other ):
+    if _getrefcount( self ) > _inplace_refcnt:
+      return self.__rshift__( other )
+    self._uint >>= _binop_operand( self._nbits, other, "'>>' (rshift)" )
+    return self
+
   def __eq__( self, other ):
     nbits = self._nbits
     try:
@@ -595,3 +621,149 @@ class Bits:
   def hex( self ):
     str = "{:x}".format(int(self._uint)).zfill(((self._nbits-1)//4)+1)
     return "0x"+str
+
+#-------------------------------------------------------------------------
+# In-place operators
+#-------------------------------------------------------------------------
+# _inplace_refcnt is the reference count an in-place operator sees for
+# self when self is only referred to by the target of the augmented
+# assignment, e.g. a local variable, an attribute or a list element. In
+# that case updating self is indistinguishable from binding the target
+# to a new object. We measure it instead of hardcoding it because it
+# varies across CPython versions. Without reference counts (PyPy) the
+# in-place operators are removed so that Python falls back to the
+# regular ones.
+
+_inplace_binops = ( "__iadd__", "__isub__", "__imul__", "__iand__", "__ior__",
+                    "__ixor__", "__ifloordiv__", "__imod__", "__irshift__" )
+
+try:
+  from sys import getrefcount as _getrefcount
+
+  class _RefcntProbe:
+    def __iadd__( self, other ):
+      return _getrefcount( self )
+
+  def _measure_inplace_refcnt():
+    x = _RefcntProbe()
+    x += 0
+    return x
+
+  _inplace_refcnt = _measure_inplace_refcnt()
+
+except ImportError:
+  for _name in _inplace_binops:
+    delattr( Bits, _name )
+
+#-------------------------------------------------------------------------
+# Energy tracking
+#-------------------------------------------------------------------------
+# The operators above don't account for energy at all. Energy-aware
+# add/sub/mul are only swapped into Bits when energy tracking is enabled
+# either by PYMTL_ENERGY=1 (PYMTL_ENERGY=toggle for the toggle activity
+# model) or by enable_energy_tracking(), which is what EnergyTrackingPass
+# does. The energy plugin (and scipy) is only imported at that point.
+
+def _valid_bits( nbits, result ):
+  # The number of significant bits of result as a two's complement number
+  up = _upper[nbits]
+  if result > (up >> 1):
+    result = up + 1 - result
+  return result.bit_length()
+
+def _popcount( v ):
+  return bin(v).count("1")
+
+def _mk_energy_binop( name, binop, toggle_activity ):
+  from ..energy.energy_plugin import _energy_scope, get_energy_table
+
+  table = get_energy_table( name )
+  scope = _energy_scope
+
+  if not toggle_activity:
+    def energy_binop( self, other ):
+      ret    = binop( self, other )
+      charge = scope[0]
+      if charge is not None and self._uint != 0 and other:
+        charge( name, table[ _valid_bits( ret._nbits, ret._uint ) ] )
+      return ret
+
+  else:
+    # The data activity of an operation is the Hamming distance between
+    # the operands and the previous operands of the same kind of
+    # operation in the same component, normalized by the number of
+    # operand bits.
+    last_operands = {}
+
+    def energy_binop( self, other ):
+      ret    = binop( self, other )
+      charge = scope[0]
+      if charge is not None and self._uint != 0 and other:
+        nbits = ret._nbits
+        a, b  = self._uint, int(other)
+        last_a, last_b = last_operands.get( charge, (0, 0) )
+        last_operands[ charge ] = (a, b)
+
+        data_activity = (_popcount( a ^ last_a ) + _popcount( b ^ last_b )) / (nbits << 1)
+        charge( name, table[ _valid_bits( nbits, ret._uint ) ] * data_activity )
+      return ret
+
+  energy_binop.__name__ = binop.__name__
+  return energy_binop
+
+_plain_binops = {
+  "add": Bits.__add__,
+  "sub": Bits.__sub__,
+  "mul": Bits.__mul__,
+}
+
+# In-place add/sub/mul would bypass the energy-aware operators, so they
+# are replaced by them while energy tracking is enabled
+_plain_inplace_binops = {
+  name: Bits.__dict__.get( f"__i{name}__" ) for name in _plain_binops
+}
+
+# Every user of energy tracking holds a handle. The plain operators are
+# restored when the last handle is released.
+_energy_tracking_handles = set()
+_energy_tracking_toggle  = [ False ]
+
+def enable_energy_tracking( toggle_activity=False ):
+  """ Enable energy tracking and return a handle to release it with
+  disable_energy_tracking(). toggle_activity=None keeps the current
+  activity model if energy tracking is already enabled. """
+  if toggle_activity is None:
+    toggle_activity = _energy_tracking_toggle[0] and is_energy_tracking_enabled()
+  _energy_tracking_toggle[0] = bool( toggle_activity )
+
+  for name, binop in _plain_binops.items():
+    energy_binop = _mk_energy_binop( name, binop, toggle_activity )
+    setattr( Bits, binop.__name__, energy_binop )
+    setattr( Bits, f"__i{name}__", energy_binop )
+
+  handle = object()
+  _energy_tracking_handles.add( handle )
+  return handle
+
+def disable_energy_tracking( handle=None ):
+  """ Release handle, or all handles if handle is None, and restore the
+  plain operators if no handle is left. """
+  if handle is None:
+    _energy_tracking_handles.clear()
+  else:
+    _energy_tracking_handles.discard( handle )
+  if _energy_tracking_handles:
+    return
+
+  for name, binop in _plain_binops.items():
+    setattr( Bits, binop.__name__, binop )
+    if _plain_inplace_binops[ name ] is not None:
+      setattr( Bits, f"__i{name}__", _plain_inplace_binops[ name ] )
+    elif f"__i{name}__" in Bits.__dict__:
+      delattr( Bits, f"__i{name}__" )
+
+def is_energy_tracking_enabled():
+  return Bits.__add__ is not _plain_binops["add"]
+
+if os.getenv("PYMTL_ENERGY") in ( "1", "toggle" ):
+  _env_energy_tracking = enable_energy_tracking( toggle_activity=os.getenv("PYMTL_ENERGY") == "toggle" )
@@ -1,4 +1,16 @@
-from .bits_import import *
-from .bits_import import _bitwidths
-from .bitstructs import bitstruct, is_bitstruct_class, is_bitstruct_inst, mk_bitstruct
+from .bits_import import Bits, __getattr__, _bitwidths, mk_bits
+from .bits_import import __all__ as _bits_all
+from .bitstructs import (
+    bitstruct,
+    is_bitstruct_class,
+    is_bitstruct_inst,
+    is_packed_bitstruct_class,
+    mk_bitstruct,
+)
 from .helpers import clog2, concat, reduce_and, reduce_or, reduce_xor, sext, trunc, zext
+
+__all__ = _bits_all + [
+  'bitstruct', 'is_bitstruct_class', 'is_bitstruct_inst', 'is_packed_bitstruct_class',
+  'mk_bitstruct',
+  'clog2', 'concat', 'reduce_and', 'reduce_or', 'reduce_xor', 'sext', 'trunc', 'zext',
+]
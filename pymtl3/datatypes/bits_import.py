@@ -5,13 +5,18 @@ bits_import.py
 Import RPython Bits from PyPy mamba module if the environment variable
 that forces the use of Python Bits is set, and there is actually an
 importable Bits in mamba module. Otherwise import the Pure-Python
-implementation in Bits.py. Then generate a bunch of fixed-width BitsN
-types for PyMTL use.
+implementation in Bits.py. The fixed-width BitsN types for PyMTL use
+are generated on first access instead of at import time.
+
+PYMTL_BITS=c selects the CPython extension implementation in CBits.c,
+which has to be built with "python setup.py build_ext --inplace".
 
 Author : Shunning Jiang
 Date   : Aug 23, 2018
 """
 import os
+import re
+from types import CodeType
 
 from pymtl3.extra.pypy import custom_exec
 
@@ -27,12 +32,21 @@ if os.getenv("PYMTL_BITS") == "1":
   # print("[env: PYMTL_BITS=1] Use Python Bits")
   bits_template = """
 class Bits{0}(Bits):
-  __slots__ = ( "_nbits", "_uint", "_next" )
+  __slots__ = ( "_nbits", "_uint", "_next", "_version" )
   nbits = {0}
   def __init__( s, v=0, *, trunc_int=False ):
     return super().__init__( {0}, v, trunc_int )
 _bits_types[{0}] = b{0} = Bits{0}
 """
+elif os.getenv("PYMTL_BITS") == "c":
+  from .CBits import Bits
+  # print("[env: PYMTL_BITS=c] Use C Bits")
+  bits_template = """
+class Bits{0}(Bits):
+  __slots__ = ()
+  nbits = {0}
+_bits_types[{0}] = b{0} = Bits{0}
+"""
 else:
   try:
     from mamba import Bits
@@ -51,7 +65,7 @@ _bits_types[{0}] = b{0} = Bits{0}
     # As a result, subclasses will have a __dict__ unless they also define __slots__.
     bits_template = """
 class Bits{0}(Bits):
-  __slots__ = ( "_nbits", "_uint", "_next" )
+  __slots__ = ( "_nbits", "_uint", "_next", "_version" )
   nbits = {0}
   def __init__( s, v=0, *, trunc_int=False ):
     return super().__init__( {0}, v, trunc_int )
@@ -59,15 +73,71 @@ _bits_types[{0}] = b{0} = Bits{0}
 """
 
 _bitwidths  = list(range(1, 256)) + [ 384, 512 ]
-_bits_types = dict()
 
-custom_exec(compile( "".join([ bits_template.format(nbits) for nbits in _bitwidths ]),
-                     filename="bits_import.py", mode="exec"), globals(), locals() )
+class _BitsTypes( dict ):
+  def __missing__( self, nbits ):
+    if isinstance( nbits, int ) and 0 < nbits < 8193:
+      return mk_bits( nbits )
+    raise KeyError( nbits )
+
+_bits_types = _BitsTypes()
+
+# Every BitsN type is generated from the same template, so the template
+# is only compiled once for the placeholder bitwidth _template_nbits.
+# mk_bits then substitutes the bitwidth in the constants and names of
+# the compiled code, which is much faster than compiling it again.
+
+_template_nbits = 99999
+_template_code  = []
+
+def _specialize_code( code, nbits ):
+  old, new = str(_template_nbits), str(nbits)
+
+  def sub( x ):
+    if type(x) is int and x == _template_nbits:
+      return nbits
+    if type(x) is str:
+      return x.replace( old, new )
+    if isinstance( x, CodeType ):
+      return _specialize_code( x, nbits )
+    return x
+
+  kwargs = dict( co_consts   = tuple( sub(x) for x in code.co_consts ),
+                 co_names    = tuple( sub(x) for x in code.co_names ),
+                 co_name     = sub( code.co_name ),
+                 co_filename = f"Bits{nbits}" )
+  if hasattr( code, "co_qualname" ):
+    kwargs["co_qualname"] = sub( code.co_qualname )
+  return code.replace( **kwargs )
 
 def mk_bits( nbits ):
   assert nbits > 0, "We don't allow Bits0"
   # assert nbits < 512, "We don't allow bitwidth to exceed 512."
   if nbits not in _bits_types:
-    custom_exec(compile( bits_template.format(nbits), filename=f"Bits{nbits}", mode="exec" ),
-                globals(), locals() )
+    if hasattr( CodeType, "replace" ):
+      if not _template_code:
+        _template_code.append( compile( bits_template.format(_template_nbits),
+                                        filename=f"Bits{_template_nbits}", mode="exec" ) )
+      code = _specialize_code( _template_code[0], nbits )
+    else:
+      code = compile( bits_template.format(nbits), filename=f"Bits{nbits}", mode="exec" )
+    custom_exec( code, globals(), globals() )
   return _bits_types[nbits]
+
+# Creating all BitsN types takes a large part of the import time, so
+# BitsN/bN are created by mk_bits when they are first looked up in this
+# module. Star imports still get all _bitwidths through __all__, because
+# the module __getattr__ can't provide names to the namespace of the
+# importing module.
+
+__all__ = [ 'Bits', 'mk_bits' ] + [ f"Bits{x}" for x in _bitwidths ] \
+                                + [ f"b{x}" for x in _bitwidths ]
+
+_bits_name_re = re.compile( r"(?:Bits|b)([1-9][0-9]*)" )
+
+def __getattr__( name ):
+  m = _bits_name_re.fullmatch( name )
+  if m and int(m.group(1)) < 8193:
+    mk_bits( int(m.group(1)) )
+    return globals()[ name ]
+  raise AttributeError( f"module '{__name__}' has no attribute '{name}'" )
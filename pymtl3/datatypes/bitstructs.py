@@ -45,6 +45,11 @@ class Pixel:
   def __str__( self ):
     return f'({self.r},{self.g},{self.b})'
 
+A bit struct whose fields are all BitsN can be created with packed=True
+(@bitstruct(packed=True) or mk_bitstruct(..., packed=True)) to store all
+fields in a single integer, which makes clone, _flip, @=, <<= and == on
+the whole struct O(1). See _mk_packed_fns for the restrictions.
+
 Author : Yanghui Ou, Shunning Jiang
   Date : Oct 19, 2019
 """
@@ -58,7 +63,7 @@ import py
 
 from pymtl3.extra.pypy import custom_exec
 
-from .bits_import import *
+from .bits_import import Bits, mk_bits
 from .helpers import concat
 
 #-------------------------------------------------------------------------
@@ -75,6 +80,11 @@ from .helpers import concat
 
 _FIELDS = '__bitstruct_fields__'
 
+# A packed bitstruct stores all fields in a single integer. See
+# _mk_packed_fns for details.
+
+_PACKED = '__bitstruct_packed__'
+
 def is_bitstruct_inst( obj ):
   """Returns True if obj is an instance of a dataclass."""
   return hasattr(type(obj), _FIELDS)
@@ -83,6 +93,10 @@ def is_bitstruct_class(cls):
   """Returns True if obj is a dataclass ."""
   return isinstance(cls, type) and hasattr(cls, _FIELDS)
 
+def is_packed_bitstruct_class( cls ):
+  """Returns True if cls is a packed bitstruct."""
+  return isinstance(cls, type) and getattr(cls, _PACKED, False)
+
 def get_bitstruct_inst_all_classes( obj ):
   # list: put all types together
   if isinstance( obj, list ):
@@ -410,17 +424,21 @@ def _mk_imatmul_fn( fields ):
   )
 
 #-------------------------------------------------------------------------
-# _mk_nbits_to_bits_fn
+# _mk_nbits_to_bits_fns
 #-------------------------------------------------------------------------
-# Creates nbits, to_bits function that copies the value over ...
+# Creates nbits, to_bits function that copies the value over, and the
+# class method to_bits_many that converts a list of bitstructs at once ...
 #
 # def to_bits( self ):
 #   return concat( self.x, self.y[0], self.y[1] )
 #
+# def to_bits_many( cls, objs ):
+#   return [ concat( self.x, self.y[0], self.y[1] ) for self in objs ]
+#
 # TODO packing order of array? x[0] is LSB or MSB of a list
 # current we do LSB
 
-def _mk_nbits_to_bits_fn( fields ):
+def _mk_nbits_to_bits_fns( fields ):
 
   def _gen_to_bits_strs( type_, prefix, start_bit ):
 
@@ -449,19 +467,30 @@ def _mk_nbits_to_bits_fn( fields ):
     total_nbits, tos = _gen_to_bits_strs( type_, name, total_nbits )
     to_bits_strs.extend( tos )
 
-  return total_nbits, _create_fn( 'to_bits', [ 'self' ],
-                                  [ f"return concat({', '.join(to_bits_strs)})" ],
-                                  _globals={'concat':concat} )
+  concat_str = f"concat({', '.join(to_bits_strs)})"
+  return total_nbits, \
+         _create_fn( 'to_bits', [ 'self' ], [ f"return {concat_str}" ],
+                     _globals={'concat':concat} ), \
+         _create_fn( 'to_bits_many', [ 'cls', 'objs' ], [ f"return [ {concat_str} for self in objs ]" ],
+                     _globals={'concat':concat} )
 
 #-------------------------------------------------------------------------
-# _mk_from_bits_fn
+# _mk_from_bits_fns
 #-------------------------------------------------------------------------
-# Creates static method from_bits that creates a new bitstruct based on Bits
-# and instance method _from_bits that copies the value over
+# Creates class method from_bits that creates a new bitstruct based on
+# Bits, and class method from_bits_many that converts a list of Bits at
+# once
+#
+# @classmethod
+# def from_bits( cls, other ):
+#   return cls( other[16:32], other[0:16] )
 #
-# @staticmethod
-# def from_bits( other ):
-#   return self.__class__( other[16:32], other[0:16] )
+# @classmethod
+# def from_bits_many( cls, others ):
+#   ret = []
+#   for other in others:
+#     ret.append( cls( other[16:32], other[0:16] ) )
+#   return ret
 
 def _mk_from_bits_fns( fields, total_nbits ):
 
@@ -514,10 +543,171 @@ def _mk_from_bits_fns( fields, total_nbits ):
   assert len(_globals) == len(type_name_mapping)
 
   # TODO add assertion in bits
+  check_str = "assert cls.nbits == other.nbits, f'LHS bitstruct {cls.nbits}-bit <> RHS other {other.nbits}-bit'"
   return _create_fn( 'from_bits', [ 'cls', 'other' ],
-                     [ "assert cls.nbits == other.nbits, f'LHS bitstruct {cls.nbits}-bit <> RHS other {other.nbits}-bit'",
+                     [ check_str,
                        "other = other.to_bits()",
-                       f"return cls({','.join(from_bits_strs)})" ], _globals )
+                       f"return cls({','.join(from_bits_strs)})" ], _globals ), \
+         _create_fn( 'from_bits_many', [ 'cls', 'others' ],
+                     [ "ret = []",
+                       "for other in others:",
+                       f"  {check_str}",
+                       "  other = other.to_bits()",
+                       f"  ret.append( cls({','.join(from_bits_strs)}) )",
+                       "return ret" ], _globals )
+
+#-------------------------------------------------------------------------
+# _mk_fns
+#-------------------------------------------------------------------------
+# Creates all the methods of a bitstruct that are generated from fields.
+
+def _mk_fns( self_name, fields ):
+  ret = {}
+  ret['__init__'] = _mk_init_fn( self_name, fields )
+  ret['__str__']  = _mk_str_fn( fields )
+  ret['__repr__'] = _mk_repr_fn( fields )
+  ret['__eq__']   = _mk_eq_fn( fields )
+  ret['__hash__'] = _mk_hash_fn( fields )
+
+  ret['__ilshift__'], ret['_flip'] = _mk_ff_fn( fields )
+  ret['clone']        = _mk_clone_fn( fields )
+  ret['__deepcopy__'] = _mk_deepcopy_fn( fields )
+  ret['__imatmul__']  = _mk_imatmul_fn( fields )
+
+  ret['nbits'], ret['to_bits'], to_bits_many = _mk_nbits_to_bits_fns( fields )
+  ret['to_bits_many'] = classmethod(to_bits_many)
+
+  from_bits, from_bits_many = _mk_from_bits_fns( fields, ret['nbits'] )
+  ret['from_bits']      = classmethod(from_bits)
+  ret['from_bits_many'] = classmethod(from_bits_many)
+
+  return ret
+
+#-------------------------------------------------------------------------
+# _mk_packed_fns
+#-------------------------------------------------------------------------
+# A packed bitstruct keeps the value of all fields in a single integer
+# self._uint (and self._next for <<=) with the same layout as to_bits,
+# i.e., the first field is the MSB. Every field becomes a property that
+# extracts/inserts the field with shift and mask, so clone, _flip, @=,
+# <<=, ==, to_bits and from_bits no longer touch every field object. For
+# example, if fields contains x (Bits4) and y (Bits8), the field x is
+#
+# def _get_x( self ):
+#   return _type_x( (self._uint >> 8) & 0xf )
+#
+# def _set_x( self, v ):
+#   self._uint = self._uint & 0xff | int(_type_x(v)) << 8
+#
+# and _mk_packed_fns returns a dict of the other methods such as
+#
+# def __init__( s, x = 0, y = 0 ):
+#   s._uint = int(_type_x(x)) << 8 | int(_type_y(y)) << 0
+#
+# def clone( self ):
+#   ret = _new(self.__class__)
+#   ret._uint = self._uint
+#   return ret
+#
+# NOTE: a field value read from a packed bitstruct is a new Bits object,
+# so only writing the whole field (s.x @= v, s.x = v) updates the struct.
+# Elaboration rejects @= on a slice or a nested field of a field in
+# update blocks, and <<= on any field in update_ff blocks.
+
+# Like Bits, a packed bitstruct counts the changes of its value in
+# self._version, which starts from the class attribute _version = 0.
+
+def _update_uint_strs( uint ):
+  return [ f'if self._uint != {uint}:',
+           f'  self._uint = {uint}',
+            '  self._version += 1' ]
+
+def _mk_packed_field_property( name, type_, offset, total_nbits ):
+  mask    = (1 << type_.nbits) - 1
+  keep    = ((1 << total_nbits) - 1) ^ (mask << offset)
+  _globals = { f'_type_{name}': type_ }
+
+  getter = _create_fn( f'_get_{name}', [ 'self' ],
+                       [ f'return _type_{name}( (self._uint >> {offset}) & {hex(mask)} )' ],
+                       _globals = _globals )
+  setter = _create_fn( f'_set_{name}', [ 'self', 'v' ],
+                       [ f'uint = self._uint & {hex(keep)} | int(_type_{name}(v)) << {offset}' ] +
+                       _update_uint_strs( 'uint' ),
+                       _globals = _globals )
+  return property( getter, setter )
+
+def _mk_packed_fns( self_name, fields ):
+  offsets = {}
+  total_nbits = 0
+  for name, type_ in reversed( list( fields.items() ) ):
+    offsets[ name ] = total_nbits
+    total_nbits += type_.nbits
+
+  _globals = { f'_type_{name}': type_ for name, type_ in fields.items() }
+  _globals['_new']       = object.__new__
+  _globals['_bits_type'] = mk_bits( total_nbits )
+
+  ret = { name: _mk_packed_field_property( name, type_, offsets[name], total_nbits )
+          for name, type_ in fields.items() }
+
+  ret['nbits'] = total_nbits
+
+  ret['__init__'] = _create_fn( '__init__',
+    [ self_name ] + [ f'{name} = 0' for name in fields ],
+    [ f'{self_name}._uint = ' + ' | '.join( [ f'int(_type_{name}({name})) << {offsets[name]}'
+                                              for name in fields ] ) ],
+    _globals = _globals,
+  )
+
+  ret['__eq__'] = _create_fn( '__eq__', [ 'self', 'other' ],
+    [ 'return (other.__class__ is self.__class__) and self._uint == other._uint' ] )
+
+  ret['__hash__'] = _create_fn( '__hash__', [ 'self' ],
+    [ f'return hash(({total_nbits}, self._uint))' ] )
+
+  convert_strs = [ 'if self.__class__ is not other.__class__:',
+                   '  other = self.__class__.from_bits( other.to_bits() )' ]
+
+  ret['__ilshift__'] = _create_fn( '__ilshift__', [ 'self', 'other' ],
+    convert_strs + [ 'self._next = other._uint', 'return self' ] )
+
+  ret['__imatmul__'] = _create_fn( '__imatmul__', [ 'self', 'other' ],
+    convert_strs + _update_uint_strs( 'other._uint' ) + [ 'return self' ] )
+
+  ret['_flip'] = _create_fn( '_flip', [ 'self' ], _update_uint_strs( 'self._next' ) )
+
+  clone_strs = [ 'ret = _new(self.__class__)', 'ret._uint = self._uint', 'return ret' ]
+  ret['clone'] = _create_fn( 'clone', [ 'self' ], clone_strs, _globals )
+  ret['__deepcopy__'] = _create_fn( '__deepcopy__', [ 'self', 'memo' ], clone_strs, _globals )
+
+  ret['to_bits'] = _create_fn( 'to_bits', [ 'self' ], [ 'return _bits_type(self._uint)' ], _globals )
+
+  ret['to_bits_many'] = classmethod( _create_fn( 'to_bits_many', [ 'cls', 'objs' ],
+    [ 'return [ _bits_type(self._uint) for self in objs ]' ], _globals ) )
+
+  check_str = "assert cls.nbits == other.nbits, f'LHS bitstruct {cls.nbits}-bit <> RHS other {other.nbits}-bit'"
+
+  ret['from_bits'] = classmethod( _create_fn( 'from_bits', [ 'cls', 'other' ],
+    [ check_str,
+      'ret = _new(cls)',
+      'ret._uint = int(other.to_bits())',
+      'return ret' ], _globals ) )
+
+  ret['from_bits_many'] = classmethod( _create_fn( 'from_bits_many', [ 'cls', 'others' ],
+    [ 'ret = []',
+      'for other in others:',
+      f'  {check_str}',
+      '  x = _new(cls)',
+      '  x._uint = int(other.to_bits())',
+      '  ret.append( x )',
+      'return ret' ], _globals ) )
+
+  # Also add the other methods that do not depend on the representation
+  ret['__str__']  = _mk_str_fn( fields )
+  ret['__repr__'] = _mk_repr_fn( fields )
+
+  return ret
+
 #-------------------------------------------------------------------------
 # _check_valid_array
 #-------------------------------------------------------------------------
@@ -573,6 +763,20 @@ def _check_field_annotation( cls, name, type_ ):
       raise TypeError( "We currently only support BitsN, list, or another BitStruct as BitStruct field:\n"
                       f"- Field '{name}' of BitStruct {cls.__name__} is annotated as {type_}." )
 
+#-------------------------------------------------------------------------
+# _check_packed_field_annotation
+#-------------------------------------------------------------------------
+# A packed bitstruct only supports BitsN fields since a nested bitstruct
+# or a list read from a packed field would be a copy.
+
+def _check_packed_field_annotation( cls, name, type_ ):
+  if isinstance( type_, list ) or not issubclass( type_, Bits ):
+    raise TypeError( "A packed BitStruct only supports BitsN fields:\n"
+                    f"- Field '{name}' of BitStruct {cls.__name__} is annotated as {type_}." )
+  if name in ( '_uint', '_next', '_version' ):
+    raise TypeError( f"A packed BitStruct cannot have a field named '{name}':\n"
+                     f"- '{name}' is used to store the value of BitStruct {cls.__name__}." )
+
 #-------------------------------------------------------------------------
 # _get_self_name
 #-------------------------------------------------------------------------
@@ -586,11 +790,17 @@ def _get_self_name( fields ):
 # _process_cls
 #-------------------------------------------------------------------------
 # Process the input cls and add methods to it.
+#
+# The generated methods only depend on the field names and types, so
+# they are cached by the field layout and shared by all bitstruct classes
+# with the same layout, e.g., the message types of the same parameters
+# created by different calls to mk_bitstruct with different names.
 
 _bitstruct_hash_cache = {}
+_bitstruct_fns_cache  = {}
 
 def _process_class( cls, add_init=True, add_str=True, add_repr=True,
-                    add_hash=True ):
+                    add_hash=True, packed=False ):
 
   # Get annotations of the class
   cls_annotations = cls.__dict__.get('__annotations__', {})
@@ -608,7 +818,7 @@ def _process_class( cls, add_init=True, add_str=True, add_repr=True,
       return tuple( [ _convert_list_to_tuple( y ) for y in x ] )
     return x
 
-  reserved_fields = ['to_bits', 'from_bits', 'nbits']
+  reserved_fields = ['to_bits', 'from_bits', 'nbits', 'to_bits_many', 'from_bits_many']
   for x in reserved_fields:
     assert x not in cls.__dict__, f"Currently a bitstruct cannot have {reserved_fields}, but "\
                                   f"{x} is provided as {cls.__dict__[x]}"
@@ -618,11 +828,13 @@ def _process_class( cls, add_init=True, add_str=True, add_repr=True,
     assert a_name not in reserved_fields, f"Currently a bitstruct cannot have {reserved_fields}, but "\
                                           f"{a_name} is annotated as {a_type}"
     _check_field_annotation( cls, a_name, a_type )
+    if packed:
+      _check_packed_field_annotation( cls, a_name, a_type )
     fields[ a_name ] = a_type
     hashable_fields[ a_name ] = _convert_list_to_tuple( a_type )
 
   cls._hash = _hash = hash( (cls.__name__, *tuple(hashable_fields.items()),
-                             add_init, add_str, add_repr, add_hash) )
+                             add_init, add_str, add_repr, add_hash, packed) )
 
   if _hash in _bitstruct_hash_cache:
     return _bitstruct_hash_cache[ _hash ]
@@ -633,6 +845,25 @@ def _process_class( cls, add_init=True, add_str=True, add_repr=True,
   # as bit struct.
   setattr( cls, _FIELDS, fields )
 
+  # Get the generated methods of this field layout
+  layout = ( tuple(hashable_fields.items()), packed )
+  fns = _bitstruct_fns_cache.get( layout )
+  if fns is None:
+    if packed:
+      fns = _mk_packed_fns( _get_self_name(fields), fields )
+    else:
+      fns = _mk_fns( _get_self_name(fields), fields )
+    _bitstruct_fns_cache[ layout ] = fns
+
+  # A packed bitstruct accesses fields through properties. Instances
+  # created without the generated __init__ start from zero.
+  if packed:
+    for name in fields:
+      setattr( cls, name, fns[ name ] )
+    cls._uint = 0
+    cls._version = 0
+    setattr( cls, _PACKED, True )
+
   # Add methods to the class
 
   # Create __init__. Here I follow the dataclass convention that we only
@@ -640,17 +871,17 @@ def _process_class( cls, add_init=True, add_str=True, add_repr=True,
   # did not define their own init.
   if add_init:
     if not '__init__' in cls.__dict__:
-      cls.__init__ = _mk_init_fn( _get_self_name(fields), fields )
+      cls.__init__ = fns['__init__']
 
   # Create __str__
   if add_str:
     if not '__str__' in cls.__dict__:
-      cls.__str__ = _mk_str_fn( fields )
+      cls.__str__ = fns['__str__']
 
   # Create __repr__
   if add_repr:
     if not '__repr__' in cls.__dict__:
-      cls.__repr__ = _mk_repr_fn( fields )
+      cls.__repr__ = fns['__repr__']
 
   # Create __eq__. There is no need for a __ne__ method as python will
   # call __eq__ and negate it.
@@ -659,7 +890,7 @@ def _process_class( cls, add_init=True, add_str=True, add_repr=True,
   # equal only if all the fields are equal. We always try to add __eq__
 
   if not '__eq__' in cls.__dict__:
-    cls.__eq__ = _mk_eq_fn( fields )
+    cls.__eq__ = fns['__eq__']
   else:
     w_msg = ( f'Overwriting {cls.__qualname__}\'s __eq__ may cause the '
               'translated verilog behaves differently from PyMTL '
@@ -669,29 +900,31 @@ def _process_class( cls, add_init=True, add_str=True, add_repr=True,
   # Create __hash__.
   if add_hash:
     if not '__hash__' in cls.__dict__:
-      cls.__hash__ = _mk_hash_fn( fields )
+      cls.__hash__ = fns['__hash__']
 
   # Shunning: add __ilshift__ and _flip for update_ff
   assert not '__ilshift__' in cls.__dict__ and not '_flip' in cls.__dict__
 
-  cls.__ilshift__, cls._flip = _mk_ff_fn( fields )
+  cls.__ilshift__, cls._flip = fns['__ilshift__'], fns['_flip']
 
   # Shunning: add clone
   assert not 'clone' in cls.__dict__ and not '__deepcopy__' in cls.__dict__
 
-  cls.clone = _mk_clone_fn( fields )
+  cls.clone = fns['clone']
 
-  cls.__deepcopy__ = _mk_deepcopy_fn( fields )
+  cls.__deepcopy__ = fns['__deepcopy__']
 
   # Shunning: add imatmul for assignment, as well as nbits/to_bits/from_bits
   assert '__imatmul__' not in cls.__dict__ and 'to_bits' not in cls.__dict__ and \
          'nbits' not in cls.__dict__ and 'from_bits' not in cls.__dict__
 
-  cls.__imatmul__ = _mk_imatmul_fn( fields )
-  cls.nbits, cls.to_bits = _mk_nbits_to_bits_fn( fields )
+  cls.__imatmul__ = fns['__imatmul__']
+  cls.nbits, cls.to_bits = fns['nbits'], fns['to_bits']
+  cls.from_bits = fns['from_bits']
 
-  from_bits = _mk_from_bits_fns( fields, cls.nbits )
-  cls.from_bits = classmethod(from_bits)
+  # Bulk conversion of a list of bitstructs/Bits, e.g., in test sources
+  # and sinks
+  cls.to_bits_many, cls.from_bits_many = fns['to_bits_many'], fns['from_bits_many']
 
   assert not 'get_field_type' in cls.__dict__
 
@@ -712,10 +945,11 @@ def _process_class( cls, add_init=True, add_str=True, add_repr=True,
 # The actual class decorator. We add a * in the argument list so that the
 # following argument can only be used as keyword arguments.
 
-def bitstruct( _cls=None, *, add_init=True, add_str=True, add_repr=True, add_hash=True ):
+def bitstruct( _cls=None, *, add_init=True, add_str=True, add_repr=True, add_hash=True,
+               packed=False ):
 
   def wrap( cls ):
-    return _process_class( cls, add_init, add_str, add_repr )
+    return _process_class( cls, add_init, add_str, add_repr, packed=packed )
 
   # Called as @bitstruct(...)
   if _cls is None:
@@ -731,7 +965,7 @@ def bitstruct( _cls=None, *, add_init=True, add_str=True, add_repr=True, add_has
 # TODO: should we add base parameters to support inheritence?
 
 def mk_bitstruct( cls_name, fields, *, namespace=None, add_init=True,
-                   add_str=True, add_repr=True, add_hash=True ):
+                   add_str=True, add_repr=True, add_hash=True, packed=False ):
 
   # copy namespace since  will mutate it
   namespace = {} if namespace is None else namespace.copy()
@@ -750,4 +984,4 @@ def mk_bitstruct( cls_name, fields, *, namespace=None, add_init=True,
   namespace['__annotations__'] = annos
   cls = types.new_class( cls_name, (), {}, lambda ns: ns.update( namespace ) )
   return bitstruct( cls, add_init=add_init, add_str=add_str,
-                    add_repr=add_repr, add_hash=add_hash )
+                    add_repr=add_repr, add_hash=add_hash, packed=packed )
@@ -0,0 +1,177 @@
+#=======================================================================
+# bits_backends_test.py
+#=======================================================================
+# Conformance tests that run the same operations on every available
+# Bits implementation and compare the results, and the type and message
+# of the exceptions, against the reference Python implementation.
+
+import copy
+import operator
+import pickle
+
+import hypothesis
+import pytest
+from hypothesis import strategies as st
+
+from .. import PythonBits
+
+_backends = { "python": PythonBits.Bits }
+
+try:
+  from .. import CBits
+  _backends["c"] = CBits.Bits
+except ImportError:
+  pass
+
+try:
+  import mamba
+  _backends["mamba"] = mamba.Bits
+except ImportError:
+  pass
+
+_ref = PythonBits.Bits
+
+def _run( f ):
+  """ Return ( "ok", normalized result ) or ( "exc", type, message ). """
+  try:
+    ret = f()
+  except Exception as e:
+    return ( "exc", type(e), str(e) )
+  if isinstance( ret, tuple(_backends.values()) ):
+    return ( "ok", "Bits", ret.nbits, ret.uint() )
+  return ( "ok", ret )
+
+def _conform( impl, f ):
+  """ f takes a Bits class and performs the operation. """
+  assert _run( lambda: f( impl ) ) == _run( lambda: f( _ref ) )
+
+@pytest.fixture( params=sorted(_backends) )
+def impl( request ):
+  return _backends[ request.param ]
+
+#-----------------------------------------------------------------------
+# Directed tests
+#-----------------------------------------------------------------------
+
+_widths = [ 1, 7, 8, 32, 63, 64, 65, 100, 128, 256 ]
+
+@pytest.mark.parametrize( 'nbits', _widths )
+def test_construct( impl, nbits ):
+  up = (1 << nbits) - 1
+  lo = -(1 << (nbits-1))
+  for v in [ 0, 1, up, up+1, lo, lo-1, -1 ]:
+    _conform( impl, lambda B: B( nbits, v ) )
+    _conform( impl, lambda B: B( nbits, v, trunc_int=True ) )
+
+  _conform( impl, lambda B: B( 0 ) )
+  _conform( impl, lambda B: B( 8193 ) )
+  _conform( impl, lambda B: B( nbits, B( nbits, 1 ) ) )
+  _conform( impl, lambda B: B( nbits, B( nbits+1, 1 ) ) )
+  if nbits > 1:
+    _conform( impl, lambda B: B( nbits, B( nbits-1, 1 ) ) )
+
+@pytest.mark.parametrize( 'nbits', _widths )
+def test_slicing( impl, nbits ):
+  up = (1 << nbits) - 1
+  v  = 0x5a5a5a5a5a5a5a5a5a5a5a5a5a5a5a5a & up
+
+  for idx in [ 0, nbits-1, nbits, -1, slice(0, nbits), slice(1, nbits),
+               slice(None, None), slice(2, 1), slice(0, nbits+1), slice(0, 1, 1) ]:
+    _conform( impl, lambda B: B( nbits, v )[ idx ] )
+
+  def setitem( B, idx, x ):
+    b = B( nbits, v )
+    b[ idx ] = x
+    return b
+
+  for idx, x in [ ( 0, 1 ), ( nbits-1, -1 ), ( 0, 2 ), ( nbits, 0 ),
+                  ( slice(0, nbits), up ), ( slice(0, nbits), up+1 ),
+                  ( slice(0, 1), 0 ) ]:
+    _conform( impl, lambda B: setitem( B, idx, x ) )
+    _conform( impl, lambda B: setitem( B, idx, B( 1, x & 1 ) ) )
+    _conform( impl, lambda B: setitem( B, idx, B( nbits, x & up ) ) )
+
+@pytest.mark.parametrize( 'nbits', _widths )
+def test_assign_and_flip( impl, nbits ):
+
+  def flip( B, v ):
+    b = B( nbits )
+    b <<= v
+    b._flip()
+    return b
+
+  def blocking( B, v ):
+    b = B( nbits )
+    b @= v
+    return b
+
+  for f in [ flip, blocking ]:
+    _conform( impl, lambda B: f( B, 1 ) )
+    _conform( impl, lambda B: f( B, -1 ) )
+    _conform( impl, lambda B: f( B, 1 << nbits ) )
+    _conform( impl, lambda B: f( B, B( nbits, 3 & ((1 << nbits)-1) ) ) )
+    _conform( impl, lambda B: f( B, B( nbits+1, 1 ) ) )
+
+def test_misc( impl ):
+  b = impl( 12, 0xabc )
+  assert repr(b) == "Bits12(0xabc)"
+  assert str(b)  == "abc"
+  assert b.bin() == "0b101010111100"
+  assert b.oct() == "0o5274"
+  assert b.hex() == "0xabc"
+  assert b.int() == 0xabc - 0x1000
+  assert b.uint() == int(b) == 0xabc
+  assert [ x.uint() for x in impl( 3, 5 ) ] == [ 1, 0, 1 ]
+  assert hash(b) == hash(_ref( 12, 0xabc ))
+  assert b.clone() == b and b.clone() is not b
+  assert copy.deepcopy(b) == b and copy.copy(b) == b
+  assert pickle.loads( pickle.dumps(b) ) == b
+  assert (b != 0xabc) is False
+
+#-----------------------------------------------------------------------
+# Random differential tests
+#-----------------------------------------------------------------------
+
+_binops = [ operator.add, operator.sub, operator.mul, operator.and_, operator.or_,
+            operator.xor, operator.floordiv, operator.mod, operator.lshift,
+            operator.rshift, operator.eq, operator.ne, operator.lt, operator.le,
+            operator.gt, operator.ge ]
+
+_inplace_binops = [ operator.iadd, operator.isub, operator.imul, operator.iand,
+                    operator.ior, operator.ixor, operator.ifloordiv, operator.imod,
+                    operator.irshift ]
+
+@st.composite
+def _operands( draw ):
+  nbits = draw( st.sampled_from( _widths ) )
+  value = st.integers( 0, (1 << nbits) - 1 )
+  a = draw( value )
+  # Mostly valid operands, sometimes out of range ones or another width
+  b = draw( st.one_of( value, st.integers( -(1 << nbits), 1 << (nbits+1) ) ) )
+  b_nbits = draw( st.sampled_from( [ nbits ] * 4 + [ nbits+1 ] ) )
+  return nbits, a, b, b_nbits
+
+@pytest.mark.parametrize( 'op', _binops + _inplace_binops, ids=lambda op: op.__name__ )
+def test_random_binop( impl, op ):
+
+  @hypothesis.given( args = _operands() )
+  @hypothesis.settings( max_examples=100, deadline=None )
+  def actual_test( args ):
+    nbits, a, b, b_nbits = args
+    _conform( impl, lambda B: op( B( nbits, a ), B( b_nbits, b, trunc_int=True ) ) )
+    _conform( impl, lambda B: op( B( nbits, a ), b ) )
+    _conform( impl, lambda B: op( b, B( nbits, a ) ) )
+
+  actual_test()
+
+def test_random_unary( impl ):
+
+  @hypothesis.given( args = _operands() )
+  @hypothesis.settings( max_examples=200, deadline=None )
+  def actual_test( args ):
+    nbits, a, _, _ = args
+    for f in [ operator.invert, bool, int, hash, repr, str,
+               lambda x: x.int(), lambda x: x.bin(), lambda x: x.oct(), lambda x: x.hex() ]:
+      _conform( impl, lambda B: f( B( nbits, a ) ) )
+
+  actual_test()
@@ -760,3 +760,88 @@ def test_bin_oct_hex():
   assert Bits(15,35).bin() == "0b000000000100011"
   assert Bits(15,35).oct() == "0o00043"
   assert Bits(15,35).hex() == "0x0023"
+
+def test_lazy_bitsN():
+  from .. import bits_import
+  from ..bits_import import Bits1000, b1000
+
+  assert Bits1000 is b1000 is bits_import._bits_types[1000]
+  assert Bits1000.nbits == 1000 and Bits1000(3) == Bits(1000, 3)
+  assert bits_import._bits_types[777] is bits_import.Bits777
+
+  with pytest.raises( AttributeError ):
+    bits_import.Bits0
+  with pytest.raises( AttributeError ):
+    bits_import.Bits08
+  with pytest.raises( KeyError ):
+    bits_import._bits_types[0]
+
+def test_bitsN_from_template():
+  from .. import bits_import
+
+  B = bits_import.mk_bits( 4321 )
+  assert B.__name__ == B.__qualname__ == "Bits4321"
+  assert B.nbits == 4321 and B(5) + B(7) == Bits(4321, 12)
+
+  # The same code as compiling the template for the bitwidth
+  code = bits_import._specialize_code( bits_import._template_code[0], 4321 )
+  ref  = compile( bits_import.bits_template.format(4321), filename="Bits4321", mode="exec" )
+  assert code.co_code == ref.co_code and code.co_names == ref.co_names
+  assert [ x for x in code.co_consts if not isinstance( x, type(code) ) ] == \
+         [ x for x in ref.co_consts  if not isinstance( x, type(ref)  ) ]
+
+def test_inplace():
+  a = Bits( 8, 3 )
+  b = a
+  a += 1
+  assert a == 4 and b == 3
+
+  # An unshared temporary is updated in place
+  t = Bits( 8, 0xf0 )
+  t |= 0x0f
+  t ^= Bits( 8, 0x01 )
+  t >>= 4
+  assert t == 0xf
+
+  l = [ Bits( 8, 255 ) ]
+  l[0] += 1
+  assert l[0] == 0
+
+  with pytest.raises( ValueError ):
+    t -= Bits( 9, 1 )
+  with pytest.raises( ValueError ):
+    t *= 256
+  with pytest.raises( ZeroDivisionError ):
+    t //= 0
+
+def test_version():
+  from ..PythonBits import Bits
+
+  a = Bits( 8, 3 )
+  assert a._version == 0
+
+  # Only assignments that change the value are counted
+  a @= 3
+  assert a._version == 0
+  a @= Bits( 8, 4 )
+  a @= 5
+  assert a._version == 2
+
+  a[0:4] = 5
+  assert a._version == 2
+  a[0:4] = Bits( 4, 6 )
+  a[7] = 1
+  assert a == 0x86 and a._version == 4
+
+  a <<= 0x86
+  a._flip()
+  assert a._version == 4
+  a <<= 1
+  assert a._version == 4
+  a._flip()
+  assert a == 1 and a._version == 5
+
+  # Temporaries start counting at their first change
+  t = a + 1
+  t @= 3
+  assert t._version == 1
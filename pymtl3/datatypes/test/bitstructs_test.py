@@ -8,9 +8,11 @@ Author : Yanghui Ou
   Date : July 27, 2019
 """
 
+import copy
+
 import pytest
 
-from pymtl3.dsl import Component, InPort, OutPort, update
+from pymtl3.dsl import Component, InPort, OutPort, Wire, update, update_ff
 from pymtl3.dsl.test.sim_utils import simple_sim_pass
 
 from ..bits_import import *
@@ -19,6 +21,7 @@ from ..bitstructs import (
     get_bitstruct_inst_all_classes,
     is_bitstruct_class,
     is_bitstruct_inst,
+    is_packed_bitstruct_class,
     mk_bitstruct,
 )
 
@@ -604,3 +607,177 @@ def test_imatmul_ilshift():
   assert c == B(0x1234567890abcd0f,[A(2),A(3),A(4)], A(5) )
   c._flip()
   assert c.to_bits() == Bits164(0xf0dcba09876543210005000400030002)
+
+#-------------------------------------------------------------------------
+# Packed bitstruct
+#-------------------------------------------------------------------------
+
+@bitstruct(packed=True)
+class PackedMsg:
+  x : Bits4
+  y : Bits100
+  z : Bits1
+
+UnpackedMsg = mk_bitstruct( 'UnpackedMsg', {
+    'x' : Bits4,
+    'y' : Bits100,
+    'z' : Bits1,
+  })
+
+def test_packed_fields():
+  a = PackedMsg( 3, 0x1234567890abcdef, 1 )
+  assert is_bitstruct_class( PackedMsg ) and is_bitstruct_inst( a )
+  assert is_packed_bitstruct_class( PackedMsg )
+  assert not is_packed_bitstruct_class( UnpackedMsg )
+  assert a.nbits == 105
+  assert a.x == Bits4(3) and a.x.nbits == 4
+  assert a.y == Bits100(0x1234567890abcdef)
+  assert a.z == Bits1(1)
+  assert str(a) == str( UnpackedMsg( 3, 0x1234567890abcdef, 1 ) )
+  assert repr(a) == repr( UnpackedMsg( 3, 0x1234567890abcdef, 1 ) ).replace( "Unpacked", "Packed" )
+
+  a.x @= 12
+  a.y = Bits100(1)
+  assert a == PackedMsg( 12, 1, 1 )
+
+  with pytest.raises( ValueError ):
+    a.x = 16
+  with pytest.raises( ValueError ):
+    a.x = Bits8(1)
+  with pytest.raises( ValueError ):
+    PackedMsg( Bits5(1) )
+
+def test_packed_same_layout_as_unpacked():
+  a = PackedMsg( 3, 0x1234567890abcdef, 1 )
+  b = UnpackedMsg( 3, 0x1234567890abcdef, 1 )
+  assert a.to_bits() == b.to_bits()
+  assert PackedMsg.from_bits( b.to_bits() ) == a
+  assert UnpackedMsg.from_bits( a.to_bits() ) == b
+
+  c = PackedMsg()
+  c @= b
+  assert c == a
+  b.x @= 0
+  b @= a
+  assert b.x == 3
+
+def test_packed_clone_ilshift_flip():
+  a = PackedMsg( 3, 4, 1 )
+  b = a.clone()
+  c = copy.deepcopy( a )
+  assert a == b == c and a is not b and a is not c
+  assert hash(a) == hash(b)
+
+  b.x @= 5
+  assert a.x == 3 and b.x == 5
+
+  a <<= b
+  assert a.x == 3
+  a._flip()
+  assert a == b
+  a <<= Bits105(0)
+  a._flip()
+  assert a == PackedMsg()
+
+def test_packed_version():
+  a = PackedMsg( 3, 4, 1 )
+  assert a._version == 0
+
+  a @= PackedMsg( 3, 4, 1 )
+  a.x @= 3
+  assert a._version == 0
+  a.x @= 5
+  a @= PackedMsg()
+  assert a._version == 2
+
+  a <<= PackedMsg()
+  a._flip()
+  assert a._version == 2
+  a <<= PackedMsg( 1, 2, 0 )
+  a._flip()
+  assert a._version == 3 and PackedMsg()._version == 0
+
+  with pytest.raises( TypeError ):
+    mk_bitstruct( 'A', { '_version': Bits4 }, packed=True )
+
+def test_packed_field_type_check():
+  with pytest.raises( TypeError ):
+    mk_bitstruct( 'A', { 'x': [ Bits4, Bits4 ] }, packed=True )
+  with pytest.raises( TypeError ):
+    mk_bitstruct( 'A', { 'x': PackedMsg }, packed=True )
+  with pytest.raises( TypeError ):
+    mk_bitstruct( 'A', { '_uint': Bits4 }, packed=True )
+
+def test_packed_component():
+  class A( Component ):
+    def construct( s ):
+      s.in_ = InPort( PackedMsg )
+      s.out = OutPort( PackedMsg )
+      s.reg = Wire( PackedMsg )
+
+      @update_ff
+      def up_reg():
+        s.reg <<= s.in_
+
+      @update
+      def up_out():
+        s.out @= s.reg
+        s.out.z @= ~s.reg.z
+
+  dut = A()
+  dut.elaborate()
+  dut.apply( simple_sim_pass )
+  dut.in_ @= PackedMsg( 1, 2, 0 )
+  dut.tick()
+  assert dut.out == PackedMsg( 1, 2, 1 )
+  dut.in_ @= PackedMsg( 3, 4, 1 )
+  dut.tick()
+  assert dut.out == PackedMsg( 3, 4, 0 )
+
+#-------------------------------------------------------------------------
+# Generated methods cache and bulk conversion
+#-------------------------------------------------------------------------
+
+def test_same_layout_shares_methods():
+  A = mk_bitstruct( 'LayoutA', { 'x': Bits8, 'y': [ Bits4 ] * 2 } )
+  B = mk_bitstruct( 'LayoutB', { 'x': Bits8, 'y': [ Bits4 ] * 2 } )
+  C = mk_bitstruct( 'LayoutC', { 'x': Bits8, 'y': [ Bits4 ] * 3 } )
+  P = mk_bitstruct( 'LayoutP', { 'x': Bits8, 'y': Bits8 }, packed=True )
+  Q = mk_bitstruct( 'LayoutQ', { 'x': Bits8, 'y': Bits8 }, packed=True )
+
+  assert A is not B
+  assert A.to_bits is B.to_bits and A.__init__ is B.__init__
+  assert A.to_bits is not C.to_bits
+  assert P.to_bits is Q.to_bits and P.x is Q.x
+
+  # Shared methods still create/compare instances of the right class
+  a = A.from_bits( Bits16(0x1234) )
+  b = B.from_bits( Bits16(0x1234) )
+  assert type(a) is A and type(b) is B and type(b.clone()) is B
+  assert repr(b) == "LayoutB(Bits8(0x12),[Bits4(0x4), Bits4(0x3)])"
+  assert a != b
+  assert type(Q.from_bits( Bits16(1) )) is Q
+
+def test_bits_many():
+  @bitstruct
+  class A:
+    x: Bits16
+
+  B = mk_bitstruct( "B", {
+    'x': Bits100,
+    'y': [ A ] * 3,
+    'z': A,
+  })
+  objs = [ B(i, [A(i+1),A(i+2),A(i+3)], A(i+4)) for i in range(10) ]
+  bits = B.to_bits_many( objs )
+  assert bits == [ x.to_bits() for x in objs ]
+  assert B.from_bits_many( bits ) == objs
+  assert B.from_bits_many( [] ) == []
+
+  with pytest.raises( AssertionError ):
+    B.from_bits_many( [ Bits163(0) ] )
+
+  packed = [ PackedMsg( i, i*3, i & 1 ) for i in range(10) ]
+  bits = PackedMsg.to_bits_many( packed )
+  assert bits == UnpackedMsg.to_bits_many( [ UnpackedMsg( i, i*3, i & 1 ) for i in range(10) ] )
+  assert PackedMsg.from_bits_many( bits ) == packed
@@ -9,6 +9,9 @@ Date   : Jan 17, 2018
 """
 
 import ast
+import inspect
+import linecache
+import tokenize
 
 
 class DetectVarNames( ast.NodeVisitor ):
@@ -214,3 +217,40 @@ def extract_reads_writes_calls( hostobj, f, tree, read, write, calls ):
 
 def get_method_calls( tree, upblk, methods ):
   DetectMethodCalls( upblk, hostobj ).enter( tree, methods )
+
+def get_nested_func_sources( filename, part=0, nparts=1 ):
+  """ Return {first line: (source lines, first line)} of all functions
+  defined inside other functions in filename, which is the same as what
+  inspect.getsourcelines returns for the function whose code object
+  starts at the first line. This is used to get the source of update
+  blocks in a different process. Only every nparts-th function starting
+  from part is processed so that a file can be split across processes. """
+
+  try:
+    lines = linecache.getlines( filename )
+    tree  = ast.parse( "".join( lines ), filename )
+  except ( OSError, SyntaxError, ValueError ):
+    return {}
+
+  funcs = []
+  def collect( node, nested ):
+    for child in ast.iter_child_nodes( node ):
+      if isinstance( child, ( ast.FunctionDef, ast.AsyncFunctionDef ) ):
+        if nested:
+          funcs.append( child )
+        collect( child, True )
+      elif isinstance( child, ast.Lambda ):
+        collect( child, True )
+      else:
+        collect( child, nested )
+  collect( tree, False )
+
+  ret = {}
+  for func in funcs[ part::nparts ]:
+    # The code object of a decorated function starts at the decorator
+    lineno = min( [ func.lineno ] + [ x.lineno for x in func.decorator_list ] )
+    try:
+      ret[ lineno ] = ( inspect.getblock( lines[ lineno-1: ] ), lineno )
+    except ( IndentationError, SyntaxError, tokenize.TokenError ):
+      pass
+  return ret
@@ -9,6 +9,7 @@ Author : Yanghui Ou
 """
 
 from .ComponentLevel1 import ComponentLevel1
+from .ComponentLevel2 import prefetch_update_block_sources
 from .ComponentLevel7 import ComponentLevel7
 from .Connectable import Const, InPort, Interface, MethodPort, OutPort, Signal, Wire
 from .errors import (
@@ -429,13 +430,19 @@ class Component( ComponentLevel7 ):
     # gc.collect() # this takes 0.1 seconds
 
   # Override, add pypy hooks
-  def elaborate( s ):
+  def elaborate( s, prefetch_nprocs=0 ):
+    """ Elaborate the component hierarchy. If prefetch_nprocs is nonzero,
+    the sources of the update blocks of all loaded component classes are
+    prefetched in a pool of prefetch_nprocs processes first. """
     try:
       import pypyjit
       pypyjit.set_param("off")
     except:
       pass
 
+    if prefetch_nprocs:
+      prefetch_update_block_sources( prefetch_nprocs )
+
     super().elaborate()
 
     # try:
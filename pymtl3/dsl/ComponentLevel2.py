@@ -15,10 +15,14 @@ Date   : Apr 16, 2018
 import ast
 import gc
 import inspect
+import os
+import pickle
 import re
+import sys
 from collections import defaultdict
+from hashlib import blake2b
 
-from pymtl3.datatypes import Bits, is_bitstruct_class
+from pymtl3.datatypes import Bits, is_bitstruct_class, is_packed_bitstruct_class
 
 from . import AstHelper
 from .ComponentLevel1 import ComponentLevel1
@@ -31,6 +35,7 @@ from .errors import (
     InvalidPlaceholderError,
     MultiWriterError,
     NotElaboratedError,
+    PackedBitstructPartialWriteError,
     PyMTLDeprecationError,
     SignalTypeError,
     UpblkFuncSameNameError,
@@ -49,6 +54,116 @@ def update_ff( blk ):
   NamedObject._elaborate_stack[-1]._update_ff( blk )
   return blk
 
+# The sources of functions that are prefetched by
+# prefetch_update_block_sources, indexed by ( filename, first line ) of
+# their code objects
+_prefetched_sources = {}
+
+def prefetch_update_block_sources( nprocs ):
+  """ Prefetch the sources of all nested functions, i.e., update blocks
+  and the helpers defined in construct, in the source files of all
+  loaded component classes that have not been elaborated, in a pool of
+  nprocs processes.
+
+  inspect.getsourcelines tokenizes the source file to find the end of
+  every function, which dominates the elaboration time of designs with
+  many component classes. This only prefetches the sources; the ASTs are
+  still parsed in _cache_func_meta because unpickling them is as slow as
+  parsing the source. The classes of a design are only known after its
+  construction, so every loaded subclass of ComponentLevel2 is covered,
+  including the ones that the design doesn't use. """
+
+  files = set()
+  Q = [ ComponentLevel2 ]
+  while Q:
+    cls = Q.pop()
+    Q.extend( cls.__subclasses__() )
+    if '_name_info' not in cls.__dict__:
+      path = getattr( sys.modules.get( cls.__module__ ), '__file__', None )
+      if path and path.endswith( '.py' ):
+        files.add( path )
+
+  files = sorted( files - { x for x, _ in _prefetched_sources } )
+  if not files:
+    return
+
+  # Importing the pool pulls in multiprocessing, so only do it when
+  # prefetching is requested
+  from concurrent.futures import ProcessPoolExecutor
+
+  # Split the files into parts when there are fewer files than processes
+  nparts = max( 1, nprocs // len(files) )
+  jobs = [ (path, i, nparts) for path in files for i in range(nparts) ]
+
+  with ProcessPoolExecutor( max_workers=nprocs ) as executor:
+    results = executor.map( AstHelper.get_nested_func_sources, *zip( *jobs ) )
+    for (path, _, _), sources in zip( jobs, results ):
+      for lineno, x in sources.items():
+        _prefetched_sources[ (path, lineno) ] = x
+
+# The metadata of functions can also be cached on disk so that other
+# processes, e.g., later test runs and pytest-xdist workers, skip parsing
+# the same update blocks. Set PYMTL_FUNC_CACHE to the cache directory or
+# call set_func_cache_dir to enable it. Every entry is keyed by the path
+# and content of the source file, and the first line and name of the
+# function. Bump _FUNC_CACHE_VERSION when the format of the cached
+# metadata changes.
+
+_FUNC_CACHE_VERSION = "1"
+
+_func_cache_dir = os.getenv( "PYMTL_FUNC_CACHE" ) or None
+_func_file_hashes = {}
+
+def set_func_cache_dir( path ):
+  """ Set the directory of the on-disk cache of function metadata. None
+  disables the cache. """
+  global _func_cache_dir
+  _func_cache_dir = path
+
+def _get_func_cache_path( func ):
+  code = func.__code__
+  filename = code.co_filename
+
+  try:
+    file_hash = _func_file_hashes[ filename ]
+  except KeyError:
+    try:
+      with open( filename, 'rb' ) as f:
+        h = blake2b( digest_size=16 )
+        h.update( f"{_FUNC_CACHE_VERSION} {sys.version_info[:2]} {filename}\n".encode() )
+        h.update( f.read() )
+        file_hash = h.hexdigest()
+    except OSError:
+      file_hash = None
+    _func_file_hashes[ filename ] = file_hash
+
+  if file_hash is None:
+    return None
+  return os.path.join( _func_cache_dir, f"{file_hash}-{code.co_firstlineno}-{func.__name__}.pkl" )
+
+def _load_func_meta( func ):
+  path = _get_func_cache_path( func )
+  if path is None:
+    return None
+  try:
+    with open( path, 'rb' ) as f:
+      return pickle.load( f )
+  except ( OSError, EOFError, pickle.UnpicklingError ):
+    return None
+
+def _dump_func_meta( func, meta ):
+  path = _get_func_cache_path( func )
+  if path is None:
+    return
+  tmp = f"{path}.{os.getpid()}.tmp"
+  try:
+    os.makedirs( _func_cache_dir, exist_ok=True )
+    with open( tmp, 'wb' ) as f:
+      pickle.dump( meta, f, protocol=pickle.HIGHEST_PROTOCOL )
+    os.replace( tmp, path )
+  except OSError:
+    pass
+
 class ComponentLevel2( ComponentLevel1 ):
 
   #-----------------------------------------------------------------------
@@ -100,7 +215,17 @@ class ComponentLevel2( ComponentLevel1 ):
       AstHelper.extract_reads_writes_calls( s, func, _ast, _rd, _wr, _fc )
 
     elif name not in name_info:
-      _src, _line = inspect.getsourcelines( func )
+      if _func_cache_dir is not None:
+        meta = _load_func_meta( func )
+        if meta is not None:
+          name_info[ name ], name_rd[ name ], name_wr[ name ], name_fc[ name ] = meta
+          return
+
+      code = func.__code__
+      try:
+        _src, _line = _prefetched_sources[ (code.co_filename, code.co_firstlineno) ]
+      except KeyError:
+        _src, _line = inspect.getsourcelines( func )
       _src = "".join( _src )
       _ast = ast.parse( compiled_re.sub( r'\2', _src ) )
 
@@ -110,6 +235,9 @@ class ComponentLevel2( ComponentLevel1 ):
       name_fc[ name ]   = _fc   = []
       AstHelper.extract_reads_writes_calls( s, func, _ast, _rd, _wr, _fc )
 
+      if _func_cache_dir is not None:
+        _dump_func_meta( func, ( name_info[ name ], _rd, _wr, _fc ) )
+
   def _elaborate_read_write_func( s ):
 
     # We have parsed AST to extract every read/write variable name.
@@ -271,6 +399,19 @@ class ComponentLevel2( ComponentLevel1 ):
               raise UpdateBlockWriteError( s, func, op+'=', nodelist[0].lineno,
                 "Fix the signal assignment with '@='")
 
+            # A field of a packed bitstruct is read as a new object, so
+            # writing a slice or a field of it is lost. The parent of the
+            # target itself may be a packed bitstruct whose field is
+            # written as a whole.
+            for x in objs:
+              ancestors = []
+              y = x
+              while not y.is_top_level_signal():
+                y = y.get_parent_object()
+                ancestors.append( y )
+              if any( is_packed_bitstruct_class( y._dsl.Type ) for y in ancestors[1:] ):
+                raise PackedBitstructPartialWriteError( s, func, nodelist[0].lineno, x )
+
         # This is a function call without "s." prefix, check func list
         elif obj_name[0][0] in s._dsl.name_func:
           call = s._dsl.name_func[ obj_name[0][0] ]
@@ -13,6 +13,7 @@ Author : Shunning Jiang
 Date   : Jan 29, 2020
 """
 import ast
+import heapq
 import inspect
 import linecache
 from collections import defaultdict
@@ -396,6 +397,21 @@ class ComponentLevel3( ComponentLevel2 ):
 
     nets = s._floodfill_nets( s._dsl.all_signals, s._dsl.all_adjacency )
 
+    # The signal ancestors of every signal from the innermost one, e.g.,
+    # (s.x.a, s.x) for s.x.a.b, computed once and shared by descendants
+
+    ancestors = {}
+
+    def get_ancestors( x ):
+      try:
+        return ancestors[ x ]
+      except KeyError:
+        pass
+      obj = x.get_parent_object()
+      ret = ( obj, ) + get_ancestors( obj ) if obj.is_signal() else ()
+      ancestors[ x ] = ret
+      return ret
+
     # Then figure out writers: all writes in upblks and their nest objects
 
     writer_prop = {}
@@ -404,10 +420,8 @@ class ComponentLevel3( ComponentLevel2 ):
       for obj in writes:
         writer_prop[ obj ] = True # propagatable
 
-        obj = obj.get_parent_object()
-        while obj.is_signal():
+        for obj in get_ancestors( obj ):
           writer_prop[ obj ] = False
-          obj = obj.get_parent_object()
 
     # Find the host object of every net signal
     # and then leverage the information to find out top level input port
@@ -423,16 +437,16 @@ class ComponentLevel3( ComponentLevel2 ):
            ( isinstance( member, OutPort ) and isinstance( host, Placeholder ) ):
           writer_prop[ member ] = True
 
-    headless = nets
-    headed   = []
-
     # Convention: we store a net in a tuple ( writer, set([readers]) )
     # The first element is writer; it should be None if there is no
     # writer. The second element is a set of signals including the writer.
 
-    while headless:
-      new_headless = []
-      wcount = len(writer_prop)
+    headed   = []
+    resolved = [ False ] * len(nets)
+
+    def resolve( i ):
+      """ Try to resolve the i-th net. Return the objects that get a new
+      or propagatable writer_prop entry, or None if the net is headless. """
 
       # For each net, figure out the writer among all vars and their
       # ancestors. Moreover, if x's ancestor has a writer in another net,
@@ -448,73 +462,112 @@ class ComponentLevel3( ComponentLevel2 ):
       # be a unpropagatable writer because we don't want x[5:15] to
       # propagate to x[12:17] later.
 
-      for net in headless:
-        has_writer = False
+      net = nets[i]
+      has_writer = False
 
-        for v in net:
-          obj = None
-          try:
-            # Check if itself is a writer or a constant
-            if v in writer_prop or isinstance( v, Const ):
-              assert not has_writer
-              has_writer, writer = True, v
+      for v in net:
+        obj = None
+        try:
+          # Check if itself is a writer or a constant
+          if v in writer_prop or isinstance( v, Const ):
+            assert not has_writer
+            has_writer, writer = True, v
 
-            else:
-              # Check if an ancestor is a propagatable writer
-              obj = v.get_parent_object()
-              while obj.is_signal():
+          else:
+            # Check if an ancestor is a propagatable writer
+            for obj in get_ancestors( v ):
+              if obj in writer_prop and writer_prop[ obj ]:
+                assert not has_writer
+                has_writer, writer = True, v
+                break
+
+            # Check sibling slices
+            for obj in v.get_sibling_slices():
+              if obj.slice_overlap( v ):
                 if obj in writer_prop and writer_prop[ obj ]:
                   assert not has_writer
                   has_writer, writer = True, v
+                  # Shunning: is breaking out of here enough? If we
+                  # don't break the loop, we might a list here storing
+                  # "why the writer became writer" and do some sibling
+                  # overlap checks when we enter the loop body later
                   break
-                obj = obj.get_parent_object()
-
-              # Check sibling slices
-              for obj in v.get_sibling_slices():
-                if obj.slice_overlap( v ):
-                  if obj in writer_prop and writer_prop[ obj ]:
-                    assert not has_writer
-                    has_writer, writer = True, v
-                    # Shunning: is breaking out of here enough? If we
-                    # don't break the loop, we might a list here storing
-                    # "why the writer became writer" and do some sibling
-                    # overlap checks when we enter the loop body later
-                    break
-
-          except AssertionError:
-            raise MultiWriterError( \
-            "Two-writer conflict \"{}\"{}, \"{}\" in the following net:\n - {}".format(
-              repr(v), "" if not obj else "(as \"{}\" is written somewhere else)".format( repr(obj) ),
-              repr(writer), "\n - ".join([repr(x) for x in net])) )
-
-        if not has_writer:
-          new_headless.append( net )
-          continue
-
-        # Child s.x.y of some propagatable s.x, or sibling of some
-        # propagatable s[a:b].
-        # This means that at least other variables are able to see s.x/s[a:b]
-        # so it doesn't matter if s.x.y is not in writer_prop
-        if writer not in writer_prop:
-          pass
 
-        for v in net:
-          if v != writer:
-            writer_prop[ v ] = True # The reader becomes new writer
+        except AssertionError:
+          raise MultiWriterError( \
+          "Two-writer conflict \"{}\"{}, \"{}\" in the following net:\n - {}".format(
+            repr(v), "" if not obj else "(as \"{}\" is written somewhere else)".format( repr(obj) ),
+            repr(writer), "\n - ".join([repr(x) for x in net])) )
+
+      if not has_writer:
+        return None
+
+      # Child s.x.y of some propagatable s.x, or sibling of some
+      # propagatable s[a:b].
+      # This means that at least other variables are able to see s.x/s[a:b]
+      # so it doesn't matter if s.x.y is not in writer_prop
+      if writer not in writer_prop:
+        pass
+
+      updated = []
+      for v in net:
+        if v != writer:
+          if not writer_prop.get( v, False ):
+            updated.append( v )
+          writer_prop[ v ] = True # The reader becomes new writer
+
+          for obj in get_ancestors( v ):
+            if obj not in writer_prop:
+              writer_prop[ obj ] = False
+              updated.append( obj )
+
+      resolved[i] = True
+      headed.append( (writer, net) )
+      return updated
+
+    # The first round checks every net in order. Most nets are resolved
+    # here because their writers are written in update blocks.
+
+    for i in range(len(nets)):
+      resolve( i )
+
+    headless = [ i for i in range(len(nets)) if not resolved[i] ]
+
+    # A headless net can only be resolved after one of its members, their
+    # ancestors or their overlapping sibling slices gets a new writer_prop
+    # entry. Instead of rechecking all headless nets round by round until
+    # there is no new writer, which is quadratic for a long chain of nets
+    # that are resolved one per round, we only recheck the nets affected
+    # by a newly resolved net. The worklist is a heap of (round, net
+    # index) so that the nets are resolved in the same order as checking
+    # all headless nets round by round.
 
-            obj = v.get_parent_object()
-            while obj.is_signal():
-              if obj not in writer_prop:
-                writer_prop[ obj ] = False
-              obj = obj.get_parent_object()
-
-        headed.append( (writer, net) )
+    if headless:
+      watchers = defaultdict(list)
+      for i in headless:
+        for v in nets[i]:
+          if not isinstance( v, Const ):
+            watchers[ v ].append( i )
+            for obj in get_ancestors( v ):
+              watchers[ obj ].append( i )
+            for obj in v.get_sibling_slices():
+              if obj.slice_overlap( v ):
+                watchers[ obj ].append( i )
+
+      worklist = [ (1, i) for i in headless ]
+      while worklist:
+        r, i = heapq.heappop( worklist )
+        if resolved[i]:
+          continue
 
-      if wcount == len(writer_prop): # no more new writers
-        break
-      headless = new_headless
+        updated = resolve( i )
+        if updated:
+          for obj in updated:
+            for j in watchers.get( obj, () ):
+              if not resolved[j]:
+                heapq.heappush( worklist, (r if j > i else r + 1, j) )
 
-    return headed + [ (None, x) for x in headless ]
+    return headed + [ (None, nets[i]) for i in headless if not resolved[i] ]
 
   def _check_port_in_nets( s ):
     nets = s._dsl.all_value_nets
@@ -312,12 +312,14 @@ class Signal( NamedObject, Connectable ):
 
     leaf_signals = []
     def recursive_getattr( m, instance ):
-      for x in instance.__dict__:
+      # Use the declared fields since a packed bitstruct instance has no
+      # per-field attributes
+      for x in instance.__bitstruct_fields__:
         signal = getattr( m, x )
         if signal.is_leaf_signal():
           leaf_signals.append( signal )
         else:
-          recursive_getattr( signal, instance.__dict__[x] )
+          recursive_getattr( signal, getattr( instance, x ) )
 
     # OK now it's not Bits or int, let's instantiate it if it's never
     # accessed
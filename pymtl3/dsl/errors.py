@@ -137,6 +137,33 @@ In file {}:{} in {}
       )
     )
 
+class PackedBitstructPartialWriteError( Exception ):
+  """ In update, raise when a slice or a nested field of a field of a
+  packed bitstruct is @= -ed """
+  def __init__( self, hostobj, blk, lineno, obj ):
+    filepath = inspect.getfile( hostobj.__class__ )
+    blk_src, base_lineno  = inspect.getsourcelines( blk )
+
+    # Shunning: we need to subtract 1 from inspect's lineno when we add it
+    # to base_lineno because it starts from 1!
+    lineno -= 1
+    error_lineno = base_lineno + lineno
+
+    return super().__init__( \
+"""
+In file {}:{} in {}
+
+{} {}
+^^^ {} is part of a field of a packed bitstruct. A field of a packed bitstruct is read as a new object, so only the whole field can appear on the left-hand side of '@='
+(when constructing instance {} of class \"{}\" in the hierarchy)
+
+Suggestion: assign the whole field, or make the bitstruct unpacked""".format( \
+      filepath, error_lineno, blk.__name__,
+      error_lineno, blk_src[ lineno ].lstrip(''),
+      repr(obj), repr(hostobj), hostobj.__class__.__name__,
+      )
+    )
+
 class VarNotDeclaredError( Exception ):
   """ Raise when a variable in an update block is not declared """
   def __init__( self, obj, field, blk=None, blk_hostobj=None, lineno=0 ):
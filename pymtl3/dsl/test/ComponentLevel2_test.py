@@ -6,10 +6,13 @@ ComponentLevel2_test.py
 Author : Shunning Jiang
 Date   : Nov 3, 2018
 """
+import ast
+import inspect
 from collections import deque
 
 from pymtl3.datatypes import Bits1, Bits16, Bits32, bitstruct, mk_bits, zext
 from pymtl3.dsl.ComponentLevel1 import update
+from pymtl3.dsl import ComponentLevel2 as L2
 from pymtl3.dsl.ComponentLevel2 import ComponentLevel2, update_ff
 from pymtl3.dsl.Connectable import InPort, Interface, OutPort, Wire
 from pymtl3.dsl.ConstraintTypes import RD, WR, U
@@ -22,6 +25,7 @@ from pymtl3.dsl.errors import (
     UpdateBlockWriteError,
     UpdateFFBlockWriteError,
     UpdateFFNonTopLevelSignalError,
+    PackedBitstructPartialWriteError,
     VarNotDeclaredError,
     WriteNonSignalError,
 )
@@ -289,6 +293,55 @@ def test_invalid_ff_assignment_slice():
     return
   raise Exception("Should've thrown UpdateFFNonTopLevelSignalError.")
 
+def test_invalid_packed_field_slice_assignment():
+
+  @bitstruct( packed=True )
+  class Packed:
+    x: Bits16
+    y: Bits16
+
+  @bitstruct
+  class Unpacked:
+    x: Bits16
+    y: Bits16
+
+  class Top(ComponentLevel2):
+    def construct( s, T ):
+      s.in_ = InPort(Bits16)
+      s.r   = Wire(T)
+
+      @update
+      def upup():
+        s.r.x[0:4] @= s.in_[0:4]
+
+  # Fields of unpacked bitstructs are objects that can be sliced
+  Top( Unpacked ).elaborate()
+
+  try:
+    Top( Packed ).elaborate()
+  except PackedBitstructPartialWriteError as e:
+    print("{} is thrown\n{}".format( e.__class__.__name__, e ))
+    return
+  raise Exception("Should've thrown PackedBitstructPartialWriteError.")
+
+def test_packed_field_assignment():
+
+  @bitstruct( packed=True )
+  class Packed:
+    x: Bits16
+    y: Bits16
+
+  class Top(ComponentLevel2):
+    def construct( s ):
+      s.in_ = InPort(Bits16)
+      s.r   = Wire(Packed)
+
+      @update
+      def upup():
+        s.r.x @= s.in_
+
+  Top().elaborate()
+
 def test_2d_array_vars():
 
   class Top(ComponentLevel2):
@@ -778,3 +831,78 @@ def test_write_interface_update_ff():
     print("{} is thrown\n{}".format( e.__class__.__name__, e ))
     return
   raise Exception("Should've thrown WriteNonSignalError.")
+
+def test_prefetch_update_block_sources():
+
+  class Top(ComponentLevel2):
+    def construct( s ):
+      s.in_ = InPort(Bits32)
+      s.out = OutPort(Bits32)
+      s.tmp = Wire(Bits32)
+
+      @update
+      def up_tmp():
+        s.tmp @= s.in_ + 1
+
+      @update_ff
+      def up_out():
+        s.out <<= s.tmp # a trailing comment
+
+      # A comment after the update block
+
+  L2.prefetch_update_block_sources( 2 )
+
+  x = Top()
+  x.elaborate()
+
+  for blk in x._dsl.upblks:
+    code = blk.__code__
+    src, line = inspect.getsourcelines( blk )
+    assert L2._prefetched_sources[ (code.co_filename, code.co_firstlineno) ] == ( src, line )
+    assert Top._name_info[ blk.__name__ ][1:3] == ( "".join(src), line )
+
+def test_func_cache( tmpdir, monkeypatch ):
+
+  class Top(ComponentLevel2):
+    def construct( s ):
+      s.in_ = InPort(Bits32)
+      s.out = OutPort(Bits32)
+      s.tmp = Wire(Bits32)
+
+      @update
+      def up_tmp():
+        s.tmp @= zext( s.in_[0:16], 32 ) + 1
+
+      @update_ff
+      def up_out():
+        s.out <<= s.tmp
+
+  monkeypatch.setattr( L2, "_func_cache_dir", str(tmpdir) )
+
+  x = Top()
+  x.elaborate()
+  assert len( tmpdir.listdir() ) == 2
+  ref = ( Top._name_info, Top._name_rd, Top._name_wr, Top._name_fc )
+
+  # Another process starts without the class caches
+  for attr in ( '_name_info', '_name_rd', '_name_wr', '_name_fc' ):
+    delattr( Top, attr )
+
+  def fail( *args ):
+    raise AssertionError( "Update blocks should be loaded from the cache" )
+  monkeypatch.setattr( L2.AstHelper, "extract_reads_writes_calls", fail )
+
+  y = Top()
+  y.elaborate()
+  assert Top._name_info.keys() == ref[0].keys()
+  for name in ref[0]:
+    assert Top._name_info[ name ][:4] == ref[0][ name ][:4]
+    assert ast.dump( Top._name_info[ name ][4] ) == ast.dump( ref[0][ name ][4] )
+    for new, old in zip( ( Top._name_rd, Top._name_wr, Top._name_fc ), ref[1:] ):
+      assert [ x[0] for x in new[ name ] ] == [ x[0] for x in old[ name ] ]
+
+  simple_sim_pass( y, 0x123 )
+  y.in_ @= 3
+  y.tick()
+  y.tick()
+  assert y.out == 4
@@ -457,6 +457,45 @@ def test_iterative_find_nets():
 
   _test_model( Top )
 
+def test_iterative_find_nets_long_chain():
+
+  # Each net can only be resolved after the previous one, and the nets
+  # are created in the reverse order
+
+  class Top( ComponentLevel3 ):
+    def construct( s, N ):
+
+      s.w0 = Wire( SomeMsg )
+      s.w  = [ Wire( SomeMsg ) for _ in range(N+1) ]
+      s.v  = [ Wire( SomeMsg ) for _ in range(N) ]
+      connect( s.w[0], s.w0 )
+
+      for i in reversed(range(N)):
+        connect( s.v[i], s.w[i] )
+        connect( s.w[i+1].a, s.v[i].a )
+
+      s.out = [ Wire( Bits16 ) for _ in range(2) ]
+      connect( s.out[0], s.w[N].a[0:16] )
+      connect( s.out[1], s.w[N].a[8:24] )
+
+      @update
+      def up_wr_s_w():
+        s.w0 @= SomeMsg( 12, 123 )
+
+  N = 100
+  A = Top( N )
+  A.elaborate()
+
+  writers = { repr(w): signals for w, signals in A.get_all_value_nets() }
+  assert len(writers) == 2 * N + 2
+  assert "s.w0" in writers
+  for i in range(N):
+    assert f"s.v[{i}].a" in writers
+    if i > 0:
+      assert f"s.w[{i}]" in writers
+  assert "s.w[100].a[0:16]" in writers
+  assert "s.w[100].a[8:24]" in writers
+
 def test_deep_connections():
 
   @bitstruct
@@ -0,0 +1,132 @@
+"""
+========================================================================
+EnergyCollectionPass.py
+========================================================================
+Collect the energy of all components that have an energy attribute into
+preallocated NumPy counters instead of their per-component energy dicts.
+
+Energy events are appended to a fixed-size event buffer as an integer
+code (event type x component id) and the energy value, and the buffer
+is reduced into the (event type x component) counters of the current
+cycle window with a single bincount when it fills up or when the window
+ends. The result is a time series of the energy per event type and
+component for every window, which can be dumped to a compressed npz
+file.
+"""
+import numpy as np
+
+from pymtl3.dsl import MetadataKey
+
+from .energy_plugin import _energy_event_names
+from .EnergyTrackingPass import EnergyTrackingPass
+
+
+class EnergyCollector:
+
+  def __init__( self, components, window, buffer_size ):
+    self.components  = components
+    self.event_names = _energy_event_names
+    self.window      = window
+
+    self._ncomps   = len(components)
+    self._ncodes   = len(self.event_names) * self._ncomps
+    self._codes    = np.zeros( buffer_size, dtype=np.int64 )
+    self._values   = np.zeros( buffer_size, dtype=np.float64 )
+    self._nbuf     = 0
+    self._counters = np.zeros( self._ncodes, dtype=np.float64 )
+    self._cycles   = 0
+    self._windows  = []
+
+  def mk_charge( self, comp_id ):
+    event_codes = { name: i * self._ncomps + comp_id
+                    for i, name in enumerate( self.event_names ) }
+    codes  = self._codes
+    values = self._values
+    size   = len(codes)
+
+    def charge( name, energy ):
+      n = self._nbuf
+      codes[n]  = event_codes[name]
+      values[n] = energy
+      self._nbuf = n = n + 1
+      if n == size:
+        self.flush()
+
+    return charge
+
+  def flush( self ):
+    n = self._nbuf
+    if n:
+      self._counters += np.bincount( self._codes[:n], weights=self._values[:n],
+                                     minlength=self._ncodes )
+      self._nbuf = 0
+
+  def tick( self ):
+    self._cycles += 1
+    if self._cycles == self.window:
+      self.flush()
+      self._windows.append( self._counters.reshape( len(self.event_names), self._ncomps ) )
+      self._counters = np.zeros( self._ncodes, dtype=np.float64 )
+      self._cycles   = 0
+
+  # Reporting
+
+  def series( self ):
+    """ Return the energy of every window as an array of shape
+    (nwindows, nevents, ncomponents). The window that is in progress is
+    included if it has any cycles. """
+    self.flush()
+    windows = list( self._windows )
+    if self._cycles:
+      windows.append( self._counters.reshape( len(self.event_names), self._ncomps ) )
+    if not windows:
+      return np.zeros( (0, len(self.event_names), self._ncomps) )
+    return np.stack( windows )
+
+  def total( self ):
+    return self.series().sum( axis=0 )
+
+  def energy_of( self, component ):
+    comp_id = self.components.index( component )
+    return dict( zip( self.event_names, self.total()[:, comp_id].tolist() ) )
+
+  def dump( self, path ):
+    np.savez_compressed( path, energy=self.series(), window=self.window,
+                         events=np.array( self.event_names ),
+                         components=np.array( [ repr(x) for x in self.components ] ) )
+
+class EnergyCollectionPass( EnergyTrackingPass ):
+
+  #: the number of cycles per window, enables the pass
+  #:
+  #: Type: ``int``; input
+  window = MetadataKey(int)
+
+  #: the collector that holds the energy time series
+  #:
+  #: Type: ``EnergyCollector``; output
+  collector = MetadataKey()
+
+  def __init__( self, buffer_size=65536, toggle_activity=None ):
+    super().__init__( toggle_activity )
+    self.buffer_size = buffer_size
+
+  def __call__( self, top ):
+    if not top.has_metadata( self.window ):
+      return
+
+    window = top.get_metadata( self.window )
+    assert window > 0, f"Energy collection window must be positive, not {window}"
+
+    components = self.collect_energy_components( top )
+    collector  = EnergyCollector( components, window, self.buffer_size )
+    self._comp_ids = { x: i for i, x in enumerate( components ) }
+    self._collector = collector
+
+    super().__call__( top )
+
+    top._sched.schedule_ff.append( collector.tick )
+    top.set_metadata( self.collector, collector )
+
+  def mk_charge( self, component ):
+    return self._collector.mk_charge( self._comp_ids[ component ] )
@@ -0,0 +1,74 @@
+"""
+========================================================================
+EnergyTrackingPass.py
+========================================================================
+Enable energy tracking for Bits arithmetic and bind the energy
+accumulator of each component that has an energy attribute to its
+update blocks, so that the energy of an operation is charged to the
+component whose update block is running without walking stack frames.
+
+Note that only the update blocks that show up in the final schedule are
+bound. Operations in method ports are charged to the calling block.
+Energy tracking is only implemented by the Python Bits. The plain Bits
+operators are restored once no model tracks energy anymore.
+"""
+import warnings
+import weakref
+from functools import partial
+
+from pymtl3.datatypes import PythonBits
+from pymtl3.datatypes.bits_import import Bits
+from pymtl3.datatypes.PythonBits import (
+    disable_energy_tracking,
+    enable_energy_tracking,
+)
+from pymtl3.passes.BasePass import BasePass
+from pymtl3.passes.errors import PassOrderError
+
+from .energy_plugin import bind_energy_charge, mk_energy_charge
+
+
+class EnergyTrackingPass( BasePass ):
+
+  # toggle_activity=None keeps the current activity model if energy
+  # tracking is already enabled
+  def __init__( self, toggle_activity=None ):
+    self.toggle_activity = toggle_activity
+
+  def __call__( self, top ):
+    if not hasattr( top, "_sched" ):
+      raise PassOrderError( "_sched" )
+
+    if Bits is not PythonBits.Bits:
+      warnings.warn( f"Energy tracking is not supported by {Bits.__module__}.Bits. "
+                     f"Set PYMTL_BITS=1 to use the Python Bits." )
+
+    # Bits arithmetic is tracked for the whole process until every model
+    # that enabled it has called top.disable_energy_tracking() or has
+    # been garbage collected
+    handle = enable_energy_tracking( self.toggle_activity )
+    top.disable_energy_tracking = partial( disable_energy_tracking, handle )
+    weakref.finalize( top, disable_energy_tracking, handle )
+
+    self.bind_schedule( top, self.collect_energy_components( top ) )
+
+  @staticmethod
+  def collect_energy_components( top ):
+    return sorted( [ x for x in top.get_all_components() if hasattr( x, "energy" ) ],
+                   key=repr )
+
+  def mk_charge( self, component ):
+    return mk_energy_charge( component.energy )
+
+  def bind_schedule( self, top, components ):
+    charges = { x: self.mk_charge( x ) for x in components }
+    hostobj = top._dsl.all_upblk_hostobj
+
+    def bind( blk ):
+      host = hostobj.get( blk )
+      if host not in charges:
+        return blk
+      return bind_energy_charge( blk, charges[ host ] )
+
+    top._sched.update_schedule = [ bind(blk) for blk in top._sched.update_schedule ]
+    top._sched.schedule_ff     = [ bind(blk) for blk in top._sched.schedule_ff ]
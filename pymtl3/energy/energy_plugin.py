@@ -1,7 +1,6 @@
 import inspect
-from scipy.interpolate import interp1d
+import json
 from collections import defaultdict
-import math
 
 # helper functions
 def _get_func_name():
@@ -22,12 +21,17 @@ def _get_caller():
 # update compute energy
 def update_energy(name, n_elem, mem_byte_width=0, data_activity=1.0):
   _energy = get_energy(name, n_elem, mem_byte_width, data_activity=data_activity)
-  caller = _get_caller()
 
-  if caller is None:
+  # Use the charge function bound by EnergyTrackingPass if there is one
+  # and only fall back to walking the stack frames otherwise
+  charge = _energy_scope[0]
+  if charge is not None:
+    charge(name, _energy)
     return
-  else:
-    _get_caller().energy[name] += _energy
+
+  caller = _get_caller()
+  if caller is not None:
+    caller.energy[name] += _energy
 
 # energy table
 def get_energy(name, n_elem, mem_byte_width, data_activity):
@@ -50,52 +54,187 @@ def get_energy(name, n_elem, mem_byte_width, data_activity):
   return ret
 
 ##################################################
-# dummy energy
+# energy models
 ##################################################
-def get_add_energy(n_elem, data_activity=1.0):
+# An energy model is characterized by a few (size, energy) points per
+# operation. The points are interpolated once when the model is built
+# into dense tables indexed by bitwidth (0..8192) for arithmetic and
+# registers, and by byte width (0..1024) for the per-access energy of
+# memories, so that every lookup during simulation is a list index.
+# Larger sizes fall back to extrapolating the points.
+#
+# A technology file is a json file that maps each operation to its
+# points, e.g.
+#
+#   { "add":  { "size": [0, 9, 13, 25, 33], "energy": [0, ...], "kind": "linear" },
+#     "read": { "size": [0, 16], "energy": [0, 1.992e-12] }, ... }
+#
+# Operations that are missing from the file use the dummy points below.
+
+_MAX_NBITS  = 8192
+_MAX_NBYTES = _MAX_NBITS // 8
+
+_bitwidth_energy_names = ( "add", "sub", "mul", "pipeline", "register" )
+_byte_width_energy_names = ( "read", "write" )
 
-  bit = [0, 9, 13, 25, 33]
-  energy = [0, 1.38e-13, 2.06e-13, 3.04e-13, 3.88e-13]
-  energy = [ele * data_activity for ele in energy]
-  f_energy = interp1d(bit, energy, fill_value='extrapolate', kind='linear')
-  ret = f_energy(n_elem).tolist()
-  return ret
+# dummy energy
+_dummy_energy_points = {
+  "add":      { "size": [0, 9, 13, 25, 33], "energy": [0, 1.38e-13, 2.06e-13, 3.04e-13, 3.88e-13] },
+  "mul":      { "size": [0, 17, 25, 33],    "energy": [0, 1.18e-12, 2.17e-12, 3.13e-12], "kind": "cubic" },
+  "register": { "size": [0, 12, 24, 32],    "energy": [0, 1.55e-13, 2.30e-13, 2.70e-13] },
+  # approximate energy to read/write 128bit(16byte) width memory
+  "read":     { "size": [0, 16], "energy": [0, 1.992e-12] },
+  "write":    { "size": [0, 16], "energy": [0, 1.764e-12] },
+}
+# sub and pipeline share the characterization of add and register
+_dummy_energy_points["sub"]      = _dummy_energy_points["add"]
+_dummy_energy_points["pipeline"] = _dummy_energy_points["register"]
+
+class EnergyModel:
+
+  def __init__( self, name, points ):
+    # scipy takes a while to import, so it is only imported when a model
+    # is built
+    from scipy.interpolate import interp1d
+
+    self.name   = name
+    self.points = points
+    self.funcs  = {}
+    self.tables = {}
+
+    for op, point in points.items():
+      self.funcs[op] = interp1d( point["size"], point["energy"],
+                                 fill_value='extrapolate', kind=point.get("kind", "linear") )
+    for op in _bitwidth_energy_names:
+      self.tables[op] = self.funcs[op]( range(_MAX_NBITS+1) ).tolist()
+    for op in _byte_width_energy_names:
+      self.tables[op] = self.funcs[op]( range(_MAX_NBYTES+1) ).tolist()
+
+  def extrapolate( self, op, size ):
+    """ Return the energy of op for a size beyond its table. """
+    return float( self.funcs[op]( size ) )
+
+  @classmethod
+  def from_file( cls, path, name=None ):
+    with open( path ) as f:
+      points = json.load( f )
+
+    unknown = set(points) - set(_dummy_energy_points)
+    if unknown:
+      raise ValueError( f"Unknown operations {sorted(unknown)} in energy model file {path}" )
+
+    return cls( name or path, { **_dummy_energy_points, **points } )
+
+# The registry of energy models. _energy_tables holds the tables of the
+# active model. The lists are updated in place when switching models so
+# that whoever grabbed a table keeps seeing the active one.
+#
+# The dummy model is only built and activated when an energy is first
+# looked up, so that importing this module doesn't import scipy.
+
+_energy_models = {}
+_energy_tables = { op: [] for op in _bitwidth_energy_names + _byte_width_energy_names }
+_active_energy_model = [ None ]
+
+def register_energy_model(model):
+  _energy_models[model.name] = model
+  return model
+
+def load_energy_model(path, name=None):
+  return register_energy_model( EnergyModel.from_file( path, name ) )
+
+def set_energy_model(name):
+  if name == "dummy" and name not in _energy_models:
+    register_energy_model( EnergyModel( "dummy", _dummy_energy_points ) )
+  model = _energy_models[name]
+  for op, table in model.tables.items():
+    if op in _energy_tables:
+      _energy_tables[op][:] = table
+    else:
+      _energy_tables[op] = list(table)
+  _active_energy_model[0] = model
+
+def _get_active_energy_model():
+  if _active_energy_model[0] is None:
+    set_energy_model( "dummy" )
+  return _active_energy_model[0]
+
+def get_energy_model():
+  return _get_active_energy_model()
+
+def get_energy_table(name):
+  _get_active_energy_model()
+  return _energy_tables[name]
+
+_add_energy      = _energy_tables["add"]
+_sub_energy      = _energy_tables["sub"]
+_mul_energy      = _energy_tables["mul"]
+_register_energy = _energy_tables["register"]
+_pipeline_energy = _energy_tables["pipeline"]
+_read_energy     = _energy_tables["read"]
+_write_energy    = _energy_tables["write"]
+
+# Sizes beyond the tables are extrapolated by the active model. The
+# tables are empty until the first lookup activates the dummy model.
+def lookup_energy(name, table, size):
+  try:
+    return table[size]
+  except IndexError:
+    if _active_energy_model[0] is None:
+      return lookup_energy( name, get_energy_table( name ), size )
+    return _active_energy_model[0].extrapolate( name, size )
+
+def get_add_energy(n_elem, data_activity=1.0):
+  return lookup_energy( "add", _add_energy, n_elem ) * data_activity
 
 def get_sub_energy(n_elem, data_activity=1.0):
-  ret = get_add_energy(n_elem)
-  return ret
+  return lookup_energy( "sub", _sub_energy, n_elem )
 
 def get_mul_energy(n_elem, data_activity=1.0):
-
-  bit = [0, 17, 25, 33]
-  energy = [0, 1.18e-12, 2.17e-12, 3.13e-12]
-
-  energy = [ele * data_activity for ele in energy]
-  f_energy = interp1d(bit, energy, fill_value='extrapolate', kind='cubic')
-  ret = f_energy(n_elem).tolist()
-  return ret
+  return lookup_energy( "mul", _mul_energy, n_elem ) * data_activity
 
 def get_register_energy(n_elem):
-  bit = [0, 12, 24, 32]
-  energy = [0, 1.55e-13, 2.30e-13, 2.70e-13]
-  f_energy = interp1d(bit, energy, fill_value='extrapolate', kind='linear')
-  ret = f_energy(n_elem).tolist()
-  return ret
+  return lookup_energy( "register", _register_energy, n_elem )
 
 def get_pipeline_energy(n_elem):
-  ret = get_register_energy(n_elem)
-  return ret
+  return lookup_energy( "pipeline", _pipeline_energy, n_elem )
 
 def get_mem_read_energy(n_elem, mem_byte_width):
-  num_access = math.ceil(n_elem / mem_byte_width)
-  print(f"read: byte{n_elem}, width:{mem_byte_width}")
-  # approximate energy to read 128bit(16byte) width memory
-  ret = 1.992e-12 * num_access * mem_byte_width/16
-  return ret
+  num_access = (n_elem + mem_byte_width - 1) // mem_byte_width
+  return lookup_energy( "read", _read_energy, mem_byte_width ) * num_access
 
 def get_mem_write_energy(n_elem, mem_byte_width):
-  num_access = math.ceil(n_elem / mem_byte_width)
-  # approximate energy to write 128bit(16byte) width memory
-  ret = 1.764e-12 * num_access * mem_byte_width/16
-  return ret
+  num_access = (n_elem + mem_byte_width - 1) // mem_byte_width
+  return lookup_energy( "write", _write_energy, mem_byte_width ) * num_access
 
+##################################################
+# energy tracking mode
+##################################################
+# When energy tracking is enabled, Bits arithmetic looks up the energy
+# of an operation in the per-bitwidth table of the active energy model,
+# and passes it to _energy_scope[0], the charge function bound to the
+# update block that is currently running. By default a charge function
+# accumulates into the energy dict of the block's host component.
+
+_energy_event_names = _bitwidth_energy_names + _byte_width_energy_names
+
+_energy_scope = [ None ]
+
+def mk_energy_charge(energy):
+  def charge(name, _energy):
+    energy[name] += _energy
+  return charge
+
+def bind_energy_charge(blk, charge):
+  scope = _energy_scope
+
+  def energy_tracked_blk():
+    prev = scope[0]
+    scope[0] = charge
+    try:
+      blk()
+    finally:
+      scope[0] = prev
+
+  energy_tracked_blk.__name__ = blk.__name__
+  return energy_tracked_blk
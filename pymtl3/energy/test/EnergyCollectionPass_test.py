@@ -0,0 +1,98 @@
+#=========================================================================
+# EnergyCollectionPass_test.py
+#=========================================================================
+
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from pymtl3 import *
+from pymtl3.datatypes import PythonBits
+from pymtl3.datatypes.PythonBits import disable_energy_tracking
+
+from ..EnergyCollectionPass import EnergyCollectionPass, EnergyCollector
+from ..energy_plugin import get_energy_table
+
+
+@pytest.fixture
+def energy_tracking():
+  if Bits is not PythonBits.Bits:
+    pytest.skip( "energy tracking requires the Python Bits implementation" )
+  yield
+  disable_energy_tracking()
+
+class Adder( Component ):
+  def construct( s ):
+    s.in_ = InPort( Bits32 )
+    s.out = OutPort( Bits32 )
+    s.energy = defaultdict(float)
+
+    @update
+    def up_add():
+      s.out @= s.in_ + 3
+
+class Top( Component ):
+  def construct( s ):
+    s.in_ = InPort( Bits32 )
+    s.out = OutPort( Bits32 )
+    s.adders = [ Adder() for _ in range(2) ]
+    s.adders[0].in_ //= s.in_
+    s.adders[1].in_ //= s.adders[0].out
+    s.out //= s.adders[1].out
+
+def _run( top, ncycles ):
+  top.sim_reset()
+  collector = top.get_metadata( EnergyCollectionPass.collector )
+  top.in_ @= 5
+  for _ in range(ncycles):
+    top.sim_tick()
+  return collector
+
+def test_energy_collection( energy_tracking ):
+  top = Top()
+  top.apply( DefaultPassGroup( energy_window=4 ) )
+  collector = _run( top, 10 )
+
+  # 3 cycles of reset + 10 cycles, the last window is in progress
+  series = collector.series()
+  assert series.shape == (4, len(collector.event_names), 2)
+
+  add = collector.event_names.index( "add" )
+  table = get_energy_table( "add" )
+  # 5+3 = 8 (4 bits), 8+3 = 11 (4 bits) once per tick and once in reset
+  assert series[-1, add, 0] == pytest.approx( 1 * table[4] )
+  assert series[-1, add, 1] == pytest.approx( 1 * table[4] )
+  assert series[1, add].tolist() == pytest.approx( [ 4 * table[4] ] * 2 )
+
+  # Nothing goes to the energy dicts
+  assert top.adders[0].energy == {}
+  assert collector.energy_of( top.adders[0] )["add"] == pytest.approx( series[:, add, 0].sum() )
+
+def test_energy_collector_buffer_flush( tmp_path ):
+  a, b = Adder(), Adder()
+  collector = EnergyCollector( [ a, b ], window=2, buffer_size=3 )
+  charge_a = collector.mk_charge( 0 )
+  charge_b = collector.mk_charge( 1 )
+
+  for i in range(5):
+    charge_a( "add", 1.0 )
+    charge_b( "read", 2.0 )
+  collector.tick()
+  collector.tick()
+  charge_a( "mul", 0.5 )
+  collector.tick()
+
+  series = collector.series()
+  assert series.shape == (2, len(collector.event_names), 2)
+  assert collector.energy_of( a ) == { **{ x: 0.0 for x in collector.event_names },
+                                       "add": 5.0, "mul": 0.5 }
+  assert collector.energy_of( b )["read"] == 10.0
+
+  path = tmp_path / "energy.npz"
+  collector.dump( str(path) )
+
+  data = np.load( str(path) )
+  assert data["window"] == 2
+  assert data["events"].tolist() == list( collector.event_names )
+  assert data["energy"] == pytest.approx( series )
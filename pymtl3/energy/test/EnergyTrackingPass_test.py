@@ -0,0 +1,153 @@
+#=========================================================================
+# EnergyTrackingPass_test.py
+#=========================================================================
+
+import gc
+from collections import defaultdict
+
+import pytest
+
+from pymtl3 import *
+from pymtl3.datatypes import PythonBits
+from pymtl3.datatypes.PythonBits import (
+    disable_energy_tracking,
+    is_energy_tracking_enabled,
+)
+
+from ..energy_plugin import get_energy_table
+
+
+@pytest.fixture
+def energy_tracking():
+  if Bits is not PythonBits.Bits:
+    pytest.skip( "energy tracking requires the Python Bits implementation" )
+  yield
+  disable_energy_tracking()
+
+class Adder( Component ):
+  def construct( s ):
+    s.in_ = InPort( Bits32 )
+    s.out = OutPort( Bits32 )
+    s.energy = defaultdict(float)
+
+    @update
+    def up_add():
+      s.out @= s.in_ + 3
+
+class Top( Component ):
+  def construct( s ):
+    s.in_ = InPort( Bits32 )
+    s.out = OutPort( Bits32 )
+    s.adder = Adder()
+    s.adder.in_ //= s.in_
+
+    @update
+    def up_top():
+      s.out @= s.adder.out * 2
+
+def test_energy_tracking_off_by_default():
+  assert not is_energy_tracking_enabled()
+
+  top = Top()
+  top.apply( DefaultPassGroup() )
+  top.sim_reset()
+  top.in_ @= 5
+  top.sim_tick()
+  assert top.adder.energy == {}
+
+def test_energy_charged_to_bound_component( energy_tracking ):
+  top = Top()
+  top.apply( DefaultPassGroup( energy=True ) )
+  assert is_energy_tracking_enabled()
+
+  top.sim_reset()
+  top.adder.energy.clear()
+
+  top.in_ @= 5
+  top.sim_eval_combinational()
+  # 5 + 3 = 8 has 4 valid bits. The multiplication happens in top,
+  # which has no energy attribute, so it is not charged anywhere.
+  assert top.adder.energy == { "add": get_energy_table("add")[4] }
+
+  # Operations outside update blocks are not charged
+  Bits32(1) + Bits32(1)
+  assert top.adder.energy == { "add": get_energy_table("add")[4] }
+
+def test_disable_energy_tracking( energy_tracking ):
+  top = Top()
+  top.apply( DefaultPassGroup( energy=True ) )
+  top.sim_reset()
+  disable_energy_tracking()
+  assert not is_energy_tracking_enabled()
+
+  top.adder.energy.clear()
+  top.in_ @= 5
+  top.sim_eval_combinational()
+  assert top.adder.energy == {}
+
+def test_valid_bits():
+  from pymtl3.datatypes.PythonBits import _valid_bits
+
+  def ref( nbits, result ):
+    max_value = 2 ** (nbits-1)
+    result_tmp = result if result < max_value else max_value*2-result
+    return result_tmp.bit_length() if result_tmp else 0
+
+  for nbits in [ 1, 2, 5, 8 ]:
+    for result in range( 2**nbits ):
+      assert _valid_bits( nbits, result ) == ref( nbits, result )
+
+  # No precision loss above 53 bits
+  assert _valid_bits( 128, (1 << 100) + 1 ) == 101
+  assert _valid_bits( 128, (1 << 128) - 1 ) == 1
+  assert _valid_bits( 128, 1 << 127 ) == 128
+
+def test_toggle_activity( energy_tracking ):
+  top = Top()
+  top.apply( DefaultPassGroup( energy="toggle" ) )
+  top.sim_reset()
+
+  top.in_ @= 5
+  top.sim_eval_combinational()
+  top.adder.energy.clear()
+
+  # Same operands as the last operation, nothing toggles
+  top.sim_eval_combinational()
+  assert top.adder.energy == { "add": 0.0 }
+
+  # 5 -> 6 toggles 2 bits of the first operand out of 64 operand bits
+  top.in_ @= 6
+  top.sim_eval_combinational()
+  assert top.adder.energy["add"] == pytest.approx( get_energy_table("add")[4] * 2 / 64 )
+
+def test_energy_tracking_released( energy_tracking ):
+  plain_add  = Bits.__add__
+  plain_iadd = Bits.__dict__.get( "__iadd__" )
+
+  A = Top()
+  A.apply( DefaultPassGroup( energy="toggle" ) )
+  B = Top()
+  B.apply( DefaultPassGroup( energy=True ) )
+
+  # B doesn't inherit the toggle activity model of A
+  B.sim_reset()
+  B.adder.energy.clear()
+  B.in_ @= 5
+  B.sim_eval_combinational()
+  assert B.adder.energy == { "add": get_energy_table("add")[4] }
+
+  # Tracking stays enabled until both models release it
+  A.disable_energy_tracking()
+  assert is_energy_tracking_enabled()
+  B.disable_energy_tracking()
+  assert not is_energy_tracking_enabled()
+  assert Bits.__add__ is plain_add
+  assert Bits.__dict__.get( "__iadd__" ) is plain_iadd
+
+  # A model that is garbage collected releases it too
+  C = Top()
+  C.apply( DefaultPassGroup( energy=True ) )
+  assert is_energy_tracking_enabled()
+  del C
+  gc.collect()
+  assert not is_energy_tracking_enabled()
@@ -0,0 +1,73 @@
+#=========================================================================
+# energy_plugin_test.py
+#=========================================================================
+
+import json
+
+import pytest
+
+from ..energy_plugin import *
+
+
+@pytest.fixture
+def dummy_energy_model():
+  yield
+  set_energy_model( "dummy" )
+
+def test_dummy_energy_tables():
+  assert get_energy_model().name == "dummy"
+
+  assert get_add_energy( 0 ) == 0
+  assert get_add_energy( 9 ) == pytest.approx( 1.38e-13 )
+  assert get_add_energy( 11 ) == pytest.approx( (1.38e-13 + 2.06e-13) / 2 )
+  assert get_add_energy( 9, data_activity=0.5 ) == pytest.approx( 0.69e-13 )
+  assert get_sub_energy( 13 ) == get_add_energy( 13 )
+  assert get_mul_energy( 25 ) == pytest.approx( 2.17e-12 )
+  assert get_pipeline_energy( 24 ) == get_register_energy( 24 ) == pytest.approx( 2.30e-13 )
+
+  assert len( get_energy_table( "add" ) ) == 8193
+  assert len( get_energy_table( "read" ) ) == 1025
+
+def test_mem_energy():
+  # 20 bytes on a 16-byte wide memory takes two accesses
+  assert get_mem_read_energy( 20, 16 ) == pytest.approx( 2 * 1.992e-12 )
+  assert get_mem_write_energy( 16, 16 ) == pytest.approx( 1.764e-12 )
+  assert get_mem_read_energy( 4, 8 ) == pytest.approx( 1.992e-12 / 2 )
+  assert get_energy( "write", 4, 8, 1.0 ) == get_mem_write_energy( 4, 8 )
+
+def test_energy_beyond_tables():
+  # Extrapolated like the points inside the tables
+  assert get_add_energy( 9000 ) == pytest.approx( 9.45e-11, rel=1e-3 )
+  assert get_add_energy( 9000, data_activity=0.5 ) == pytest.approx( 9.45e-11 / 2, rel=1e-3 )
+  assert get_register_energy( 10000 ) > get_register_energy( 8192 )
+  assert get_mem_read_energy( 64, 2048 ) == pytest.approx( 2.55e-10, rel=1e-3 )
+  assert get_mem_write_energy( 4096, 2048 ) == pytest.approx( 2 * 2048 / 16 * 1.764e-12 )
+
+def test_load_energy_model( tmp_path, dummy_energy_model ):
+  path = tmp_path / "tech.json"
+  path.write_text( json.dumps( {
+    "add":  { "size": [0, 32], "energy": [0, 3.2e-13] },
+    "read": { "size": [0, 1],  "energy": [0, 1e-13] },
+  } ) )
+
+  model = load_energy_model( str(path), "tech" )
+  assert model.name == "tech"
+  assert get_energy_model().name == "dummy"
+
+  add_table = get_energy_table( "add" )
+  set_energy_model( "tech" )
+  assert get_energy_model() is model
+
+  # Tables are updated in place
+  assert add_table[16] == pytest.approx( 1.6e-13 )
+  assert get_add_energy( 16 ) == pytest.approx( 1.6e-13 )
+  assert get_mem_read_energy( 32, 16 ) == pytest.approx( 2 * 1.6e-12 )
+  # Missing operations fall back to the dummy model
+  assert get_mul_energy( 25 ) == pytest.approx( 2.17e-12 )
+
+def test_load_energy_model_unknown_op( tmp_path ):
+  path = tmp_path / "tech.json"
+  path.write_text( json.dumps( { "div": { "size": [0, 1], "energy": [0, 1] } } ) )
+
+  with pytest.raises( ValueError ):
+    load_energy_model( str(path) )
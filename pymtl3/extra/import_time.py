@@ -0,0 +1,95 @@
+"""
+========================================================================
+import_time.py
+========================================================================
+Measure the cold import time of pymtl3 and its subpackages. Every
+measurement imports the module in a fresh interpreter, and also reports
+which heavy optional dependencies the import pulled in. With --profile
+it lists the modules that take the longest to import, as reported by
+python -X importtime.
+
+  python -m pymtl3.extra.import_time [-n REPEAT] [--profile] [module ...]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+default_modules = [
+  "pymtl3",
+  "pymtl3.datatypes",
+  "pymtl3.dsl",
+  "pymtl3.passes",
+  "pymtl3.passes.backends.verilog",
+  "pymtl3.passes.backends.yosys",
+  "pymtl3.stdlib.test_utils",
+  "pymtl3.energy",
+]
+
+# Optional or heavy dependencies that are only imported when the
+# features that need them are used
+heavy_modules = [ "scipy", "numpy", "cffi", "greenlet", "hypothesis", "pytest" ]
+
+_measure_src = """
+import sys, time
+t = time.perf_counter()
+import {0}
+t = time.perf_counter() - t
+print( t )
+print( " ".join( x for x in {1!r} if x in sys.modules ) )
+"""
+
+def cold_import( module, importtime=False ):
+  """ Import module in a fresh interpreter. Return the import time in
+  seconds, the heavy modules that got imported, and the -X importtime
+  output if importtime is set. """
+  cmd = [ sys.executable ] + ( [ "-X", "importtime" ] if importtime else [] ) + \
+        [ "-c", _measure_src.format( module, heavy_modules ) ]
+  proc = subprocess.run( cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         universal_newlines=True )
+  if proc.returncode:
+    raise RuntimeError( f"Failed to import {module}:\n{proc.stderr}" )
+
+  t, heavy = proc.stdout.split( "\n" )[:2]
+  return float(t), heavy.split(), proc.stderr
+
+def cold_import_time( module, repeat=5 ):
+  """ Return the median cold import time of module in seconds. """
+  return statistics.median( cold_import( module )[0] for _ in range(repeat) )
+
+def import_profile( module ):
+  """ Return [(self us, cumulative us, name)] of all modules imported by
+  a cold import of module, from the most expensive one. """
+  profile = []
+  for line in cold_import( module, importtime=True )[2].splitlines():
+    if not line.startswith( "import time:" ) or "self [us]" in line:
+      continue
+    self_us, cumulative_us, name = line[ len("import time:"): ].split( "|" )
+    profile.append( ( int(self_us), int(cumulative_us), name.strip() ) )
+  return sorted( profile, reverse=True )
+
+def main():
+  parser = argparse.ArgumentParser( description=__doc__,
+                                    formatter_class=argparse.RawDescriptionHelpFormatter )
+  parser.add_argument( "modules", nargs="*", default=default_modules )
+  parser.add_argument( "-n", "--repeat", type=int, default=5,
+                       help="number of cold imports per module (default: 5)" )
+  parser.add_argument( "--profile", action="store_true",
+                       help="list the most expensive modules of each import" )
+  parser.add_argument( "--top", type=int, default=15,
+                       help="number of modules listed by --profile (default: 15)" )
+  args = parser.parse_args()
+
+  print( f"{'module':40} {'median':>10} {'min':>10}  heavy imports" )
+  for module in args.modules:
+    results = [ cold_import( module ) for _ in range(args.repeat) ]
+    times   = [ t for t, _, _ in results ]
+    print( f"{module:40} {statistics.median(times)*1e3:8.1f}ms {min(times)*1e3:8.1f}ms  "
+           f"{' '.join( results[0][1] ) or '-'}" )
+
+    if args.profile:
+      for self_us, cumulative_us, name in import_profile( module )[:args.top]:
+        print( f"  {self_us/1e3:8.1f}ms self {cumulative_us/1e3:8.1f}ms cumulative  {name}" )
+
+if __name__ == "__main__":
+  main()
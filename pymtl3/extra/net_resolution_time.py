@@ -0,0 +1,141 @@
+"""
+========================================================================
+net_resolution_time.py
+========================================================================
+Measure how long elaboration takes to find the nets of large generated
+designs and resolve their writers. The design is a rows x cols mesh of
+small components with struct ports, where neighbouring nodes are
+connected field by field. On top of the mesh, a relay chain of rows*cols
+struct wires passes one field down the chain. The chain is connected in
+reverse order, so that checking the headless nets round by round only
+finds one new writer per round.
+
+  python -m pymtl3.extra.net_resolution_time [-n ROWSxCOLS ...] [--no-chain]
+"""
+import argparse
+import time
+
+from pymtl3.datatypes import Bits8, bitstruct
+from pymtl3.dsl import Component, InPort, OutPort, Wire, update
+
+#-------------------------------------------------------------------------
+# Generated design
+#-------------------------------------------------------------------------
+
+@bitstruct
+class MeshMsg:
+  a: Bits8
+  b: Bits8
+
+class _MeshNode( Component ):
+
+  def construct( s ):
+    s.in0  = InPort( MeshMsg )
+    s.in1  = InPort( MeshMsg )
+    s.out0 = OutPort( MeshMsg )
+    s.out1 = OutPort( MeshMsg )
+
+    @update
+    def up_node():
+      s.out0.a @= s.in0.a + s.in1.b
+      s.out0.b @= s.in1.a
+      s.out1 @= s.in0
+
+class NetMesh( Component ):
+
+  def construct( s, nrows, ncols, chain=True ):
+    s.in_ = [ InPort( MeshMsg ) for _ in range(nrows + ncols) ]
+    s.out = [ OutPort( MeshMsg ) for _ in range(nrows + ncols) ]
+
+    s.nodes = [ [ _MeshNode() for _ in range(ncols) ] for _ in range(nrows) ]
+
+    for i in range(nrows):
+      for j in range(ncols):
+        x = s.nodes[i][j]
+        if j == 0:
+          x.in0 //= s.in_[i]
+        else:
+          x.in0.a //= s.nodes[i][j-1].out0.a
+          x.in0.b //= s.nodes[i][j-1].out0.b
+
+        if i == 0:
+          x.in1 //= s.in_[nrows + j]
+        else:
+          x.in1 //= s.nodes[i-1][j].out1
+
+      s.out[i] //= s.nodes[i][ncols-1].out0
+
+    for j in range(ncols):
+      s.out[nrows + j] //= s.nodes[nrows-1][j].out1
+
+    # The relay chain. w[k+1].a only gets its writer after the net of
+    # v[k] and w[k] is resolved, which is checked after the net of w[k+1].
+
+    n = nrows * ncols if chain else 0
+
+    s.head = Wire( MeshMsg )
+    s.w    = [ Wire( MeshMsg ) for _ in range(n + 1) ]
+    s.v    = [ Wire( MeshMsg ) for _ in range(n) ]
+    s.tail = OutPort( Bits8 )
+
+    s.w[0] //= s.head
+    for k in reversed(range(n)):
+      s.v[k] //= s.w[k]
+      s.w[k+1].a //= s.v[k].a
+    s.tail //= s.w[n].a
+
+    @update
+    def up_head():
+      s.head @= MeshMsg()
+
+#-------------------------------------------------------------------------
+# Measurement
+#-------------------------------------------------------------------------
+
+def net_resolution_time( nrows, ncols, chain=True ):
+  """ Generate a nrows x ncols mesh, with or without the relay chain, and
+  elaborate it. Return a dict of the number of signals and value nets,
+  the elaboration time and the time of _resolve_value_connections on the
+  elaborated design in seconds. """
+  ret = {}
+  top = NetMesh( nrows, ncols, chain )
+
+  t = time.perf_counter()
+  top.elaborate()
+  ret["elaborate"] = time.perf_counter() - t
+
+  ret["signals"] = len(top._dsl.all_signals)
+  ret["nets"]    = len(top._dsl.all_value_nets)
+
+  t = time.perf_counter()
+  top._resolve_value_connections()
+  ret["resolve"] = time.perf_counter() - t
+  return ret
+
+def _mesh_size( x ):
+  try:
+    nrows, ncols = ( int(y) for y in x.lower().split( "x" ) )
+  except ValueError:
+    raise argparse.ArgumentTypeError( f"expected ROWSxCOLS, not '{x}'" )
+  if nrows < 1 or ncols < 1:
+    raise argparse.ArgumentTypeError( f"mesh size must be positive, not '{x}'" )
+  return nrows, ncols
+
+def main():
+  parser = argparse.ArgumentParser( description=__doc__,
+                                    formatter_class=argparse.RawDescriptionHelpFormatter )
+  parser.add_argument( "-n", "--sizes", type=_mesh_size, nargs="+",
+                       default=[ (40, 40), (100, 100) ],
+                       help="mesh sizes as ROWSxCOLS (default: 40x40 100x100)" )
+  parser.add_argument( "--no-chain", dest="chain", action="store_false",
+                       help="leave out the relay chain" )
+  args = parser.parse_args()
+
+  print( f"{'mesh':>10} {'signals':>8} {'nets':>8} {'elaborate':>10} {'resolve':>10}" )
+  for nrows, ncols in args.sizes:
+    r = net_resolution_time( nrows, ncols, args.chain )
+    print( f"{f'{nrows}x{ncols}':>10} {r['signals']:8} {r['nets']:8} "
+           f"{r['elaborate']:9.3f}s {r['resolve']:9.3f}s" )
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,158 @@
+"""
+========================================================================
+schedule_time.py
+========================================================================
+Measure how long the schedule passes take to schedule the update blocks
+of large generated designs. The design is a grid of small components
+with one update block each, where every block reads two blocks of the
+previous row. Some of the blocks branch, so that Mamba2020Pass has
+blocks of different branchiness to order. A wide grid keeps many blocks
+ready at the same time in the topological sort.
+
+  python -m pymtl3.extra.schedule_time [-n BLOCKS] [-w WIDTH] [pass ...]
+"""
+import argparse
+import time
+
+from pymtl3.datatypes import Bits8
+from pymtl3.dsl import Component, InPort, OutPort, update
+
+#-------------------------------------------------------------------------
+# Generated design
+#-------------------------------------------------------------------------
+
+class _Add( Component ):
+
+  def construct( s ):
+    s.in0 = InPort( Bits8 )
+    s.in1 = InPort( Bits8 )
+    s.out = OutPort( Bits8 )
+
+    @update
+    def up_add():
+      s.out @= s.in0 + s.in1
+
+class _Max( Component ):
+
+  def construct( s ):
+    s.in0 = InPort( Bits8 )
+    s.in1 = InPort( Bits8 )
+    s.out = OutPort( Bits8 )
+
+    @update
+    def up_max():
+      if s.in0 > s.in1:
+        s.out @= s.in0
+      else:
+        s.out @= s.in1
+
+class _Clamp( Component ):
+
+  def construct( s ):
+    s.in0 = InPort( Bits8 )
+    s.in1 = InPort( Bits8 )
+    s.out = OutPort( Bits8 )
+
+    @update
+    def up_clamp():
+      if s.in0 > s.in1:
+        s.out @= s.in1
+      elif s.in0 < 16:
+        s.out @= 16
+      else:
+        s.out @= s.in0
+
+_node_types = [ _Add, _Add, _Max, _Add, _Clamp ]
+
+class ScheduleGrid( Component ):
+
+  def construct( s, nrows, ncols ):
+    s.in_ = InPort( Bits8 )
+    s.out = OutPort( Bits8 )
+
+    s.nodes = [ _node_types[ (i * 7 + j) % len(_node_types) ]()
+                for i in range(nrows) for j in range(ncols) ]
+
+    for i in range(nrows):
+      for j in range(ncols):
+        x = s.nodes[ i * ncols + j ]
+        if i == 0:
+          x.in0 //= s.in_
+          x.in1 //= s.in_
+        else:
+          x.in0 //= s.nodes[ (i-1) * ncols + j ].out
+          x.in1 //= s.nodes[ (i-1) * ncols + (j+1) % ncols ].out
+
+    s.out //= s.nodes[-1].out
+
+#-------------------------------------------------------------------------
+# Measurement
+#-------------------------------------------------------------------------
+
+def _get_schedule_passes():
+  from pymtl3.passes.mamba.Mamba2020Pass import Mamba2020Pass
+  from pymtl3.passes.sim.DynamicSchedulePass import DynamicSchedulePass
+
+  return {
+    "mamba"   : lambda: Mamba2020Pass( print_line_trace=False ),
+    "dynamic" : DynamicSchedulePass,
+  }
+
+def schedule_time( nblocks, width, pass_name ):
+  """ Generate a grid of about nblocks update blocks with width blocks in
+  a row and apply the schedule pass pass_name to it. Return a dict of the
+  elaboration time, the time of the passes that build the DAG and the
+  time of schedule_intra_cycle in seconds. """
+  from pymtl3.passes.sim.GenDAGPass import GenDAGPass
+  from pymtl3.passes.sim.WrapGreenletPass import WrapGreenletPass
+
+  ret = {}
+  width = min( width, nblocks )
+  top = ScheduleGrid( max( 1, nblocks // width ), width )
+
+  t = time.perf_counter()
+  top.elaborate()
+  ret["elaborate"] = time.perf_counter() - t
+
+  t = time.perf_counter()
+  top.apply( GenDAGPass() )
+  top.apply( WrapGreenletPass() )
+  ret["dag"] = time.perf_counter() - t
+
+  schedule_pass = _get_schedule_passes()[ pass_name ]()
+  schedule_intra_cycle = schedule_pass.schedule_intra_cycle
+
+  def timed_schedule_intra_cycle( top ):
+    t = time.perf_counter()
+    schedule_intra_cycle( top )
+    ret["schedule"] = time.perf_counter() - t
+
+  schedule_pass.schedule_intra_cycle = timed_schedule_intra_cycle
+  top.apply( schedule_pass )
+  return ret
+
+def main():
+  parser = argparse.ArgumentParser( description=__doc__,
+                                    formatter_class=argparse.RawDescriptionHelpFormatter )
+  parser.add_argument( "passes", nargs="*", metavar="pass",
+                       help="mamba and/or dynamic (default: both)" )
+  parser.add_argument( "-n", "--blocks", type=int, nargs="+", default=[ 1000, 10000 ],
+                       help="number of update blocks (default: 1000 10000)" )
+  parser.add_argument( "-w", "--width", type=int, default=20,
+                       help="number of update blocks in a row (default: 20)" )
+  args = parser.parse_args()
+
+  passes = args.passes or [ "mamba", "dynamic" ]
+  for x in passes:
+    if x not in _get_schedule_passes():
+      parser.error( f"unknown pass '{x}'" )
+
+  print( f"{'pass':10} {'blocks':>8} {'width':>8} {'elaborate':>10} {'dag':>10} {'schedule':>10}" )
+  for pass_name in passes:
+    for n in args.blocks:
+      r = schedule_time( n, args.width, pass_name )
+      print( f"{pass_name:10} {n:8} {min(args.width, n):8} {r['elaborate']:9.3f}s "
+             f"{r['dag']:9.3f}s {r['schedule']:9.3f}s" )
+
+if __name__ == "__main__":
+  main()
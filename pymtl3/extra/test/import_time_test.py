@@ -0,0 +1,31 @@
+#=========================================================================
+# import_time_test.py
+#=========================================================================
+
+import pytest
+
+from ..import_time import cold_import, import_profile
+
+# Optional dependencies that each subpackage is allowed to pull in
+_allowed_heavy_modules = {
+  "pymtl3.stdlib.test_utils" : { "greenlet" },
+}
+
+@pytest.mark.parametrize( "module", [
+  "pymtl3",
+  "pymtl3.datatypes",
+  "pymtl3.dsl",
+  "pymtl3.passes",
+  "pymtl3.passes.backends.verilog",
+  "pymtl3.stdlib.test_utils",
+  "pymtl3.energy",
+])
+def test_cold_import( module ):
+  t, heavy, _ = cold_import( module )
+  print( f"{module}: {t*1e3:.1f}ms" )
+  assert set(heavy) <= _allowed_heavy_modules.get( module, set() )
+
+def test_import_profile():
+  names = [ name for _, _, name in import_profile( "pymtl3.datatypes" ) ]
+  assert "pymtl3.datatypes.bits_import" in names
+  assert "scipy" not in names
@@ -0,0 +1,25 @@
+#=========================================================================
+# net_resolution_time_test.py
+#=========================================================================
+
+import pytest
+
+from ..net_resolution_time import NetMesh, net_resolution_time
+
+
+@pytest.mark.parametrize( "chain", [ True, False ] )
+def test_net_resolution_time( chain ):
+  t = net_resolution_time( 5, 5, chain )
+  print( t )
+  assert set(t) == { "signals", "nets", "elaborate", "resolve" }
+  assert all( x >= 0 for x in t.values() )
+
+def test_relay_chain_writers():
+  top = NetMesh( 2, 2 )
+  top.elaborate()
+  writers = { repr(writer) for writer, net in top._dsl.all_value_nets }
+  # Every link of the chain gets its writer from the previous one
+  for k in range(4):
+    assert f"s.v[{k}].a" in writers
+  for k in range(1, 4):
+    assert f"s.w[{k}]" in writers
@@ -0,0 +1,15 @@
+#=========================================================================
+# schedule_time_test.py
+#=========================================================================
+
+import pytest
+
+from ..schedule_time import schedule_time
+
+
+@pytest.mark.parametrize( "pass_name", [ "mamba", "dynamic" ] )
+def test_schedule_time( pass_name ):
+  t = schedule_time( 100, 10, pass_name )
+  print( t )
+  assert set(t) == { "elaborate", "dag", "schedule" }
+  assert all( x >= 0 for x in t.values() )
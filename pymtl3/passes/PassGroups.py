@@ -1,6 +1,7 @@
 from .autotick.OpenLoopCLPass import OpenLoopCLPass
 from .BasePass import BasePass
 from .sim.DynamicSchedulePass import DynamicSchedulePass
+from .sim.EventDrivenSchedulePass import EventDrivenSchedulePass
 from .sim.GenDAGPass import GenDAGPass
 from .sim.PrepareSimPass import PrepareSimPass
 from .sim.SimpleSchedulePass import SimpleSchedulePass
@@ -27,12 +28,23 @@ class SimpleSimPass( BasePass ):
 
 class DefaultPassGroup( BasePass ):
   def __init__( s, *, vcdwave=None, textwave=False,
-                      print_line_trace=True, reset_active_high=True ):
+                      print_line_trace=True, reset_active_high=True,
+                      energy=False, event_driven=False, fuse_net_blocks=False,
+                      alias_nets=False, inline_blocks=False, cache_dir=None,
+                      partitions=1, energy_window=None ):
 
     s.vcdwave = vcdwave
     s.textwave = textwave
     s.print_line_trace = print_line_trace
     s.reset_active_high = reset_active_high
+    s.energy = energy
+    s.event_driven = event_driven
+    s.fuse_net_blocks = fuse_net_blocks
+    s.alias_nets = alias_nets
+    s.inline_blocks = inline_blocks
+    s.cache_dir = cache_dir
+    s.partitions = partitions
+    s.energy_window = energy_window
 
   def __call__( s, top ):
 
@@ -43,15 +55,40 @@ class DefaultPassGroup( BasePass ):
       top.set_metadata( PrintTextWavePass.enable, True )
 
     LineTraceParamPass()( top )
-    GenDAGPass()( top )
+    GenDAGPass( cache_dir=s.cache_dir )( top )
     WrapGreenletPass()( top )
     CLLineTracePass()( top )
-    DynamicSchedulePass()( top )
+
+    # event_driven=True only executes the update blocks whose inputs
+    # changed, which pays off for designs with low activity
+    if s.event_driven:
+      EventDrivenSchedulePass( cache_dir=s.cache_dir )( top )
+    else:
+      DynamicSchedulePass( cache_dir=s.cache_dir )( top )
+
     VcdGenerationPass()( top )
     PrintTextWavePass()( top )
 
+    # energy="toggle" derives the data activity from operand toggles
+    toggle_activity = s.energy == "toggle"
+
+    # The energy passes pull in numpy and scipy, so they are only imported
+    # when they are used. energy_window=N collects the energy of every N
+    # cycles into a time series instead of the energy dicts.
+    if s.energy_window:
+      from pymtl3.energy.EnergyCollectionPass import EnergyCollectionPass
+      top.set_metadata( EnergyCollectionPass.window, s.energy_window )
+      EnergyCollectionPass( toggle_activity=toggle_activity )( top )
+    elif s.energy:
+      from pymtl3.energy.EnergyTrackingPass import EnergyTrackingPass
+      EnergyTrackingPass( toggle_activity=toggle_activity )( top )
+
     PrepareSimPass(print_line_trace=s.print_line_trace,
-                   reset_active_high=s.reset_active_high)( top )
+                   reset_active_high=s.reset_active_high,
+                   fuse_net_blocks=s.fuse_net_blocks,
+                   alias_nets=s.alias_nets,
+                   inline_blocks=s.inline_blocks,
+                   partitions=s.partitions)( top )
 
 class AutoTickSimPass( BasePass ):
   def __init__( s, print_line_trace=True ):
@@ -0,0 +1,139 @@
+"""
+========================================================================
+BranchProfiler.py
+========================================================================
+Measure how update blocks branch and how much they execute during a
+warm-up window of the simulation. Mamba2020Pass can then partition meta
+blocks with the measured branchiness instead of the static one.
+
+The profiler traces the line events of update blocks with sys.settrace.
+The outcome of an if statement is the line executed right after its
+test. The measured branchiness of a block is the sum of the entropy in
+bits of its if statements, each weighted by the probability that the
+statement is reached in a call. A branch that always goes one way
+counts as 0. A 50/50 branch reached in every call counts as 1, like in
+CountBranchesLoops. Conditional expressions are on a single line and
+can't be observed, so each keeps the static count of 1. The cost of a
+block is its average number of executed lines per call.
+"""
+import ast
+import sys
+from collections import Counter, defaultdict
+from math import log2
+
+
+def _is_reset_test( node ):
+  # Special case "if s.reset:" -- it's only high for a cycle
+  return isinstance( node, ast.Attribute ) and node.attr == 'reset' and \
+         isinstance( node.value, ast.Name ) and node.value.id == 's'
+
+class _CollectBranches( ast.NodeVisitor ):
+
+  def __init__( self ):
+    self.if_lines  = []
+    self.num_ifexp = 0
+
+  def visit_If( self, node ):
+    if not _is_reset_test( node.test ):
+      self.if_lines.append( node.lineno )
+    self.generic_visit( node )
+
+  def visit_IfExp( self, node ):
+    if not _is_reset_test( node.test ):
+      self.num_ifexp += 1
+    self.generic_visit( node )
+
+class BranchProfiler:
+
+  def __init__( self, top, blocks ):
+    # Update blocks of different instances of a component share the code
+    # object, so we tell them apart by their closure variables.
+    self.block_key = {}
+    self.if_lines  = {}
+    self.num_ifexp = {}
+
+    for blk in blocks:
+      host = top.get_update_block_host_component( blk )
+      info = host.get_update_block_info( blk )
+      if info is None or info[0]: # lambda
+        continue
+
+      code = blk.__code__
+      v = _CollectBranches()
+      v.visit( info[-1] )
+
+      # The cached AST starts at the first line of the block
+      self.if_lines [ code ] = { code.co_firstlineno + x - 1 for x in v.if_lines }
+      self.num_ifexp[ code ] = v.num_ifexp
+
+      try:
+        closure = tuple( id(x.cell_contents) for x in blk.__closure__ or () )
+      except ValueError: # empty cell
+        continue
+      self.block_key[ blk ] = ( code, closure )
+
+    self.ncalls   = Counter()
+    self.nlines   = Counter()
+    # ( key, line of if ) -> Counter of the next lines
+    self.outcomes = defaultdict( Counter )
+
+    self._prev_trace = None
+
+  def start( self ):
+    self._prev_trace = sys.gettrace()
+    sys.settrace( self._trace )
+
+  def stop( self ):
+    sys.settrace( self._prev_trace )
+
+  def _trace( self, frame, event, arg ):
+    code = frame.f_code
+    if event != "call" or code not in self.if_lines:
+      return None
+
+    f_locals = frame.f_locals
+    key = ( code, tuple( id(f_locals[x]) for x in code.co_freevars ) )
+    self.ncalls[ key ] += 1
+
+    if_lines = self.if_lines[ code ]
+    outcomes = self.outcomes
+    nlines   = self.nlines
+    prev     = None
+
+    def trace_lines( frame, event, arg ):
+      nonlocal prev
+      if event == "line":
+        line = frame.f_lineno
+        nlines[ key ] += 1
+        if prev is not None:
+          outcomes[ ( key, prev ) ][ line ] += 1
+        prev = line if line in if_lines else None
+      elif event == "return" and prev is not None:
+        outcomes[ ( key, prev ) ][ None ] += 1
+      return trace_lines
+
+    return trace_lines
+
+  def get_branchiness( self, blk ):
+    """ Return the measured branchiness of blk rounded to an integer, or
+    None if blk has not been executed. """
+    key = self.block_key.get( blk )
+    n   = self.ncalls[ key ]
+    if not n:
+      return None
+
+    br = float( self.num_ifexp[ key[0] ] )
+    for line in self.if_lines[ key[0] ]:
+      counts = self.outcomes.get( ( key, line ) )
+      if counts:
+        visits = sum( counts.values() )
+        entropy = -sum( x / visits * log2( x / visits ) for x in counts.values() )
+        br += entropy * min( 1.0, visits / n )
+    return int( round( br ) )
+
+  def get_cost( self, blk ):
+    """ Return the average number of executed lines per call of blk, or
+    None if blk has not been executed. """
+    key = self.block_key.get( blk )
+    n   = self.ncalls[ key ]
+    return self.nlines[ key ] / n if n else None
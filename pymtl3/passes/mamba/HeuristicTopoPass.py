@@ -116,9 +116,11 @@ class HeuristicTopoPass( UnrollSimPass ):
     self.create_sim_cycle_count( top )
     self.create_lock_unlock_simulation( top )
     top.lock_in_simulation()
+    self.create_update_schedule( top )
 
     self.create_sim_eval_comb( top )
     self.create_sim_tick( top )
+    self.create_sim_run( top )
     self.create_sim_reset( top )
 
   def schedule_intra_cycle( self, top ):
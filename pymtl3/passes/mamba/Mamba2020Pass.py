@@ -10,26 +10,103 @@
 
 import os
 from collections import defaultdict, deque
+from heapq import heappop, heappush
 
 import py
 
-from pymtl3.datatypes import Bits, is_bitstruct_class
 from pymtl3.dsl import MethodPort
 from pymtl3.dsl.errors import UpblkCyclicError
 from pymtl3.extra.pypy import custom_exec
 from pymtl3.passes.BasePass import BasePass, PassMetadata
 from pymtl3.passes.errors import PassOrderError
 
-from ..sim.DynamicSchedulePass import kosaraju_scc
+from ..sim.DynamicSchedulePass import gen_scc_worklist_block, kosaraju_scc
 from ..sim.SimpleSchedulePass import SimpleSchedulePass, dump_dag
+from .BranchProfiler import BranchProfiler
 from .HeuristicTopoPass import CountBranchesLoops
 from .UnrollSimPass import UnrollSimPass
 
 # _DEBUG = True
 _DEBUG = False
 
+try:
+  from pypyjit import dont_trace_here
+except ImportError:
+  dont_trace_here = None
+
+#-------------------------------------------------------------------------
+# BranchinessQueue
+#-------------------------------------------------------------------------
+# The ready queue of the topological sort in schedule_intra_cycle. Items
+# are ordered by ( branchiness, -timestamp ) where the timestamp is the
+# order of push, i.e., pop_min returns the most recently pushed item with
+# the lowest branchiness and pop_max returns the least recently pushed
+# item with the highest branchiness. The items of the same branchiness
+# are kept in a deque, and two heaps of the branchiness values find the
+# lowest and highest nonempty deques, so each operation is O(log B) where
+# B is the number of distinct branchiness values.
+
+class BranchinessQueue:
+
+  def __init__( self ):
+    self.buckets  = {}
+    self.min_heap = []
+    self.max_heap = []
+    self.size     = 0
+
+  def __len__( self ):
+    return self.size
+
+  def push( self, br, item ):
+    bucket = self.buckets.get( br )
+    if bucket is None:
+      bucket = self.buckets[ br ] = deque()
+      heappush( self.min_heap, br )
+      heappush( self.max_heap, -br )
+    bucket.append( item )
+    self.size += 1
+
+  # The heaps may keep the branchiness of the deques that became empty,
+  # and they are dropped lazily here
+
+  def pop_min( self ):
+    heap, buckets = self.min_heap, self.buckets
+    while heap[0] not in buckets:
+      heappop( heap )
+    br = heap[0]
+    return br, self._pop( br, buckets[ br ].pop )
+
+  def pop_max( self ):
+    heap, buckets = self.max_heap, self.buckets
+    while -heap[0] not in buckets:
+      heappop( heap )
+    br = -heap[0]
+    return br, self._pop( br, buckets[ br ].popleft )
+
+  def _pop( self, br, pop ):
+    item = pop()
+    if not self.buckets[ br ]:
+      del self.buckets[ br ]
+    self.size -= 1
+    return item
+
 class Mamba2020Pass( UnrollSimPass ):
 
+  # Branchiness factor is the bound of branchiness in a meta block.
+  branchiness_factor = 20
+
+  # Block factor is the bound of the number of branchy blocks in a
+  # meta block.
+  branchy_block_factor = 6
+
+  # Cost factor is the bound of the number of executed lines in a meta
+  # block. Only the profile-guided mode measures the cost of blocks.
+  cost_factor = 500
+
+  def __init__( self, print_line_trace=True, reset_active_high=True, profile_cycles=0 ):
+    super().__init__( print_line_trace, reset_active_high )
+    self.profile_cycles = profile_cycles
+
   def __call__( self, top ):
     if not hasattr( top._dag, "all_constraints" ):
       raise PassOrderError( "all_constraints" )
@@ -45,6 +122,7 @@ class Mamba2020Pass( UnrollSimPass ):
     self.meta_block_id = 0
     self.branchiness = { x: 0 for x in top._dag.genblks }
     self.only_loop_at_top = { x: False for x in top._dag.genblks }
+    self.cost = defaultdict(int)
     v = CountBranchesLoops()
 
     # Shunning: since each loop turns into call_assembler_r, a pure-loop
@@ -76,11 +154,92 @@ class Mamba2020Pass( UnrollSimPass ):
     self.create_sim_cycle_count( top )
     self.create_lock_unlock_simulation( top )
     top.lock_in_simulation()
+    self.create_update_schedule( top )
 
     self.create_sim_eval_comb( top )
     self.create_sim_tick( top )
+    self.create_sim_run( top )
     self.create_sim_reset( top )
 
+    if self.profile_cycles > 0:
+      self.create_profiled_sim_tick( top )
+
+  #-----------------------------------------------------------------------
+  # create_profiled_sim_tick
+  #-----------------------------------------------------------------------
+  # Profile the update blocks in the first profile_cycles cycles, and then
+  # re-partition the meta blocks with the measured branchiness and cost.
+  # Static branch counts mispredict branches that almost always go one
+  # way, which are cheap for the tracing JIT.
+
+  def create_profiled_sim_tick( self, top ):
+    blocks = [ x for x in top.get_all_update_blocks()
+               if x not in top._dag.blk_greenlet_mapping ]
+    profiler = BranchProfiler( top, blocks )
+
+    sim_tick = top.sim_tick
+    profiled_cycles = 0
+    done = False
+
+    # Callers may keep a reference to this function from before the
+    # repartition, so it forwards to the new sim_tick afterwards.
+    def profiled_sim_tick():
+      nonlocal profiled_cycles, done
+      if done:
+        top.sim_tick()
+        return
+
+      profiler.start()
+      try:
+        sim_tick()
+      finally:
+        profiler.stop()
+
+      profiled_cycles += 1
+      if profiled_cycles >= self.profile_cycles:
+        done = True
+        self.repartition( top, profiler, blocks )
+
+    # The generated sim_run would bypass the profiler, so tick one cycle
+    # at a time until repartition replaces both sim_tick and sim_run.
+    def profiled_sim_run( ncycles, until=None, check_every=1 ):
+      if check_every < 1:
+        raise ValueError( f"check_every must be positive, not {check_every}" )
+      n = 0
+      while n < ncycles and top.sim_run is profiled_sim_run:
+        if until is not None and n % check_every == 0 and until():
+          return n
+        profiled_sim_tick()
+        n += 1
+      if n < ncycles:
+        # Finish the current check_every window before checking until()
+        n += top.sim_run( min( -n % check_every, ncycles - n ) )
+        n += top.sim_run( ncycles - n, until, check_every )
+      return n
+
+    top.sim_tick = profiled_sim_tick
+    top.sim_run  = profiled_sim_run
+
+  def repartition( self, top, profiler, blocks ):
+    top._sched.profiled_branchiness = {}
+    for blk in blocks:
+      br = profiler.get_branchiness( blk )
+      if br is not None:
+        self.branchiness[ blk ] = top._sched.profiled_branchiness[ blk ] = br
+        self.cost[ blk ] = profiler.get_cost( blk )
+
+    self.schedule_ff( top )
+    self.schedule_intra_cycle( top )
+    self.create_update_schedule( top )
+
+    # Creating the sim functions starts the cycle count over
+    cycles = top._sim.simulated_cycles
+    self.create_sim_eval_comb( top )
+    self.create_sim_tick( top )
+    self.create_sim_run( top )
+    self.create_sim_reset( top )
+    top._sim.simulated_cycles = cycles
+
   #-----------------------------------------------------------------------
   # compile_meta_block
   #-----------------------------------------------------------------------
@@ -114,11 +273,8 @@ class Mamba2020Pass( UnrollSimPass ):
 
     # We will use pypyjit.dont_trace_here to compile standalone traces for
     # each meta block
-    try:
-      from pypyjit import dont_trace_here
+    if dont_trace_here is not None:
       dont_trace_here( 0, False, ret.__code__ )
-    except:
-      pass
 
     return ret
 
@@ -144,28 +300,21 @@ class Mamba2020Pass( UnrollSimPass ):
 
     # Divide all blks into meta blocks
 
-    # Branchiness factor is the bound of branchiness in a meta block.
-    branchiness_factor = 20
-
-    # Block factor is the bound of the number of branchy blocks in a
-    # meta block.
-    branchy_block_factor = 6
-
-    cur_meta, cur_br, cur_count = [], 0, 0
+    cur_meta, cur_br, cur_count, cur_cost = [], 0, 0, 0
 
     for i, (br, blk) in enumerate( ffs ):
-      if br == 0:
-        cur_meta.append( blk )
+      cur_meta.append( blk )
+      cur_cost += self.cost[ blk ]
 
-      else: # this means the remaining blocks are all branchy
-        cur_meta.append( blk )
+      if br > 0: # this means the remaining blocks are all branchy
         cur_br += br
         cur_count += 1
 
-        if cur_br >= branchiness_factor or cur_count >= branchy_block_factor:
-          schedule.append( self.compile_meta_block( cur_meta ) )
-          cur_br = cur_count = 0
-          cur_meta = []
+      if cur_br >= self.branchiness_factor or cur_count >= self.branchy_block_factor or \
+         cur_cost >= self.cost_factor:
+        schedule.append( self.compile_meta_block( cur_meta ) )
+        cur_br = cur_count = cur_cost = 0
+        cur_meta = []
 
     if cur_meta:
       schedule.append( self.compile_meta_block( cur_meta ) )
@@ -184,15 +333,13 @@ class Mamba2020Pass( UnrollSimPass ):
     G   = { v: [] for v in V }
     G_T = { v: [] for v in V } # transpose graph
 
-    E = set()
     for (u, v) in top._dag.all_constraints: # u -> v
       if u in V and v in V:
         G  [u].append( v )
         G_T[v].append( u )
-        E.add( (u, v) )
 
     if 'MAMBA_DAG' in os.environ:
-      dump_dag( top, V, E )
+      dump_dag( top, V, { (u, v) for u in V for v in G[u] } )
 
     # Compute SCC using Kosaraju's algorithm
 
@@ -236,9 +383,10 @@ class Mamba2020Pass( UnrollSimPass ):
         # We start bfs from the block that has the least number of input
         # edges in the SCC
         InD = { v: 0 for v in scc }
-        for (u, v) in E: # u -> v
-          if u in scc and v in scc:
-            InD[ v ] += 1
+        for u in scc: # u -> v
+          for v in G[u]:
+            if v in scc:
+              InD[ v ] += 1
         Q.append( max(InD, key=InD.get) )
 
       else:
@@ -262,137 +410,62 @@ class Mamba2020Pass( UnrollSimPass ):
             visited.add( v )
 
       variables = set()
-      for (u, v) in E:
+      for u in scc:
         # Collect all variables that triggers other blocks in the SCC
-        if u in scc and v in scc:
-          variables.update( constraint_objs[ (u, v) ] )
+        for v in G[u]:
+          if v in scc:
+            variables.update( constraint_objs[ (u, v) ] )
 
       if len(variables) == 0:
         raise UpblkCyclicError("There is a cyclic dependency without involving variables."
                         "Probably a loop that involves blocks that should be update_once:\n{}"\
                         .format(", ".join( [ x.__name__ for x in scc] )))
 
-      # generate a loop for scc
-      # Shunning: we just simply loop over the whole SCC block
-      # TODO performance optimizations using Mamba techniques within a SCC block
-
-      template = """
-from copy import deepcopy
-def wrapped_SCC_{0}():
-  N = 0
-  while True:
-    N += 1
-    if N > 100:
-      raise UpblkCyclicError("Combinational loop detected at runtime in {{{4}}} after 100 iters!")
-    {1}
-    {3}
-    {2}
-    # print( "SCC block{0} is executed", N, "times" )
-    break
-generated_block = wrapped_SCC_{0}
-"""
-
-      # clean up non-top variables if top is there. For slices of Bits
-      # we directly use the top level wide Bits since Bits clone is
-      # rpython code
-
-      final_variables = set()
-
-      for x in sorted( variables, key=repr ):
-        w = x.get_top_level_signal()
-        if w is x:
-          final_variables.add( x )
-          continue
-
-        # w is not x
-        if issubclass( w._dsl.Type, Bits ):
-          if w not in final_variables:
-            final_variables.add( w )
-        elif is_bitstruct_class( w._dsl.Type ):
-          if w not in final_variables:
-            final_variables.add( x )
-        else:
-          final_variables.add( x )
-
-      # also group them by common ancestor to reduce byte code
-      # TODO use longest-common-prefix (LCP) algorithms ...
-
-      final_var_host = defaultdict(list)
-      for x in final_variables:
-        final_var_host[ x.get_host_component() ].append( x )
-
-      # Then, we generate the Python code that saves variables at the
-      # beginning of each SCC iteration and the code that checks if the
-      # values of those variables have changed
-      copy_srcs  = []
-      check_srcs = []
-
-      var_id = 0
-      for host, var_list in final_var_host.items():
-        hostlen = len(repr(host))
-
-        copy_srcs.append( f"host = {host!r}" )
-        check_srcs.append( f"host = {host!r}" )
-
-        sub_check_srcs = []
-
-        for var in var_list:
-          var_id += 1
-          subname = repr(var)[hostlen+1:]
-          if issubclass( var._dsl.Type, Bits ):     copy_srcs.append( f"t{var_id}=host.{subname}.clone()" )
-          elif is_bitstruct_class( var._dsl.Type ): copy_srcs.append( f"t{var_id}=host.{subname}.clone()" )
-          else:                                     copy_srcs.append( f"t{var_id}=deepcopy(host.{subname})" )
-
-          sub_check_srcs.append( f"host.{subname} != t{var_id}" )
-
-        check_srcs.append( f"if { ' or '.join(sub_check_srcs)}: continue" )
-
       # Divide all blks into meta blocks
-      # Branchiness factor is the bound of branchiness in a meta block.
-      branchiness_factor = 20
-      branchy_block_factor = 6
+      branchiness_factor   = self.branchiness_factor
+      branchy_block_factor = self.branchy_block_factor
+      cost_factor          = self.cost_factor
 
       num_blks = 0  # sanity check
-      cur_meta, cur_br, cur_count = [], 0, 0
+      cur_meta, cur_br, cur_count, cur_cost = [], 0, 0, 0
       scc_schedule = []
 
-      _globals = { 's': top, 'UpblkCyclicError': UpblkCyclicError }
-      blk_srcs = []
-
       # If there is only 10 blocks, we directly unroll it
       if len(tmp_schedule) < 10:
-        blk_srcs = []
-        for i, b in enumerate(tmp_schedule):
-          blk_srcs.append( f"blk{i}() # [br {self.branchiness[b]}, loop {int(self.only_loop_at_top[b])}] {b.__name__}" )
-          _globals[f"blk{i}"] = b # put it into the block's closure
+        groups = [ ( b, [b] ) for b in tmp_schedule ]
 
       else:
         for i, blk in enumerate( tmp_schedule ):
           # Same here. If an update block only has top-level loop, br = 0
           br = 0 if self.only_loop_at_top[blk] else self.branchiness[blk]
+          cost = self.cost[blk]
           if cur_br == 0:
             cur_meta.append( blk )
             cur_br += br
             cur_count += (br > 0)
-            if cur_br >= branchiness_factor or cur_count >= branchy_block_factor:
+            cur_cost += cost
+            if cur_br >= branchiness_factor or cur_count >= branchy_block_factor or \
+               cur_cost >= cost_factor:
               num_blks += len(cur_meta)
               scc_schedule.append( cur_meta )
-              cur_meta, cur_br, cur_count = [], 0, 0 # clear
+              cur_meta, cur_br, cur_count, cur_cost = [], 0, 0, 0 # clear
           else:
             if br == 0:
               # If no branchy block available, directly start a new metablock
               num_blks += len(cur_meta)
               scc_schedule.append( cur_meta )
-              cur_meta, cur_br, cur_count = [ blk ], br, (br > 0)
+              cur_meta, cur_br, cur_count, cur_cost = [ blk ], br, (br > 0), cost
             else:
               cur_meta.append( blk )
               cur_br += br
               cur_count += (br > 0)
+              cur_cost += cost
 
-              if cur_br + br >= branchiness_factor or cur_count + 1 >= branchy_block_factor:
+              if cur_br + br >= branchiness_factor or cur_count + 1 >= branchy_block_factor or \
+                 cur_cost >= cost_factor:
                 num_blks += len(cur_meta)
                 scc_schedule.append( cur_meta )
-                cur_meta, cur_br, cur_count = [], 0, 0 # clear
+                cur_meta, cur_br, cur_count, cur_cost = [], 0, 0, 0 # clear
 
         if cur_meta:
           num_blks += len(cur_meta)
@@ -401,40 +474,14 @@ generated_block = wrapped_SCC_{0}
         assert num_blks == len(tmp_schedule), f"Some blocks are missing during trace breaking of SCC "\
                                               f"({num_blks} compiled, {len(tmp_schedule)} total)"
 
-        blk_srcs = []
-
         if len(scc_schedule) == 1:
-          for i, b in enumerate( scc_schedule[-1] ):
-            blk_srcs.append( f"blk{i}() # [br {self.branchiness[b]}, loop {int(self.only_loop_at_top[b])}] {b.__name__}" )
-            _globals[ f"blk{i}" ] = b
-
+          groups = [ ( b, [b] ) for b in scc_schedule[-1] ]
         else:
-          # TODO we might turn all meta blocks before the last one into meta
-          # blocks, and directly fold the last block into the main loop
-          # for i, meta in enumerate( scc_schedule[:-1] ):
-            # b = self.compile_meta_block( meta )
-            # blk_srcs.append( f"{b.__name__}()" )
-            # _globals[ b.__name__ ] = b
-
-          # for i, b in enumerate( scc_schedule[-1] ):
-            # blk_srcs.append( f"blk_of_last_meta{i}() # [br {self.branchiness[b]}, loop {int(self.only_loop_at_top[b])}] {b.__name__}" )
-            # _globals[ f"blk_of_last_meta{i}" ] = b
-
-          for i, meta in enumerate( scc_schedule ):
-            b = self.compile_meta_block( meta )
-            blk_srcs.append( f"{b.__name__}()" )
-            _globals[ b.__name__ ] = b
-
-
-      scc_block_src = template.format( scc_id, "; ".join( copy_srcs ), "\n    ".join( check_srcs ),
-                                       '\n    '.join(blk_srcs),
-                                       ", ".join( [ x.__name__ for x in scc] ) )
+          groups = [ ( self.compile_meta_block( meta ), meta ) for meta in scc_schedule ]
 
-      if _DEBUG: print(scc_block_src, "\n", "="*100 )
-
-      _locals  = {}
-      custom_exec(py.code.Source( scc_block_src ).compile(), _globals, _locals)
-      return _locals[ 'generated_block' ]
+      # Only re-execute the blocks or meta blocks whose inputs changed
+      if _DEBUG: print( [ x.__name__ for x, _ in groups ] )
+      return gen_scc_worklist_block( top, scc_id, groups )
 
     # Now we generate meta blocks for each SCC and produce final schedule
 
@@ -457,88 +504,69 @@ generated_block = wrapped_SCC_{0}
       for v in vs:
         InD[ v ] += 1
 
-    # Shunning: reuse this binary search from TraceBreakingPass. Not the
-    # most efficient one. Ideally we want to use two heaps or a balanced
-    # binary search tree ... TODO
-
-    def insert_sortedlist( arr, key, item ):
-      left, right = -1, len(arr)
-      while left + 1 < right:
-        mid = (left + right) >> 1
-        if arr[mid][0] <= key:
-          left = mid
-        else:
-          right = mid
-      arr.insert( right, ( key, item ) )
-
     # scc_pred is for heuristic hamiltonian path ... It records for each
     # scc, in the schedule who is the predecessor that reduce its input
     # degree to zero.
     scc_pred = {}
 
-    Q = []
-    cnt = 0
+    Q = BranchinessQueue()
 
     # Put the graph input nodes into the queue
     for v in range(len(SCCs)):
       if not InD[v]:
-        cnt += 1
         scc_pred[v] = None
         if v in nontrivial_sccs or v in trivial_loop_sccs:
-          insert_sortedlist( Q, (0, -cnt), v )
+          Q.push( 0, v )
         else:
-          insert_sortedlist( Q, (self.branchiness[list(SCCs[v])[0]], -cnt), v )
+          Q.push( self.branchiness[list(SCCs[v])[0]], v )
 
     schedule = []
 
-    # Branchiness factor is the bound of branchiness in a meta block.
-    branchiness_factor = 20
-
-    # Block factor is the bound of the number of branchy blocks in a
-    # meta block.
-    branchy_block_factor = 6
+    branchiness_factor   = self.branchiness_factor
+    branchy_block_factor = self.branchy_block_factor
+    cost_factor          = self.cost_factor
 
     # refactored code ...
     def expand_node( u ):
-      nonlocal cnt
       for v in G_new[u]:
         InD[v] -= 1
         if not InD[v]:
-          cnt += 1
           scc_pred[ v ] = u
           # Now we use (br, timestamp) as the key because we want to kind
           # of preserve DFS behavior on top of the branch priority
           # Basically we want to pop in a DFS order such that the variable
           # most recently written can directly feed into the next block
           if v in nontrivial_sccs or v in trivial_loop_sccs:
-            insert_sortedlist( Q, (0, -cnt), v )
+            Q.push( 0, v )
           else:
-            insert_sortedlist( Q, (self.branchiness[list(SCCs[v])[0]], -cnt), v )
+            Q.push( self.branchiness[list(SCCs[v])[0]], v )
 
     # Run topological sort
 
     cur_meta = []
-    cur_br = cur_count = 0
+    cur_br = cur_count = cur_cost = 0
 
     while Q:
       if cur_br == 0:
-        (br, _), u = Q.pop(0)
+        br, u = Q.pop_min()
 
         cur_meta.append( compile_scc(u) )
         cur_br += br
         cur_count += (br > 0)
+        cur_cost += sum( self.cost[x] for x in SCCs[u] )
 
-        if cur_br >= branchiness_factor:
+        if cur_br >= branchiness_factor or cur_cost >= cost_factor:
           schedule.append( cur_meta )
-          cur_meta, cur_br, cur_count = [], 0, 0
+          cur_meta, cur_br, cur_count, cur_cost = [], 0, 0, 0
 
       else:
-        (br, _), u = Q.pop()
+        br, u = Q.pop_max()
+        cost = sum( self.cost[x] for x in SCCs[u] )
 
         # If no branchy block available, directly start a new metablock
         if br == 0:
           schedule.append( cur_meta )
-          cur_meta, cur_br, cur_count = [], 0, 0
+          cur_meta, cur_br, cur_count, cur_cost = [], 0, 0, cost
 
           cur_meta.append( compile_scc(u) )
 
@@ -547,10 +575,12 @@ generated_block = wrapped_SCC_{0}
           cur_meta.append( compile_scc(u) )
           cur_br += br
           cur_count += (br > 0)
+          cur_cost += cost
 
-          if cur_br + br >= branchiness_factor or cur_count + 1 >= branchy_block_factor:
+          if cur_br + br >= branchiness_factor or cur_count + 1 >= branchy_block_factor or \
+             cur_cost >= cost_factor:
             schedule.append( cur_meta )
-            cur_meta, cur_br, cur_count = [], 0, 0
+            cur_meta, cur_br, cur_count, cur_cost = [], 0, 0, 0
 
       expand_node( u )
 
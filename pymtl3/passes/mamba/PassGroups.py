@@ -38,10 +38,12 @@ class HeuTopoUnrollSim( BasePass ):
                       reset_active_high=s.reset_active_high)( top )
 
 class Mamba2020( BasePass ):
-  def __init__( s, *, waveform=None, print_line_trace=True, reset_active_high=True ):
+  def __init__( s, *, waveform=None, print_line_trace=True, reset_active_high=True,
+                      profile_cycles=0 ):
     s.waveform = waveform
     s.print_line_trace = print_line_trace
     s.reset_active_high = reset_active_high
+    s.profile_cycles = profile_cycles
 
   def __call__( s, top ):
     top.elaborate()
@@ -51,4 +53,5 @@ class Mamba2020( BasePass ):
       CLLineTracePass()( top )
       LineTraceParamPass()( top )
     Mamba2020Pass(print_line_trace=s.print_line_trace,
-                  reset_active_high=s.reset_active_high)( top )
+                  reset_active_high=s.reset_active_high,
+                  profile_cycles=s.profile_cycles)( top )
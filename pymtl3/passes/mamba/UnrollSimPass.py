@@ -34,7 +34,7 @@ def compile_unroll( schedule ):
   return unrolled
         """.format( ";".join( [ f"_{idx}_{x.__name__}=schedule[{idx}]"
                                 for idx, x in enumerate( funclist ) ] ),
-                       "\n    ".join( strs ) )
+                       "\n    ".join( strs ) or "pass" )
 
     l = {}
     exec(py.code.Source( gen_tick_src ).compile(), l)
@@ -65,4 +65,5 @@ def compile_unroll( schedule ):
     final_schedule += self.collect_ff_funcs( top )
     final_schedule += top._sched.update_schedule
     final_schedule.append( top._sim.check_top_level_inports )
+    top._sim.tick_schedule = final_schedule
     top.sim_tick = self.gen_tick_function( final_schedule )
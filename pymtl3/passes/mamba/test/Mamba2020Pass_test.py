@@ -1,7 +1,10 @@
+import random
+
 from pymtl3.datatypes import Bits32
 from pymtl3.dsl import *
 from pymtl3.dsl.errors import UpblkCyclicError
 
+from ..Mamba2020Pass import BranchinessQueue
 from ..PassGroups import Mamba2020
 
 
@@ -143,3 +146,137 @@ def test_update_once():
     return
 
   raise Exception("Should've thrown UpblkCyclicError")
+
+def test_profile_guided_partitioning():
+
+  class Ctrl(Component):
+    def construct( s ):
+      s.in_  = InPort(Bits32)
+      s.out  = OutPort(Bits32)
+      s.mode = Wire(Bits32)
+
+      # Five branches that always go the same way
+      @update_ff
+      def ff():
+        if s.reset:
+          s.out <<= 0
+        elif s.mode == 1:
+          s.out <<= 1
+        elif s.mode == 2:
+          s.out <<= 2
+        elif s.mode == 3:
+          s.out <<= 3
+        elif s.mode == 4:
+          s.out <<= 4
+        elif s.mode == 5:
+          s.out <<= 5
+        else:
+          s.out <<= s.out + s.in_
+
+  class Top(Component):
+    def construct( s, N=10 ):
+      s.in_ = InPort(Bits32)
+      s.ctrls = [ Ctrl() for i in range(N) ]
+      for i in range(N):
+        s.ctrls[i].in_ //= s.in_
+
+      s.out = OutPort(Bits32)
+      s.out //= s.ctrls[N-1].out
+
+  def run( **kwargs ):
+    A = Top()
+    A.apply( Mamba2020( print_line_trace=False, **kwargs ) )
+    A.sim_reset()
+
+    # Keep the tick function from before the repartition
+    tick = A.sim_tick
+    num_ff_meta = [ len(A._sched.schedule_ff) ]
+    trace = []
+    for i in range(10):
+      A.in_ @= i
+      tick()
+      trace.append( int(A.out) )
+    num_ff_meta.append( len(A._sched.schedule_ff) )
+    return A, tick, trace, num_ff_meta
+
+  _, _, ref, ref_meta = run()
+  A, tick, trace, num_meta = run( profile_cycles=5 )
+  assert trace == ref
+  assert ref_meta == [ 3, 3 ]
+  assert num_meta[0] == 3
+
+  # The measured branchiness is 0, so all blocks go to one meta block
+  assert num_meta[1] == 1
+  assert set( A._sched.profiled_branchiness.values() ) == { 0 }
+  assert A.sim_cycle_count() == 10 + 3
+
+  # The repartition only runs once
+  schedule_ff = A._sched.schedule_ff
+  for i in range(3):
+    tick()
+  assert A._sched.schedule_ff is schedule_ff
+  assert A.sim_cycle_count() == 13 + 3
+
+def test_large_scc():
+
+  class Max(Component):
+    def construct( s, v ):
+      s.in_ = InPort(Bits32)
+      s.v   = InPort(Bits32)
+      s.out = OutPort(Bits32)
+
+      @update
+      def up():
+        if s.in_ > s.v:
+          s.out @= s.in_
+        else:
+          s.out @= s.v
+
+  class Top(Component):
+    def construct( s, N=12 ):
+      s.in_ = InPort(Bits32)
+      s.out = OutPort(Bits32)
+      s.maxs = [ Max( i ) for i in range(N) ]
+      for i in range(N):
+        s.maxs[i].in_ //= s.maxs[i-1].out
+        s.maxs[i].v //= s.in_ if i == 0 else i
+      s.out //= s.maxs[N-1].out
+
+  A = Top()
+  A.apply( Mamba2020( print_line_trace=False ) )
+  A.sim_reset()
+
+  # The 12 branchy blocks are partitioned into meta blocks in the SCC
+  for x in [ 3, 20 ]:
+    A.in_ @= x
+    A.sim_eval_combinational()
+    assert A.out == max( x, 11 )
+
+def test_branchiness_queue():
+  # The sorted list that the queue replaces
+  def insert_sortedlist( arr, key, item ):
+    left, right = -1, len(arr)
+    while left + 1 < right:
+      mid = (left + right) >> 1
+      if arr[mid][0] <= key:
+        left = mid
+      else:
+        right = mid
+    arr.insert( right, ( key, item ) )
+
+  rng = random.Random( 0 )
+  Q, ref = BranchinessQueue(), []
+  for cnt in range(5000):
+    op = rng.random()
+    if op < 0.5 or not ref:
+      br = rng.choice( [ 0, 0, 0, 1, 2, 5 ] )
+      Q.push( br, cnt )
+      insert_sortedlist( ref, (br, -cnt), cnt )
+    elif op < 0.8:
+      (br, _), u = ref.pop(0)
+      assert Q.pop_min() == ( br, u )
+    else:
+      (br, _), u = ref.pop()
+      assert Q.pop_max() == ( br, u )
+    assert len(Q) == len(ref)
+
@@ -0,0 +1,317 @@
+"""
+========================================================================
+BlockInliner.py
+========================================================================
+Generate a single function that executes a schedule of update blocks
+and net blocks with the bodies of the blocks inlined, instead of calling
+every block.
+
+A block is inlined if it is an update block whose AST is cached by
+_cache_func_meta or a net block generated by GenDAGPass, and its body is
+straight-line code that can be moved into another function: it has no
+return, yield, global/nonlocal statement or nested scope. The names of
+its local variables are prefixed to avoid conflicts with other blocks.
+Closure variables are bound once in the namespace of the generated
+function. Global functions, classes and modules are bound once too,
+while other globals are looked up in the module of the block every time
+because they may be reassigned. All other entries of the schedule are
+called as usual.
+
+Attribute chains like s.dpath.alu.in0 through the hierarchy are bound to
+local variables at the beginning of the generated function, so that each
+of them is looked up once per call instead of every time a block uses it.
+A chain is bound if every step is an attribute of a component/interface
+or a constant index into a list of them, and it ends at a component, an
+interface, such a list or a signal. Signals are updated in place by @=
+and <<=, so the bound objects stay valid for the whole call.
+"""
+import ast
+import builtins
+import sys
+import types
+from copy import deepcopy
+
+from pymtl3.dsl.NamedObject import NamedObject
+from pymtl3.extra.pypy import custom_exec
+
+# Global objects that are not expected to be reassigned
+_STABLE_TYPES = ( types.ModuleType, types.FunctionType, types.BuiltinFunctionType, type )
+
+# Nodes that can't be moved into another function
+_UNSUPPORTED_NODES = ( ast.Return, ast.Yield, ast.YieldFrom, ast.Await,
+                       ast.Global, ast.Nonlocal, ast.Lambda, ast.FunctionDef,
+                       ast.AsyncFunctionDef, ast.ClassDef, ast.ListComp,
+                       ast.SetComp, ast.DictComp, ast.GeneratorExp )
+
+class _NotInlinable( Exception ):
+  pass
+
+def _const_index( node ):
+  if sys.version_info < (3, 9):
+    node = node.value if isinstance( node, ast.Index ) else None
+  if sys.version_info < (3, 8):
+    return node.n if isinstance( node, ast.Num ) and type(node.n) is int else None
+  return node.value if isinstance( node, ast.Constant ) and type(node.value) is int else None
+
+class _RenameNames( ast.NodeTransformer ):
+
+  def __init__( self, names, hoist=None ):
+    self.names = names
+    self.hoist = hoist
+
+  def generic_visit( self, node ):
+    if isinstance( node, _UNSUPPORTED_NODES ):
+      raise _NotInlinable()
+    return super().generic_visit( node )
+
+  def visit_Attribute( self, node ):
+    # A plain assignment replaces the object, so only the prefix of the
+    # target can be bound
+    if self.hoist is not None and isinstance( node.ctx, ast.Load ):
+      new = self.hoist( node, self.names )
+      if new is not None:
+        return ast.copy_location( ast.Name( id=new, ctx=node.ctx ), node )
+    return self.generic_visit( node )
+
+  visit_Subscript = visit_Attribute
+
+  def visit_AugAssign( self, node ):
+    # @= and <<= update the target in place and return it
+    if self.hoist is not None and isinstance( node.op, (ast.MatMult, ast.LShift) ) and \
+       isinstance( node.target, (ast.Attribute, ast.Subscript) ):
+      new = self.hoist( node.target, self.names )
+      if new is not None:
+        node.target = ast.copy_location( ast.Name( id=new, ctx=ast.Store() ), node.target )
+        node.value  = self.visit( node.value )
+        return node
+    return self.generic_visit( node )
+
+  def visit_Name( self, node ):
+    try:
+      new = self.names[ node.id ]
+    except KeyError:
+      return node
+
+    # A global that has to be looked up in the module every time
+    if isinstance( new, ast.AST ):
+      if not isinstance( node.ctx, ast.Load ):
+        raise _NotInlinable()
+      return ast.copy_location( deepcopy( new ), node )
+
+    return ast.copy_location( ast.Name( id=new, ctx=node.ctx ), node )
+
+class BlockInliner:
+
+  def __init__( self, top ):
+    self.top = top
+    self._globals = {}
+    self.num_inlined = 0
+    self.num_called  = 0
+    self._num_blocks = 0
+
+    # ( id(parent), attribute or index ) of all signals
+    self._signal_slots = { ( id(obj), i ) for obj, i, _, _ in
+                           top._sim.signal_object_mapping.values() }
+    self._hoisted  = {}
+    self._prologue = []
+
+  #-----------------------------------------------------------------------
+  # hoist
+  #-----------------------------------------------------------------------
+  # Return the name of the local variable that the attribute chain node
+  # is bound to, or None if node is not a chain that can be bound. names
+  # maps the names in the original block to the names in the generated
+  # function.
+
+  def hoist( self, node, names ):
+    steps = []
+    while isinstance( node, (ast.Attribute, ast.Subscript) ):
+      if isinstance( node, ast.Attribute ):
+        steps.append( node.attr )
+      else:
+        idx = _const_index( node.slice )
+        if idx is None:
+          return None
+        steps.append( idx )
+      node = node.value
+
+    if not isinstance( node, ast.Name ):
+      return None
+    name = names.get( node.id )
+    if not isinstance( name, str ) or name not in self._globals:
+      return None
+
+    obj = self._globals[ name ]
+    steps.reverse()
+
+    for j, step in enumerate( steps ):
+      key = ( id(obj), step )
+      if key in self._hoisted:
+        name, obj = self._hoisted[ key ]
+        continue
+
+      if isinstance( step, str ):
+        if not isinstance( obj, NamedObject ) or step not in obj.__dict__:
+          return None
+        child = obj.__dict__[ step ]
+        expr  = f"{name}.{step}"
+      else:
+        if not isinstance( obj, list ) or not ( 0 <= step < len(obj) ):
+          return None
+        child = obj[ step ]
+        expr  = f"{name}[{step}]"
+
+      # Don't look into the fields of signals
+      if key in self._signal_slots:
+        if j != len(steps) - 1:
+          return None
+      elif not isinstance( child, NamedObject ) and \
+           not ( isinstance( child, list ) and child and
+                 all( isinstance( x, (NamedObject, list) ) or ( id(child), i ) in self._signal_slots
+                      for i, x in enumerate( child ) ) ):
+        return None
+
+      name = f"_h{len(self._hoisted)}"
+      obj  = child
+      self._hoisted[ key ] = ( name, obj )
+      self._prologue.extend( ast.parse( f"{name} = {expr}" ).body )
+
+    return name
+
+  #-----------------------------------------------------------------------
+  # get_block_body
+  #-----------------------------------------------------------------------
+  # Return the list of statements of blk and whether the globals of blk
+  # are private to the generated net blocks, or None if blk is neither an
+  # update block with cached AST nor a net block.
+
+  def get_block_body( self, blk ):
+    top = self.top
+
+    src = top._dag.genblk_src.get( blk ) if hasattr( top, "_dag" ) else None
+    if src is not None:
+      tree = ast.parse( "def f():\n  " + "\n  ".join( src or [ "pass" ] ) )
+      return tree.body[0].body, True
+
+    try:
+      host = top.get_update_block_host_component( blk )
+    except KeyError:
+      return None
+
+    info = host.get_update_block_info( blk )
+    # Lambdas, or a different function with the same name
+    if info is None or info[0] or info[2] != blk.__code__.co_firstlineno:
+      return None
+
+    tree = info[-1].body[0]
+    return tree.body, False
+
+  #-----------------------------------------------------------------------
+  # inline
+  #-----------------------------------------------------------------------
+  # Return the statements of blk with renamed variables, or None if blk
+  # can't be inlined.
+
+  def inline( self, blk ):
+    if not isinstance( blk, types.FunctionType ):
+      return None
+    code = blk.__code__
+    if code.co_argcount or code.co_kwonlyargcount:
+      return None
+
+    ret = self.get_block_body( blk )
+    if ret is None:
+      return None
+    body, private_globals = ret
+    func_globals = blk.__globals__
+
+    k = self._num_blocks
+    self._num_blocks += 1
+    names = {}
+
+    for x in code.co_varnames:
+      names[x] = f"_l{k}_{x}"
+
+    for x, cell in zip( code.co_freevars, blk.__closure__ or () ):
+      try:
+        self._globals[ f"_f{k}_{x}" ] = cell.cell_contents
+      except ValueError: # empty cell
+        return None
+      names[x] = f"_f{k}_{x}"
+
+    for x in code.co_names:
+      if x in names or x not in func_globals:
+        continue
+      value = func_globals[x]
+      if private_globals or isinstance( value, _STABLE_TYPES ):
+        self._globals[ f"_g{k}_{x}" ] = value
+        names[x] = f"_g{k}_{x}"
+      else:
+        self._globals[ f"_m{k}" ] = func_globals
+        names[x] = ast.parse( f"_m{k}[{x!r}]", mode="eval" ).body
+
+    hoisted  = dict( self._hoisted )
+    prologue = len( self._prologue )
+    try:
+      stmts = [ _RenameNames( names, self.hoist ).visit( deepcopy( x ) ) for x in body ]
+    except _NotInlinable:
+      self._hoisted = hoisted
+      del self._prologue[ prologue: ]
+      return None
+
+    self.num_inlined += 1
+    return stmts
+
+  #-----------------------------------------------------------------------
+  # gen_function
+  #-----------------------------------------------------------------------
+  # Generate a function that executes every entry of schedule. template
+  # is the source of the function where the statement "_body_" stands for
+  # the entries, and _globals are the extra globals that it refers to.
+
+  def gen_function( self, name, schedule, template=None, _globals=None ):
+    self._hoisted  = {}
+    self._prologue = []
+
+    body = []
+    for blk in schedule:
+      stmts = self.inline( blk )
+      if stmts is None:
+        i = self.num_called
+        self.num_called += 1
+        self._globals[ f"_c{i}" ] = blk
+        stmts = ast.parse( f"_c{i}()" ).body
+      body.extend( stmts )
+
+    return self.compile_template( name, template, self._prologue, body,
+                                  { **self._globals, **( _globals or {} ) } )
+
+  @staticmethod
+  def compile_template( name, template, prologue, body, _globals ):
+    if template is None:
+      template = f"def {name}():\n  _body_"
+    tree = ast.parse( template )
+    func = tree.body[0]
+
+    holes = []
+    for node in ast.walk( func ):
+      for field in ( "body", "orelse" ):
+        stmts = getattr( node, field, None )
+        if isinstance( stmts, list ):
+          holes.extend( ( stmts, i ) for i, x in enumerate( stmts )
+                        if isinstance( x, ast.Expr ) and isinstance( x.value, ast.Name ) and
+                           x.value.id == "_body_" )
+
+    # Replace the last hole first to keep the other indices valid
+    for j, ( stmts, i ) in enumerate( reversed( holes ) ):
+      stmts[i:i+1] = ( deepcopy( body ) if j else body ) or [ ast.Pass() ]
+    func.body = prologue + func.body
+
+    # The inlined statements keep the line numbers in their own blocks
+    ast.fix_missing_locations( tree )
+
+    _globals = dict( _globals )
+    _globals[ "__builtins__" ] = builtins
+    filename = f"<inlined {name}>"
+    custom_exec( compile( tree, filename, "exec" ), _globals, _globals )
+    return _globals[ name ]
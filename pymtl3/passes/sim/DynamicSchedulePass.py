@@ -5,23 +5,25 @@
 # Author : Shunning Jiang
 # Date   : Apr 19, 2019
 
+import linecache
 import os
 from collections import defaultdict, deque
 from copy import deepcopy
 
-import py
-
-from pymtl3.datatypes import Bits, is_bitstruct_class
+from pymtl3.datatypes import Bits, is_bitstruct_class, is_packed_bitstruct_class
 from pymtl3.dsl.errors import UpblkCyclicError
 from pymtl3.extra.pypy import custom_exec
 from pymtl3.passes.BasePass import BasePass, PassMetadata
 from pymtl3.passes.errors import PassOrderError
 
+from .SimCache import SimCache
 from .SimpleSchedulePass import SimpleSchedulePass, dump_dag
-from .SimpleTickPass import SimpleTickPass
 
 
 class DynamicSchedulePass( BasePass ):
+  def __init__( self, cache_dir=None ):
+    self.cache_dir = cache_dir
+
   def __call__( self, top ):
     if not hasattr( top._dag, "all_constraints" ):
       raise PassOrderError( "all_constraints" )
@@ -31,13 +33,65 @@ class DynamicSchedulePass( BasePass ):
 
     top._sched = PassMetadata()
 
-    self.schedule_intra_cycle( top )
+    cache = SimCache.get( top, self.cache_dir ) if self.cache_dir else None
+    if cache is None or not self.load_cache( top, cache ):
+      self.schedule_intra_cycle( top )
+      if cache is not None:
+        self.dump_cache( top, cache )
 
     # Reuse simple's ff and flip schedule
     simple = SimpleSchedulePass()
     simple.schedule_ff( top )
     simple.schedule_posedge_flip( top )
 
+  #-----------------------------------------------------------------------
+  # Schedule cache
+  #-----------------------------------------------------------------------
+  # Every entry of the cached schedule is either the name of a block (a
+  # tuple), or a list of the names of the blocks and variables of an SCC.
+
+  def dump_cache( self, top, cache ):
+    entries = []
+    for blk in top._sched.update_schedule:
+      if blk in top._sched.scc_upblks:
+        bids = [ cache.block_id( x ) for x in top._sched.scc_upblks[ blk ] ]
+        entry = [ bids, sorted( repr(x) for x in top._sched.scc_variables[ blk ] ) ]
+      else:
+        bids  = [ cache.block_id( blk ) ]
+        entry = bids[0]
+
+      # e.g., blocks wrapped by other passes
+      if None in bids:
+        return
+      entries.append( entry )
+
+    cache.dump( "schedule", entries )
+
+  def load_cache( self, top, cache ):
+    entries = cache.load( "schedule" )
+    if entries is None:
+      return False
+
+    top._sched.update_schedule = schedule = []
+    top._sched.scc_upblks    = {}
+    top._sched.scc_variables = {}
+
+    try:
+      for entry in entries:
+        if isinstance( entry, tuple ):
+          schedule.append( cache.get_block( entry ) )
+        else:
+          bids, names = entry
+          scc       = [ cache.get_block( x ) for x in bids ]
+          variables = { cache.get_object( x ) for x in names }
+          schedule.append( self.gen_scc_block( top, len(top._sched.scc_upblks)+1, scc, variables ) )
+    except ( AttributeError, KeyError, IndexError, TypeError ):
+      return False
+
+    # The cached schedule has to cover exactly the same blocks
+    V = top._dag.final_upblks - top.get_all_update_ff()
+    return len(schedule) + sum( len(x)-1 for x in top._sched.scc_upblks.values() ) == len(V)
+
   def schedule_intra_cycle( self, top ):
 
     # Construct the intra-cycle graph based on normal update blocks
@@ -96,6 +150,11 @@ class DynamicSchedulePass( BasePass ):
     # Put the graph schedule to _sched
     top._sched.update_schedule = schedule = []
 
+    # The update blocks of each generated SCC block, and the variables
+    # that trigger the re-execution of the SCC
+    top._sched.scc_upblks    = {}
+    top._sched.scc_variables = {}
+
     scc_id = 0
     for i in scc_schedule:
       scc = SCCs[i]
@@ -153,7 +212,6 @@ class DynamicSchedulePass( BasePass ):
               Q.append( v )
               visited.add( v )
 
-        scc_id += 1
         variables = set()
         for (u, v) in E:
           # Collect all variables that triggers other blocks in the SCC
@@ -165,94 +223,109 @@ class DynamicSchedulePass( BasePass ):
                           "Probably a loop that involves blocks that should be update_once:\n{}"\
                           .format(", ".join( [ x.__name__ for x in scc] )))
 
-        # generate a loop for scc
-        # Shunning: we just simply loop over the whole SCC block
-        # TODO performance optimizations using Mamba techniques within a SCC block
-
-        def gen_wrapped_SCCblk( s, scc, src ):
-
-          # TODO mamba?
-          scc_tick_func = SimpleTickPass.gen_tick_function( scc )
-          _globals = { 's': s, 'scc_tick_func': scc_tick_func, 'deepcopy': deepcopy,
-                       'UpblkCyclicError': UpblkCyclicError }
-          _locals  = {}
-
-          custom_exec(py.code.Source( src ).compile(), _globals, _locals)
-          return _locals[ 'generated_block' ]
-
-        template = """
-def wrapped_SCC_{0}():
-  N = 0
-  while True:
-    N += 1
-    if N > 100:
-      raise UpblkCyclicError("Combinational loop detected at runtime in {{{3}}} after 100 iters!")
-    {1}
-    scc_tick_func()
-    {2}
-    # print( "SCC block{0} is executed", num_iters, "times" )
-    break
-generated_block = wrapped_SCC_{0}
-          """
-
-        copy_srcs  = []
-        check_srcs = []
-        # print_srcs = []
-
-        # clean up non-top variables if top is there. remove slices
-
-        final_variables = set()
-
-        for x in sorted( variables, key=repr ):
-          w = x.get_top_level_signal()
-          if w is x:
-            final_variables.add( x )
-            continue
-
-          # w is not x
-          if issubclass( w._dsl.Type, Bits ):
-            if w not in final_variables:
-              final_variables.add( w )
-          elif is_bitstruct_class( w._dsl.Type ):
-            if w not in final_variables:
-              final_variables.add( x )
-          else:
-            final_variables.add( x )
-
-        # group them by host component so that we create less bytecode
-
-        final_var_host = defaultdict(list)
-        for x in final_variables:
-          final_var_host[ x.get_host_component() ].append( x )
-
-        # create a block of copy/check code for each host component. Need
-        # to allocate global var_id across different host components.
-
-        var_id = 0
-        for host, var_list in final_var_host.items():
-
-          copy_srcs .append( f"host={host!r}" )
-          check_srcs.append( f"host={host!r}" )
-
-          sub_check_srcs = []
-
-          hostlen = len(repr(host))
-          for var in var_list:
-            var_id += 1
-            subname = repr(var)[hostlen+1:]
-            if issubclass( var._dsl.Type, Bits ):     copy_srcs.append( f"t{var_id}=host.{subname}.clone()" )
-            elif is_bitstruct_class( var._dsl.Type ): copy_srcs.append( f"t{var_id}=host.{subname}.clone()" )
-            else:                                     copy_srcs.append( f"t{var_id}=deepcopy(host.{subname})" )
-
-            sub_check_srcs.append( f"host.{subname} != t{var_id}" )
-
-          check_srcs.append( f"if { ' or '.join(sub_check_srcs)}: continue" )
-
-        scc_block_src = template.format( scc_id, "; ".join( copy_srcs ), "\n    ".join( check_srcs ),
-                                         ", ".join( [ x.__name__ for x in scc] ) )
-
-        # print(scc_block_src)
-        schedule.append( gen_wrapped_SCCblk( top, tmp_schedule, scc_block_src ) )
+        scc_id += 1
+        schedule.append( self.gen_scc_block( top, scc_id, tmp_schedule, variables ) )
+
+  #-----------------------------------------------------------------------
+  # gen_scc_block
+  #-----------------------------------------------------------------------
+  # Generate a block that executes the blocks of an SCC in the order of
+  # scc until none of the variables changes.
+
+  def gen_scc_block( self, top, scc_id, scc, variables ):
+    scc_blk = gen_scc_worklist_block( top, scc_id, [ ( x, [x] ) for x in scc ] )
+    top._sched.scc_upblks[ scc_blk ] = scc
+    top._sched.scc_variables[ scc_blk ] = variables
+    return scc_blk
+
+def get_scc_variable( x ):
+  """ Return the signal to compare to detect the changes of x in an SCC.
+  For slices and fields of Bits and packed bitstructs we directly use the
+  top level signal since comparing and cloning it is O(1). """
+  w = x.get_top_level_signal()
+  if issubclass( w._dsl.Type, Bits ) or is_packed_bitstruct_class( w._dsl.Type ):
+    return w
+  return x
+
+def get_change_check_strs( x ):
+  """ Return the expression that is compared with the last snapshot to
+  detect the changes of signal x, and the expression that takes the
+  snapshot. Python Bits and packed bitstructs count the changes of their
+  value in _version, so both are the integer counter and no copy is made.
+  Other values are cloned/deep-copied and compared as a whole. """
+  Type = x._dsl.Type
+  if not x.is_sliced_signal() and \
+     ( is_packed_bitstruct_class( Type ) or
+       ( issubclass( Type, Bits ) and hasattr( Bits, "_version" ) ) ):
+    return f"{x!r}._version", f"{x!r}._version"
+  if issubclass( Type, Bits ) or is_bitstruct_class( Type ):
+    return f"{x!r}", f"{x!r}.clone()"
+  return f"{x!r}", f"deepcopy({x!r})"
+
+def gen_scc_worklist_block( top, scc_id, groups ):
+  """ Return a function that executes an SCC until it converges. groups
+  is a list of ( func, blks ) in the order of execution, where func
+  executes the update blocks in blks. Every group is executed once, and
+  then only the groups that read a variable that changed since their last
+  execution are executed again, using the variables of the constraints
+  between the update blocks. """
+
+  constraint_objs = top._dag.constraint_objs
+
+  group_of = {}
+  for i, (_, blks) in enumerate( groups ):
+    for k, x in enumerate( blks ):
+      group_of[ x ] = ( i, k )
+
+  # For each group, the variables written by the group and the groups
+  # that read them. A reader in the same group only has to execute
+  # again if it executes before the writer.
+  readers = [ defaultdict(set) for _ in groups ]
+  for (u, v), objs in constraint_objs.items():
+    if u in group_of and v in group_of:
+      (i, ku), (j, kv) = group_of[u], group_of[v]
+      if i != j or kv <= ku:
+        for x in objs:
+          readers[i][ get_scc_variable(x) ].add( j )
+
+  variables = sorted( { x for r in readers for x in r }, key=repr )
+  var_id    = { x: k for k, x in enumerate( variables ) }
+
+  # Every variable is compared with its value at the last check instead
+  # of the value before the writer executes, because the variables of a
+  # net may share the same object and change before their net block.
+  names = ", ".join( x.__name__ for _, blks in groups for x in blks )
+  lines = [ f"def wrapped_SCC_{scc_id}():" ]
+  checks = [ get_change_check_strs( x ) for x in variables ]
+  lines.extend( f"  t{k} = {snapshot}" for k, (_, snapshot) in enumerate( checks ) )
+  lines.extend( [ f"  {' = '.join( f'd{i}' for i in range(len(groups)) )} = True",
+                   "  N = 0",
+                   "  while True:",
+                   "    N += 1",
+                   "    if N > 100:",
+                  f"      raise UpblkCyclicError(\"Combinational loop detected at runtime in {{{names}}} after 100 iters!\")" ] )
+
+  _globals = { 's': top, 'deepcopy': deepcopy, 'UpblkCyclicError': UpblkCyclicError }
+  for i, (func, _) in enumerate( groups ):
+    _globals[ f"g{i}" ] = func
+    lines.extend( [ f"    if d{i}:",
+                    f"      d{i} = False",
+                    f"      g{i}()" ] )
+
+    for x in sorted( readers[i], key=repr ):
+      k = var_id[x]
+      current, snapshot = checks[k]
+      lines.extend( [ f"      if {current} != t{k}:",
+                      f"        t{k} = {snapshot}",
+                      f"        {' = '.join( f'd{j}' for j in sorted( readers[i][x] ) )} = True" ] )
+
+  lines.extend( [ f"    if not ( {' or '.join( f'd{i}' for i in range(len(groups)) )} ):",
+                   "      break" ] )
+
+  filename = f"wrapped_SCC_{scc_id}"
+  custom_exec( compile( "\n".join(lines), filename=filename, mode="exec" ), _globals, _globals )
+  linecache.cache[ filename ] = (1, None, lines, filename)
+  return _globals[ f"wrapped_SCC_{scc_id}" ]
 
 def kosaraju_scc( G, G_T ):
 
@@ -0,0 +1,209 @@
+"""
+========================================================================
+EventDrivenSchedulePass.py
+========================================================================
+Generate the same intra-cycle schedule as DynamicSchedulePass, and
+record which signals every entry of the schedule reads and writes. With
+this information PrepareSimPass generates an activity-driven update
+function that only re-executes the entries whose input signals changed
+since they were last executed.
+
+Changes are detected at the granularity of top-level signals with the
+change counter of Bits and packed bitstructs, or by comparing against a
+copy of other values, since @= updates the value in place. Signals that
+are not written by any entry of the schedule (e.g., outputs of update_ff
+blocks and top-level input ports) are checked at the beginning of every
+evaluation, and the signals written by an entry are checked right after
+it executes.
+
+An update block is only skipped if it is a function of the signals it
+reads. Blocks that also read plain Python attributes, closure variables
+or globals, or call methods of Python objects, are executed every time.
+Designs with method ports use the full schedule.
+"""
+import linecache
+import warnings
+from collections import defaultdict
+from copy import deepcopy
+
+from pymtl3.dsl import MethodPort
+from pymtl3.dsl.Connectable import Signal
+from pymtl3.dsl.NamedObject import NamedObject
+from pymtl3.extra.pypy import custom_exec
+
+from .DynamicSchedulePass import DynamicSchedulePass, get_change_check_strs
+
+
+class EventDrivenSchedulePass( DynamicSchedulePass ):
+
+  def __call__( self, top ):
+    super().__call__( top )
+
+    if top.get_all_object_filter( lambda x: isinstance( x, MethodPort ) ):
+      warnings.warn( "Event-driven simulation only supports pure RTL designs. "
+                     "All update blocks will be executed every cycle." )
+      return
+
+    self.collect_update_events( top )
+
+  def collect_update_events( self, top ):
+    """ Set top._sched.update_events to a list of (reads, writes) for
+    every entry of top._sched.update_schedule, where reads and writes are
+    sets of top-level signals. reads is None if the entry must always be
+    executed. """
+
+    upblk_reads, upblk_writes, _ = top.get_all_upblk_metadata()
+    genblks = top._dag.genblks
+    genblk_reads, genblk_writes = top._dag.genblk_reads, top._dag.genblk_writes
+
+    def get_events( blk ):
+      if blk in genblks:
+        reads, writes = genblk_reads.get( blk, [] ), genblk_writes[ blk ]
+      else:
+        reads, writes = upblk_reads[ blk ], upblk_writes[ blk ]
+        if not self.is_pure_func( top.get_update_block_host_component( blk ), blk, set() ):
+          reads = None
+
+      writes = { x.get_top_level_signal() for x in writes if isinstance( x, Signal ) }
+
+      if reads is None or not all( isinstance( x, Signal ) for x in reads ):
+        return None, writes
+      return { x.get_top_level_signal() for x in reads }, writes
+
+    top._sched.update_events = events = []
+
+    for blk in top._sched.update_schedule:
+      reads, writes = set(), set()
+      for x in top._sched.scc_upblks.get( blk, [ blk ] ):
+        r, w = get_events( x )
+        writes |= w
+        reads = None if reads is None or r is None else reads | r
+      events.append( (reads, writes) )
+
+  @staticmethod
+  def is_pure_func( host, func, visited ):
+    """ Return True if the update block/function func of host only reads
+    signals and only calls pure functions. """
+
+    def only_signals( obj_name ):
+      objs = [ host ]
+      for field, _ in obj_name[1:]:
+        next_objs = []
+        for obj in objs:
+          Q = [ getattr( obj, field, None ) ]
+          while Q:
+            x = Q.pop()
+            if isinstance( x, list ):
+              Q.extend( x )
+            elif isinstance( x, NamedObject ):
+              next_objs.append( x )
+            else:
+              return False
+        objs = next_objs
+      return all( isinstance( x, Signal ) for x in objs )
+
+    cls = type(host)
+    name = func.__name__
+    local_vars = func.__code__.co_varnames
+
+    for obj_name, _, _ in cls._name_rd[ name ]:
+      root = obj_name[0][0]
+      if root == 's':
+        if not only_signals( obj_name ):
+          return False
+      # Attributes of local variables are derived from signals, but
+      # closure variables and globals may be modified anywhere
+      elif root not in local_vars:
+        return False
+
+    for obj_name, _, _ in cls._name_fc[ name ]:
+      root = obj_name[0][0]
+
+      # Functions defined with @s.func
+      if len(obj_name) == 1 and root in host._dsl.name_func:
+        f = host._dsl.name_func[ root ]
+        if f not in visited:
+          visited.add( f )
+          if not EventDrivenSchedulePass.is_pure_func( host, f, visited ):
+            return False
+
+      elif root != 's':
+        # Functions such as zext(...) and int(...), and methods of local
+        # variables. Methods of other objects such as random.randint(...)
+        # may have side effects.
+        if len(obj_name) > 1 and root not in local_vars:
+          return False
+
+      # Methods of signal values, e.g., s.in_.uint()
+      elif len(obj_name) < 3 or not only_signals( obj_name[:-1] ):
+        return False
+
+    return True
+
+  @staticmethod
+  def gen_update_function( top, schedule, events ):
+    """ Return a function that executes the entries of schedule whose
+    input signals changed. This has to be called after the signals are
+    replaced with the actual values. """
+
+    readers = defaultdict(list)
+    written = set()
+    for i, (reads, writes) in enumerate( events ):
+      written |= writes
+      if reads is not None:
+        for x in reads:
+          readers[x].append( i )
+
+    signals = sorted( readers, key=repr )
+    sig_id  = { x: k for k, x in enumerate( signals ) }
+
+    change_checks = [ get_change_check_strs( x ) for x in signals ]
+
+    def check_strs( x, indent, exclude=None ):
+      k = sig_id[x]
+      current, snapshot = change_checks[k]
+      ret = [ f"if {current} != t{k}:",
+              f"  t{k} = {snapshot}" ]
+      dirty = [ f"d{i}" for i in readers[x] if i != exclude ]
+      if dirty:
+        ret.append( f"  {' = '.join(dirty)} = True" )
+      return [ indent + y for y in ret ]
+
+    _globals = { 's': top, 'deepcopy': deepcopy }
+    for x, k in sig_id.items():
+      _globals[ f"t{k}" ] = eval( change_checks[k][1], _globals )
+
+    global_vars = [ f"t{k}" for k in range(len(signals)) ]
+    body = []
+
+    # Signals that are only changed outside the schedule
+    for x in signals:
+      if x not in written:
+        body.extend( check_strs( x, "  " ) )
+
+    for i, (blk, (reads, writes)) in enumerate( zip( schedule, events ) ):
+      _globals[ f"b{i}" ] = blk
+      checks = [ x for x in sorted( writes, key=repr ) if x in sig_id ]
+
+      if reads is None:
+        body.append( f"  b{i}()" )
+        for x in checks:
+          body.extend( check_strs( x, "  " ) )
+      else:
+        _globals[ f"d{i}" ] = True
+        global_vars.append( f"d{i}" )
+        body.extend( [ f"  if d{i}:",
+                       f"    d{i} = False",
+                       f"    b{i}()" ] )
+        for x in checks:
+          body.extend( check_strs( x, "    ", exclude=i ) )
+
+    lines = [ "def event_driven_update():" ]
+    if global_vars:
+      lines.append( f"  global {', '.join(global_vars)}" )
+    lines.extend( body or [ "  pass" ] )
+
+    custom_exec( compile( '\n'.join(lines), filename='event_driven_update', mode='exec' ),
+                 _globals, _globals )
+    linecache.cache['event_driven_update'] = (1, None, lines, 'event_driven_update')
+    return _globals['event_driven_update']
@@ -11,18 +11,20 @@ Date   : Jan 18, 2018
 from collections import defaultdict, deque
 from linecache import cache as line_cache
 
-from pymtl3.datatypes import *
-from pymtl3.datatypes.bitstructs import get_bitstruct_inst_all_classes
 from pymtl3.dsl import *
 from pymtl3.dsl.errors import LeftoverPlaceholderError
 from pymtl3.extra.pypy import custom_exec
 from pymtl3.passes.BasePass import BasePass, PassMetadata
 
+from .SimCache import SimCache
+
 
 class GenDAGPass( BasePass ):
 
+  def __init__( self, cache_dir=None ):
+    self.cache_dir = cache_dir
+
   def __call__( self, top ):
-    top.check()
     top._dag = PassMetadata()
 
     placeholders = [ x for x in top._dsl.all_named_objects
@@ -31,35 +33,110 @@ class GenDAGPass( BasePass ):
     if placeholders:
       raise LeftoverPlaceholderError( placeholders )
 
-    self._generate_net_blocks( top )
-    self._process_value_constraints( top )
+    # The cache is keyed by the source code, so the cached results have
+    # passed top.check() before
+    cache = SimCache.get( top, self.cache_dir ) if self.cache_dir else None
+    if cache is None or not self._load_cache( top, cache ):
+      top.check()
+      self._generate_net_blocks( top )
+      self._process_value_constraints( top )
+      if cache is not None:
+        self._dump_cache( top, cache )
+
     self._process_methods( top )
 
+  #-----------------------------------------------------------------------
+  # DAG cache
+  #-----------------------------------------------------------------------
+  # A net is identified by the name of its first reader since constant
+  # writers don't have names.
+
+  def _dump_cache( self, top, cache ):
+    _globals = top._dag.genblk_globals
+
+    nets     = []
+    net_name = {}
+    for blk, body in top._dag.genblk_src.items():
+      writer, readers = top._dag.genblk_nets[ blk ]
+      net_name[ blk ] = repr( readers[0] )
+      nets.append( (blk.__name__, body, net_name[ blk ]) )
+
+    global_names = {}
+    for blk, body in top._dag.genblk_src.items():
+      if body and body[0][4:] in _globals:
+        global_names[ body[0][4:] ] = net_name[ blk ]
+    for name, obj in _globals.items():
+      if isinstance( obj, Component ):
+        global_names[ name ] = repr(obj)
+
+    block_id = cache.block_id
+    cache.dump( "dag", {
+      'nets':        nets,
+      'globals':     global_names,
+      'constraints': [ ( block_id(x), block_id(y) ) for x, y in top._dag.all_constraints ],
+      'constraint_objs': [ ( block_id(x), block_id(y), [ repr(z) for z in objs ] )
+                           for (x, y), objs in top._dag.constraint_objs.items() ],
+    } )
+
+  def _load_cache( self, top, cache ):
+    data = cache.load( "dag" )
+    if data is None:
+      return False
+
+    try:
+      net_of = {}
+      for writer, signals in top.get_all_value_nets():
+        for x in signals:
+          net_of[ x ] = (writer, signals)
+
+      net_blks = []
+      for genblk_name, body, name in data['nets']:
+        writer, signals = net_of[ cache.get_object( name ) ]
+        net_blks.append( (genblk_name, body, writer, [ x for x in signals if x is not writer ]) )
+
+      _globals = {}
+      for name, obj_name in data['globals'].items():
+        # Host components are s0, s1, ... and constants are c0, c1, ...
+        if name[0] == 's':
+          _globals[ name ] = cache.get_object( obj_name )
+        else:
+          _globals[ name ] = net_of[ cache.get_object( obj_name ) ][0]._dsl.const
+
+      self._compile_net_blocks( top, net_blks, _globals )
+
+      get_block = cache.get_block
+      top._dag.all_constraints = { ( get_block(x), get_block(y) ) for x, y in data['constraints'] }
+      top._dag.constraint_objs = constraint_objs = defaultdict(set)
+      for x, y, objs in data['constraint_objs']:
+        constraint_objs[ ( get_block(x), get_block(y) ) ] = { cache.get_object(z) for z in objs }
+
+      # The cached nets have to cover exactly the same nets
+      valid = len(net_blks) == sum( len(x) > 1 for _, x in top.get_all_value_nets() )
+
+    except ( AttributeError, KeyError, IndexError, TypeError ):
+      valid = False
+
+    if not valid:
+      top._dag = PassMetadata()
+      top._dag.sim_cache = cache
+      cache.genblks = {}
+    return valid
+
   def _generate_net_blocks( self, top ):
     """ _generate_net_blocks:
     Each net is an update block. Readers are actually "written" here.
       >>> s.net_reader1 = s.net_writer
       >>> s.net_reader2 = s.net_writer """
 
-    top._dag.genblks = set()
-    top._dag.genblk_hostobj = {}
-    top._dag.genblk_reads   = {}
-    top._dag.genblk_writes  = {}
-    # top._dag.genblk_src     = {}
-
-    # Fall back to compiling one block at a time
-    # This is currently because there might be different structs with
-    # the same name but essentially different type. It requires name
-    # disambiguation to let them co-exist in closure. With block-by-block
-    # compilation, we minimize the effect.
-
-    # TODO see if directly compiling AST instead of source can be faster
-    def compile_net_blk( _globals, src, writer ):
-      _locals = {}
-      fname = f"Net (writer is {writer!r}"
-      custom_exec( compile( src, filename=fname, mode="exec"), _globals, _locals )
-      line_cache[ fname ] = (len(src), None, src.splitlines(), fname )
-      return list(_locals.values())[0]
+    # All net blocks are compiled together in one source. Different
+    # structs may have the same name but essentially different type, so
+    # instead of referring to constants and host components by name, each
+    # of them gets a unique global name in the shared namespace. This also
+    # lets fuse_net_blocks concatenate the bodies of any net blocks.
+    _globals  = {}
+    lca_names = {}
+    net_blks  = [] # (name, body lines, writer, all_readers)
+    blk_names = set()
 
     for writer, signals in top.get_all_value_nets():
       if len(signals) == 1:
@@ -116,16 +193,16 @@ class GenDAGPass( BasePass ):
                       .replace( "(", "_" ).replace( ")", "_" ) \
                       .replace( ",", "_" )
 
+      # Different writers may end up with the same name, e.g., s.a_b and s.a.b
+      if genblk_name in blk_names:
+        genblk_name = f"{genblk_name}_{len(net_blks)}"
+      blk_names.add( genblk_name )
+
       # If all signals are top-level, we still need to generate an empty
       # to convey the constraints using all_readers
 
       if fanout == 0:
-        blk = compile_net_blk( {}, f"""def {genblk_name}(): pass""", writer )
-
-        top._dag.genblks.add( blk )
-        if writer.is_signal():
-          top._dag.genblk_reads[ blk ] = [ writer ]
-        top._dag.genblk_writes[ blk ] = all_readers
+        net_blks.append( (genblk_name, [], writer, all_readers) )
         continue
       # readers = all_readers
       # fanout  = all_fanout
@@ -165,30 +242,55 @@ class GenDAGPass( BasePass ):
           rd_lcas[i] = rd_lcas[i].get_parent_object()
 
       lca_len = len( repr(wr_lca) )
-      _globals = {'s': wr_lca }
+      if wr_lca not in lca_names:
+        lca_names[ wr_lca ] = f"s{len(lca_names)}"
+        _globals[ lca_names[ wr_lca ] ] = wr_lca
+      s_name = lca_names[ wr_lca ]
+
+      if isinstance( writer, Const ):
+        if type(writer._dsl.const) is int:
+          wstr = repr(writer)
+        else:
+          # Refer to the constant object since @= copies the value
+          wstr = f"c{len(net_blks)}"
+          _globals[ wstr ] = writer._dsl.const
+      else:
+        wstr = f"{s_name}.{repr(writer)[lca_len+1:]}"
 
-      if isinstance( writer, Const ) and type(writer._dsl.const) is not int:
-        types = get_bitstruct_inst_all_classes( writer._dsl.const )
+      rstrs = [ f"{s_name}.{repr(x)[lca_len+1:]}" for x in readers ]
 
-        for t in types:
-          if t.__name__ in _globals:
-            assert t is _globals[ t.__name__ ], "Cannot handle two subfields with the same struct name but different structs"
-          _globals[ t.__name__ ] = t
-        wstr = repr(writer)
+      net_blks.append( (genblk_name, [ f"x = {wstr}" ] + [ f"{rstr} @= x" for rstr in rstrs ],
+                        writer, all_readers) )
 
-      else:
-        wstr = f"s.{repr(writer)[lca_len+1:]}"
+    self._compile_net_blocks( top, net_blks, _globals )
 
-      rstrs   = [ f"s.{repr(x)[lca_len+1:]}" for x in readers ]
+  def _compile_net_blocks( self, top, net_blks, _globals ):
+    """ Compile all net blocks at once. net_blks is a list of (name, body
+    lines, writer, all readers). """
 
-      gen_src = """
-def {}():
-  x = {}
-  {}""".format( genblk_name, wstr, '\n  '.join([ f"{rstr} @= x" for rstr in rstrs ]) )
+    top._dag.genblks = set()
+    top._dag.genblk_hostobj = {}
+    top._dag.genblk_reads   = {}
+    top._dag.genblk_writes  = {}
+    top._dag.genblk_src     = {}
+    top._dag.genblk_nets    = {}
+    top._dag.genblk_globals = _globals
+
+    lines = []
+    for genblk_name, body, _, _ in net_blks:
+      lines.append( f"def {genblk_name}():" )
+      lines.extend( [ f"  {x}" for x in body ] or [ "  pass" ] )
 
-      blk = compile_net_blk( _globals, gen_src, writer )
+    fname = "GenDAGPass net blocks"
+    custom_exec( compile( '\n'.join(lines), filename=fname, mode="exec" ), _globals, _globals )
+    line_cache[ fname ] = (1, None, lines, fname)
+
+    for genblk_name, body, writer, all_readers in net_blks:
+      blk = _globals.pop( genblk_name )
 
       top._dag.genblks.add( blk )
+      top._dag.genblk_src[ blk ] = body
+      top._dag.genblk_nets[ blk ] = (writer, all_readers)
       if writer.is_signal():
         top._dag.genblk_reads[ blk ] = [ writer ]
       top._dag.genblk_writes[ blk ] = all_readers
@@ -196,6 +298,46 @@ def {}():
     # Get the final list of update blocks
     top._dag.final_upblks = top.get_all_update_blocks() | top._dag.genblks
 
+  @staticmethod
+  def fuse_net_blocks( top, schedule ):
+    """ Return a copy of schedule where every run of consecutive net
+    blocks is replaced by one generated function that executes their
+    bodies in order. Net blocks without a body are dropped. """
+
+    genblk_src = top._dag.genblk_src
+    ret = []
+    run = []
+
+    def flush():
+      body = [ x for blk in run for x in genblk_src[ blk ] ]
+      run.clear()
+      if not body:
+        return
+
+      fused_id = len(top._dag.fused_genblks)
+      fname = f"fused_net_blocks_{fused_id}"
+      lines = [ f"def {fname}():" ] + [ f"  {x}" for x in body ]
+
+      _globals = dict( top._dag.genblk_globals )
+      custom_exec( compile( '\n'.join(lines), filename=fname, mode="exec" ), _globals, _globals )
+      line_cache[ fname ] = (1, None, lines, fname)
+
+      top._dag.fused_genblks.append( _globals[ fname ] )
+      ret.append( _globals[ fname ] )
+
+    if not hasattr( top._dag, "fused_genblks" ):
+      top._dag.fused_genblks = []
+
+    for blk in schedule:
+      if blk in genblk_src:
+        run.append( blk )
+      else:
+        flush()
+        ret.append( blk )
+    flush()
+
+    return ret
+
   def _process_value_constraints( self, top ):
 
     # Query update block metadata from top
@@ -0,0 +1,566 @@
+"""
+========================================================================
+PartitionedSim.py
+========================================================================
+Simulate a design in several processes that each execute the update
+blocks of one partition of the design.
+
+The design is cut at the registers: two update blocks are in the same
+partition if there is a scheduling constraint between them, or if they
+write the same signal. The signals that one partition reads from
+another one are then only written by update_ff blocks or by the test
+harness through the top-level input ports. The groups of blocks are
+ordered by the names of their components, so that the blocks of the
+same tile stay together, and split into partitions of similar size.
+
+The main process simulates partition 0 and forks a process for every
+other partition the first time the simulation runs. The processes
+exchange the values of the boundary signals through a buffer in shared
+memory and wait for each other at a barrier after every exchange. A
+cycle executes the combinational blocks, exchanges the signals read by
+the update_ff blocks of other partitions, executes the update_ff
+blocks and flips the registers of the partition, exchanges the
+registers read by other partitions, and executes the combinational
+blocks again. Every exchange writes to the other half of the buffer
+than the previous one, so a process never overwrites values that
+another process is still reading.
+
+Only the top-level ports and the signals of partition 0 are kept up to
+date in the main process. If the line trace is printed or waveforms are
+generated, all signals written by the other partitions are sent to the
+main process every cycle. Other state of the components, like Python
+attributes of test sources and sinks, is only visible in the process
+that simulates them.
+"""
+import atexit
+import multiprocessing
+import re
+import threading
+import traceback
+import warnings
+from collections import defaultdict
+
+from pymtl3.datatypes import Bits, b1, is_bitstruct_inst, mk_bits
+from pymtl3.dsl.Connectable import MethodPort, Signal
+from pymtl3.extra.pypy import custom_exec
+
+# Commands that the main process sends to the other processes
+_STOP, _TICK, _EVAL, _RESET = range(4)
+
+# The first two words of each half of the buffer hold the command
+_CMD_WORDS = 2
+
+_MASK64 = (1 << 64) - 1
+
+def _natural_key( name ):
+  # s.tiles[2] comes before s.tiles[10]
+  return tuple( int(x) if x.isdigit() else x for x in re.split( r"(\d+)", name ) )
+
+class PartitionedSim:
+
+  def __init__( self, top, nparts, prepare ):
+    if top.get_all_object_filter( lambda x: isinstance( x, MethodPort ) ):
+      raise NotImplementedError( "Partitioned simulation only supports pure RTL designs." )
+    if "fork" not in multiprocessing.get_all_start_methods():
+      raise NotImplementedError( "Partitioned simulation requires the fork start method." )
+
+    self.top     = top
+    self.prepare = prepare
+    self._ctx    = multiprocessing.get_context( "fork" )
+
+    # The line trace and the tracing hooks of the main process read the
+    # signals of all partitions
+    self.print_line_trace = prepare.print_line_trace and hasattr( top, 'line_trace' )
+    self.sync_main = self.print_line_trace or \
+                     len( prepare.collect_ff_funcs( top, [], [], hooks=True ) ) > \
+                     len( prepare.collect_ff_funcs( top, [], [], hooks=False ) )
+
+    self.partition( nparts )
+    self.collect_boundary_signals()
+
+    nwords = _CMD_WORDS + sum( self._words.values() )
+    self._raw     = self._ctx.RawArray( "Q", 2 * nwords )
+    self._barrier = self._ctx.Barrier( self.nparts )
+    self._errors  = self._ctx.SimpleQueue()
+    self._globals = {
+      's'     : top,
+      '_b'    : memoryview( self._raw ).cast( "B" ).cast( "Q" ),
+      '_n'    : nwords,
+      '_st'   : [ 0 ],
+      '_wait' : self._barrier.wait,
+    }
+
+    self._procs  = []
+    self._broken = False
+    self._funcs  = [ self.gen_partition_funcs( p ) for p in range(self.nparts) ]
+    self._recv   = [ self.gen_command_function( p ) for p in range(self.nparts) ]
+
+  #-----------------------------------------------------------------------
+  # partition
+  #-----------------------------------------------------------------------
+  # Assign every entry of the update schedule and every update_ff block
+  # to a partition.
+
+  def partition( self, nparts ):
+    top = self.top
+    all_ff  = top.get_all_update_ff()
+    entries = list( top._sched.update_schedule )
+    ff_blks = list( top._sched.schedule_ff )
+    if not all( x in all_ff for x in ff_blks ):
+      raise NotImplementedError( "Partitioned simulation requires the update_ff blocks to be "
+                                 "scheduled one by one." )
+
+    scc_upblks = getattr( top._sched, "scc_upblks", {} )
+    members  = { x: scc_upblks.get( x, [ x ] ) for x in entries }
+    entry_of = { y: x for x in entries for y in members[x] }
+    for x in ff_blks:
+      members[x] = [ x ]
+
+    upblk_reads, upblk_writes, _ = top.get_all_upblk_metadata()
+    genblks = top._dag.genblks
+    mapping = top._sim.signal_object_mapping
+
+    # Signals are identified by the objects that hold their values, so
+    # that all top-level signals of a net are the same signal
+    self._names  = {}
+    self._values = {}
+
+    def get_keys( signals ):
+      ret = set()
+      for x in signals:
+        if not isinstance( x, Signal ):
+          continue
+        x = x.get_top_level_signal()
+        value = mapping[x][-1]
+        k = id(value)
+        name = repr(x)
+        if k not in self._names or name < self._names[k]:
+          self._names[k] = name
+        self._values[k] = value
+        ret.add( k )
+      return ret
+
+    # A net block only writes the readers whose objects are not the same
+    # as the writer's. The net blocks that don't write anything are only
+    # executed by partition 0.
+    self._reads  = {}
+    self._writes = {}
+    noops = set()
+    for x, blks in members.items():
+      reads, writes = set(), set()
+      for blk in blks:
+        if blk in genblks:
+          r = get_keys( top._dag.genblk_reads.get( blk, [] ) )
+          reads  |= r
+          writes |= get_keys( top._dag.genblk_writes[ blk ] ) - r
+        else:
+          reads  |= get_keys( upblk_reads[ blk ] )
+          writes |= get_keys( upblk_writes[ blk ] )
+      if x in genblks and not writes:
+        noops.add( x )
+        reads = set()
+      self._reads[x], self._writes[x] = reads, writes
+
+    # Union the blocks that can't be in different partitions
+
+    parent = { x: x for x in members if x not in noops }
+
+    def find( x ):
+      while parent[x] is not x:
+        parent[x] = parent[ parent[x] ]
+        x = parent[x]
+      return x
+
+    def union( x, y ):
+      x, y = find(x), find(y)
+      if x is not y:
+        parent[y] = x
+
+    # Explicit constraints between update blocks. A constraint between
+    # an update block and an update_ff block only orders them within the
+    # same phase of the cycle.
+    for u, v in top._dag.all_constraints:
+      u, v = entry_of.get( u, u ), entry_of.get( v, v )
+      if u in parent and v in parent and u not in genblks and v not in genblks and \
+         ( u in all_ff ) == ( v in all_ff ):
+        union( u, v )
+
+    # The blocks that write the same signal, and the update blocks that
+    # read a signal written by an update block
+    writers = defaultdict(list)
+    readers = defaultdict(list)
+    for x in parent:
+      for k in self._writes[x]:
+        writers[k].append( x )
+      for k in self._reads[x]:
+        readers[k].append( x )
+
+    for k, blks in writers.items():
+      for x in blks[1:]:
+        union( blks[0], x )
+      if any( x not in all_ff for x in blks ):
+        for x in readers[k]:
+          if x not in all_ff:
+            union( blks[0], x )
+
+    groups = defaultdict(list)
+    for x in parent:
+      groups[ find(x) ].append( x )
+
+    def get_name( blk ):
+      if blk in genblks:
+        writer, readers = top._dag.genblk_nets[ blk ]
+        x = writer if isinstance( writer, Signal ) else readers[0]
+        return repr( x.get_host_component() )
+      return repr( top.get_update_block_host_component( blk ) )
+
+    def group_key( blks ):
+      return min( _natural_key( get_name( y ) ) for x in blks for y in members[x] )
+
+    # The groups that start in the same component, like the update
+    # blocks and the update_ff blocks of a tile, stay together
+    units = defaultdict(list)
+    for blks in groups.values():
+      units[ group_key( blks ) ].extend( blks )
+    groups = [ units[x] for x in sorted( units ) ]
+
+    # Split the ordered groups into contiguous ranges of similar size
+    sizes = [ sum( len( members[x] ) for x in blks ) for blks in groups ]
+    total = max( sum( sizes ), 1 )
+    assigned = []
+    acc = 0
+    for size in sizes:
+      assigned.append( min( nparts-1, int( (acc + size / 2) * nparts / total ) ) )
+      acc += size
+
+    renumber = { x: i for i, x in enumerate( sorted( set( assigned ) ) ) }
+    self.nparts = len( renumber )
+    if self.nparts < nparts:
+      warnings.warn( f"The design only has {self.nparts} independent groups of update blocks. "
+                     f"Simulating {self.nparts} partitions instead of {nparts}." )
+
+    self.part_of = { x: 0 for x in noops }
+    for blks, p in zip( groups, assigned ):
+      for x in blks:
+        self.part_of[x] = renumber[p]
+
+    self.schedules    = [ [] for _ in range(self.nparts) ]
+    self.schedules_ff = [ [] for _ in range(self.nparts) ]
+    self.events       = [ [] for _ in range(self.nparts) ]
+    update_events = getattr( top._sched, "update_events", None )
+    for i, x in enumerate( entries ):
+      p = self.part_of[x]
+      self.schedules[p].append( x )
+      if update_events is not None:
+        self.events[p].append( update_events[i] )
+    for x in ff_blks:
+      self.schedules_ff[ self.part_of[x] ].append( x )
+    if update_events is None:
+      self.events = [ None ] * self.nparts
+
+  #-----------------------------------------------------------------------
+  # collect_boundary_signals
+  #-----------------------------------------------------------------------
+  # Collect the signals that each exchange sends from the writer
+  # partition to the reader partitions, and reserve their words in the
+  # buffer.
+
+  def collect_boundary_signals( self ):
+    top = self.top
+    all_ff = top.get_all_update_ff()
+    mapping = top._sim.signal_object_mapping
+
+    readers = defaultdict(set)
+    for x, reads in self._reads.items():
+      for k in reads:
+        readers[k].add( self.part_of[x] )
+
+    # The main process sees the top-level ports
+    inports = set()
+    for x in top._dsl.all_signals:
+      if x.is_top_level_signal() and x.get_host_component() is top:
+        value = mapping[x][-1]
+        k = id( value )
+        self._names[k], self._values[k] = repr(x), value
+        readers[k].add( 0 )
+        if x.is_input_value_port():
+          inports.add( k )
+
+    # phase -> { signal: (writer partition, reader partitions) }
+    self.phases = { "input": {}, "comb": {}, "flip": {}, "sync": {} }
+
+    for k in sorted( inports, key=self._names.get ):
+      if readers[k] - { 0 }:
+        self.phases["input"][k] = ( 0, readers[k] - { 0 } )
+
+    for x, writes in sorted( self._writes.items(), key=lambda x: self.part_of[ x[0] ] ):
+      p = self.part_of[x]
+      phase = "flip" if x in all_ff else "comb"
+      for k in writes:
+        if readers[k] - { p }:
+          self.phases[phase][k] = ( p, readers[k] - { p } )
+        if p:
+          self.phases["sync"][k] = ( p, { 0 } )
+
+    self._words = {}
+    self._slots = {}
+    offset = _CMD_WORDS
+    for phase in self.phases.values():
+      for k in phase:
+        if k not in self._slots:
+          self._slots[k] = offset
+          self._words[k] = ( self.get_nbits( k ) + 63 ) // 64
+          offset += self._words[k]
+
+  def get_nbits( self, k ):
+    value = self._values[k]
+    if isinstance( value, Bits ):
+      return value.nbits
+    if is_bitstruct_inst( value ):
+      return value.to_bits().nbits
+    raise NotImplementedError( f"Partitioned simulation can't exchange {self._names[k]} "
+                               f"of type {type(value).__name__} between processes." )
+
+  #-----------------------------------------------------------------------
+  # Code generation
+  #-----------------------------------------------------------------------
+
+  def export_strs( self, k ):
+    name, i, w = self._names[k], self._slots[k], self._words[k]
+    value = f"int( {name} )" if isinstance( self._values[k], Bits ) else \
+            f"int( {name}.to_bits() )"
+    if w == 1:
+      return [ f"_b[o+{i}] = {value}" ]
+    return [ f"_v = {value}" ] + \
+           [ f"_b[o+{i+j}] = _v >> {64*j} & {_MASK64}" for j in range(w) ]
+
+  def import_strs( self, k ):
+    name, i, w = self._names[k], self._slots[k], self._words[k]
+    value = " | ".join( [ f"_b[o+{i}]" ] + [ f"_b[o+{i+j}] << {64*j}" for j in range(1, w) ] )
+    if isinstance( self._values[k], Bits ):
+      return [ f"{name} @= {value}" ]
+    self._globals[ f"_T{k}" ] = type( self._values[k] )
+    self._globals[ f"_B{k}" ] = mk_bits( self.get_nbits( k ) )
+    return [ f"{name} @= _T{k}.from_bits( _B{k}( {value} ) )" ]
+
+  def compile_function( self, name, lines ):
+    custom_exec( compile( "\n".join( lines ), filename=name, mode="exec" ),
+                 self._globals, self._globals )
+    return self._globals.pop( name.split()[0] )
+
+  def gen_exchange( self, p, phase ):
+    """ Return the function of partition p that exchanges the signals of
+    phase, or None if no partition exchanges anything in phase. """
+    signals = self.phases[ phase ]
+    if not signals:
+      return None
+
+    lines = [ f"def exchange_{phase}():",
+              "  o = _st[0]",
+              "  _st[0] = _n - o" ]
+    for k, (writer, readers) in signals.items():
+      if writer == p:
+        lines.extend( "  " + x for x in self.export_strs( k ) )
+    lines.append( "  _wait()" )
+    for k, (writer, readers) in signals.items():
+      if p in readers:
+        lines.extend( "  " + x for x in self.import_strs( k ) )
+
+    return self.compile_function( f"exchange_{phase} {p}", lines )
+
+  def gen_command_function( self, p ):
+    """ Return the function of partition p that sends (main process) or
+    receives (other processes) the next command and the values of the
+    top-level input ports. """
+    lines = [ "def command( cmd=0, n=0 ):",
+              "  o = _st[0]",
+              "  _st[0] = _n - o" ]
+    if p == 0:
+      lines.extend( [ "  _b[o] = cmd", "  _b[o+1] = n" ] )
+      for k in self.phases["input"]:
+        lines.extend( "  " + x for x in self.export_strs( k ) )
+    lines.append( "  _wait()" )
+    for k, (writer, readers) in self.phases["input"].items():
+      if p in readers:
+        lines.extend( "  " + x for x in self.import_strs( k ) )
+    lines.append( "  return _b[o], _b[o+1]" )
+
+    return self.compile_function( f"command {p}", lines )
+
+  def gen_partition_funcs( self, p ):
+    """ Return the functions that partition p executes for every
+    command. """
+    top, prepare = self.top, self.prepare
+    is_main = ( p == 0 )
+
+    up = prepare.get_sim_schedule( top, self.schedules[p], self.events[p] )
+    flip = self.gen_posedge_flip( p )
+    ff_funcs = prepare.collect_ff_funcs( top, self.schedules_ff[p], [ flip ], hooks=is_main )
+
+    print_line_trace = self.print_line_trace
+    exchange_comb = [ x for x in [ self.gen_exchange( p, "comb" ) ] if x ]
+    exchange_flip = [ x for x in [ self.gen_exchange( p, "flip" ) ] if x ]
+    exchange_sync = [ x for x in [ self.gen_exchange( p, "sync" ) ] if x and self.sync_main ]
+
+    tick_schedule = up + exchange_comb + exchange_sync
+    if is_main and print_line_trace:
+      tick_schedule.append( top.print_line_trace )
+    tick_schedule += ff_funcs + exchange_flip + up + exchange_comb
+
+    gen = prepare.gen_schedule_function
+    tick = gen( top, "sim_tick_n", tick_schedule,
+                "def sim_tick_n( n ):\n  for _ in range( n ):\n    _body_" )
+    up_x = gen( top, "up", up + exchange_comb )
+    ff_x = gen( top, "ff", exchange_sync + ff_funcs + exchange_flip )
+
+    def print_reset_line_trace():
+      for f in exchange_sync:
+        f()
+      if is_main:
+        print( f"{top._sim.simulated_cycles:3}r {top.line_trace()}" )
+
+    active_high = prepare.reset_active_high
+
+    def sim_reset( n ):
+      if is_main and print_line_trace:
+        print()
+      # cycle 0
+      up_x()
+
+      ff_x()
+      # cycle 1
+      up_x()
+      if print_line_trace:
+        print_reset_line_trace()
+
+      ff_x()
+      # cycle 2
+      up_x()
+      if print_line_trace:
+        print_reset_line_trace()
+
+      ff_x()
+      # cycle 3
+      top.reset @= b1( not active_high )
+      up_x()
+
+    def sim_eval_combinational( n ):
+      up_x()
+
+    return { _TICK: tick, _EVAL: sim_eval_combinational, _RESET: sim_reset }
+
+  def gen_posedge_flip( self, p ):
+    """ Return the function that flips the registers written by the
+    update_ff blocks of partition p. Partition 0 also flips the registers
+    that no update_ff block writes. """
+    top = self.top
+    writes = set()
+    for x in self.schedules_ff[p]:
+      writes |= self._writes[x]
+    if p == 0:
+      owned = set()
+      for x in top._sched.schedule_ff:
+        owned |= self._writes[x]
+
+    mapping = top._sim.signal_object_mapping
+    names = set()
+    for x in top._dsl.all_signals:
+      if x._dsl.needs_double_buffer:
+        k = id( mapping[ x.get_top_level_signal() ][-1] )
+        if k in writes or ( p == 0 and k not in owned ):
+          names.add( repr( x.get_top_level_signal() ) )
+
+    lines = [ "def double_buffer():" ] + \
+            [ f"  {x}._flip()" for x in sorted( names ) ] + [ "  pass" ]
+    return self.compile_function( f"double_buffer {p}", lines )
+
+  #-----------------------------------------------------------------------
+  # Processes
+  #-----------------------------------------------------------------------
+
+  def start( self ):
+    for p in range( 1, self.nparts ):
+      proc = self._ctx.Process( target=self._worker, args=(p,), daemon=True )
+      proc.start()
+      self._procs.append( proc )
+    atexit.register( self.close )
+
+  def _worker( self, p ):
+    funcs, command = self._funcs[p], self._recv[p]
+    try:
+      while True:
+        cmd, n = command()
+        if cmd == _STOP:
+          return
+        funcs[cmd]( n )
+    except threading.BrokenBarrierError:
+      pass
+    except BaseException:
+      self._errors.put( ( p, traceback.format_exc() ) )
+      self._barrier.abort()
+
+  def run( self, cmd, n=0 ):
+    """ Execute cmd in all processes and return when partition 0 is
+    done. """
+    if self._broken:
+      raise RuntimeError( "The partitioned simulation has been aborted." )
+    if not self._procs:
+      self.start()
+
+    self.top._sim.check_top_level_inports()
+    try:
+      self._recv[0]( cmd, n )
+      self._funcs[0][cmd]( n )
+    except threading.BrokenBarrierError:
+      self._broken = True
+      if self._errors.empty():
+        raise RuntimeError( "A partition of the simulation stopped." ) from None
+      p, error = self._errors.get()
+      raise RuntimeError( f"Partition {p} of the simulation failed:\n{error}" ) from None
+    except BaseException:
+      self._broken = True
+      self._barrier.abort()
+      raise
+
+  def close( self ):
+    """ Stop the processes of the other partitions. """
+    if self._procs and not self._broken:
+      self._broken = True
+      try:
+        self._recv[0]( _STOP )
+      except threading.BrokenBarrierError:
+        pass
+    for proc in self._procs:
+      proc.join( 1 )
+      if proc.is_alive():
+        proc.terminate()
+    self._procs = []
+    self._broken = True
+
+  #-----------------------------------------------------------------------
+  # Simulation functions of the main process
+  #-----------------------------------------------------------------------
+
+  def sim_tick( self ):
+    self.run( _TICK, 1 )
+
+  def sim_eval_combinational( self ):
+    self.run( _EVAL )
+
+  def sim_reset( self ):
+    self.top.reset @= b1( self.prepare.reset_active_high )
+    self.run( _RESET )
+
+  def sim_run( self, ncycles, until=None, check_every=1 ):
+    if check_every < 1:
+      raise ValueError( f"check_every must be positive, not {check_every}" )
+    if until is None:
+      check_every = max( ncycles, 1 )
+    n = 0
+    while n < ncycles:
+      if until is not None and until():
+        break
+      k = min( check_every, ncycles - n )
+      self.run( _TICK, k )
+      n += k
+    return n
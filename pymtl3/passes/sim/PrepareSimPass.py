@@ -7,14 +7,16 @@ Author : Shunning Jiang
 Date   : Jan 26, 2020
 """
 
+import ast
+import sys
+
 import py
 
-from pymtl3.datatypes import Bits, b1
+from pymtl3.datatypes import Bits, b1, is_packed_bitstruct_class
 from pymtl3.dsl.Component import Component
 from pymtl3.dsl.Connectable import Const, Interface, MethodPort, Signal
 from pymtl3.dsl.NamedObject import NamedObject
 from pymtl3.extra.pypy import custom_exec
-from pymtl3.passes.backends.verilog import VerilogTBGenPass
 from pymtl3.passes.BasePass import BasePass, PassMetadata
 from pymtl3.passes.errors import PassOrderError
 from pymtl3.passes.tracing.CLLineTracePass import CLLineTracePass
@@ -22,15 +24,25 @@ from pymtl3.passes.tracing.LineTraceParamPass import LineTraceParamPass
 from pymtl3.passes.tracing.PrintTextWavePass import PrintTextWavePass
 from pymtl3.passes.tracing.VcdGenerationPass import VcdGenerationPass
 
+from .BlockInliner import BlockInliner
+from .EventDrivenSchedulePass import EventDrivenSchedulePass
+from .GenDAGPass import GenDAGPass
 from .SimpleTickPass import SimpleTickPass
 
 
 class PrepareSimPass( BasePass ):
-  def __init__( self, print_line_trace=True, reset_active_high=True ):
+  def __init__( self, print_line_trace=True, reset_active_high=True,
+                fuse_net_blocks=False, alias_nets=False, inline_blocks=False, partitions=1 ):
     assert reset_active_high in [ True, False ]
+    if type(partitions) is not int or partitions < 1:
+      raise ValueError( f"partitions must be a positive integer, not {partitions!r}" )
 
     self.print_line_trace  = print_line_trace
     self.reset_active_high = reset_active_high
+    self.fuse_net_blocks   = fuse_net_blocks
+    self.alias_nets        = alias_nets
+    self.inline_blocks     = inline_blocks
+    self.partitions        = partitions
 
   def __call__( self, top ):
     if hasattr(top, "sim_reset"):
@@ -47,6 +59,7 @@ class PrepareSimPass( BasePass ):
       raise PassOrderError( "schedule_posedge_flip" )
 
     top._sim = PassMetadata()
+    top._sim.alias_nets = self.alias_nets
 
     self.create_print_line_trace( top )
     self.create_sim_cycle_count( top )
@@ -54,17 +67,70 @@ class PrepareSimPass( BasePass ):
 
     top.lock_in_simulation()
 
+    top._sim.inliner = BlockInliner( top ) if self.inline_blocks else None
+
+    self.create_update_schedule( top )
     self.create_sim_eval_comb( top )
     self.create_sim_tick( top )
+    self.create_sim_run( top )
     self.create_sim_reset( top )
 
+    # partitions=K simulates the design in K processes
+    if self.partitions > 1:
+      self.create_partitioned_sim( top )
+
+
+  def create_update_schedule( self, top ):
+    top._sim.update_schedule = self.get_sim_schedule( top, top._sched.update_schedule,
+                                                      getattr( top._sched, "update_events", None ) )
+
+  def get_sim_schedule( self, top, schedule, events=None ):
+    # EventDrivenSchedulePass records the signals that every entry of the
+    # schedule reads and writes, so that we only execute the entries
+    # whose inputs changed. The generated function has to be shared by
+    # all simulation functions since it tracks the changes.
+    if events is not None:
+      return [ EventDrivenSchedulePass.gen_update_function( top, schedule, events ) ]
+
+    # The net blocks of aliased nets and the empty net blocks that only
+    # convey scheduling constraints don't do anything in simulation
+    if self.alias_nets:
+      genblk_src = top._dag.genblk_src
+      aliased    = top._sim.aliased_genblks
+      schedule   = [ x for x in schedule if not ( x in aliased or genblk_src.get( x ) == [] ) ]
+
+    # Fusing the consecutive net blocks saves one call per net per cycle
+    if self.fuse_net_blocks:
+      schedule = GenDAGPass.fuse_net_blocks( top, schedule )
+
+    return schedule
+
+  @staticmethod
+  def gen_schedule_function( top, name, schedule, template=None, _globals=None ):
+    # inline_blocks=True copies the bodies of the update blocks and net
+    # blocks into the generated function to save the calls, and looks up
+    # each attribute chain through the hierarchy once per call
+    inliner = getattr( top._sim, "inliner", None )
+    if inliner is not None:
+      return inliner.gen_function( name, schedule, template, _globals )
+
+    if template is None:
+      return SimpleTickPass.gen_tick_function( schedule )
+
+    # Call every entry of the schedule in place of "_body_"
+    _globals = dict( _globals or {} )
+    for i, blk in enumerate( schedule ):
+      _globals[ f"_c{i}" ] = blk
+    body = ast.parse( "\n".join( f"_c{i}()" for i in range(len(schedule)) ) ).body
+    return BlockInliner.compile_template( name, template, [], body, _globals )
 
   def create_sim_eval_comb( self, top ):
     # FIXME update_once? currently check if the design has method_port
     method_ports = top.get_all_object_filter( lambda x: isinstance( x, MethodPort ) )
 
     if len(method_ports) == 0: # Pure RTL design, add eval_combinational
-      sim_eval_combinational = SimpleTickPass.gen_tick_function( [top._sim.check_top_level_inports] + top._sched.update_schedule )
+      sim_eval_combinational = self.gen_schedule_function( top, "sim_eval_combinational",
+                                 [top._sim.check_top_level_inports] + top._sim.update_schedule )
     else:
       def sim_eval_combinational():
         raise NotImplementedError(f"top is not a pure RTL design. {'top'+repr(list(method_ports)[0])[1:]} is a method port.")
@@ -75,42 +141,77 @@ class PrepareSimPass( BasePass ):
     final_schedule = []
     if not top.get_all_object_filter( lambda x: isinstance( x, MethodPort ) ):
       # Pure RTL -- tick update blocks first
-      final_schedule = top._sched.update_schedule[::]
+      final_schedule = top._sim.update_schedule[::]
 
     if self.print_line_trace and hasattr( top, 'line_trace' ):
       final_schedule.append( top.print_line_trace )
     final_schedule += self.collect_ff_funcs( top )
-    final_schedule += top._sched.update_schedule
+    final_schedule += top._sim.update_schedule
     final_schedule.append( top._sim.check_top_level_inports )
-    top.sim_tick = SimpleTickPass.gen_tick_function( final_schedule )
+    top._sim.tick_schedule = final_schedule
+    top.sim_tick = self.gen_schedule_function( top, "sim_tick", final_schedule )
+
+  def create_sim_run( self, top ):
+    # sim_run( ncycles, until=None, check_every=1 ) ticks the simulator
+    # ncycles times in a generated loop, or stops early once until()
+    # returns True. until() is only called every check_every cycles,
+    # which may overshoot the stop condition by check_every-1 cycles.
+    # Returns the number of simulated cycles.
+    template = """
+def sim_run( ncycles, until=None, check_every=1 ):
+  if check_every < 1:
+    raise ValueError( f"check_every must be positive, not {check_every}" )
+  if until is None:
+    check_every = max( ncycles, 1 )
+  n = 0
+  while n < ncycles:
+    if until is not None and until():
+      break
+    k = min( check_every, ncycles - n )
+    for _ in range( k ):
+      _body_
+    n += k
+  return n
+"""
+    top.sim_run = self.gen_schedule_function( top, "sim_run", top._sim.tick_schedule, template )
 
-  def collect_ff_funcs( self, top ):
+  def collect_ff_funcs( self, top, schedule_ff=None, schedule_posedge_flip=None, hooks=True ):
     # ff_funcs summarizes the execution at the clock edge
     ret = []
-    # append tracing related work
-    if top.has_metadata( VcdGenerationPass.vcd_func ):
-      ret.append( top.get_metadata( VcdGenerationPass.vcd_func ) )
-
-    if top.has_metadata( PrintTextWavePass.textwave_func ):
-      ret.append( top.get_metadata( PrintTextWavePass.textwave_func ) )
-
-    if top.has_metadata( VerilogTBGenPass.vtbgen_hooks ):
-      ret.extend( top.get_metadata( VerilogTBGenPass.vtbgen_hooks ) )
-
-    ret.extend( top._sched.schedule_ff )
-    ret.extend( top._sched.schedule_posedge_flip )
+    if schedule_ff is None:
+      schedule_ff = top._sched.schedule_ff
+    if schedule_posedge_flip is None:
+      schedule_posedge_flip = top._sched.schedule_posedge_flip
+
+    # append tracing related work. The main process of a partitioned
+    # simulation is the only one that traces.
+    if hooks:
+      if top.has_metadata( VcdGenerationPass.vcd_func ):
+        ret.append( top.get_metadata( VcdGenerationPass.vcd_func ) )
+
+      if top.has_metadata( PrintTextWavePass.textwave_func ):
+        ret.append( top.get_metadata( PrintTextWavePass.textwave_func ) )
+
+      # Don't import the verilog backend just to look up the key. The hooks
+      # can't have been set if VerilogTBGenPass was never imported.
+      tbgen = sys.modules.get( "pymtl3.passes.backends.verilog.tbgen.VerilogTBGenPass" )
+      if tbgen and top.has_metadata( tbgen.VerilogTBGenPass.vtbgen_hooks ):
+        ret.extend( top.get_metadata( tbgen.VerilogTBGenPass.vtbgen_hooks ) )
+
+    ret.extend( schedule_ff )
+    ret.extend( schedule_posedge_flip )
     ret.append( self.create_advance_sim_cycle( top ) )
 
     # clear cl method flag after flip
-    if top.has_metadata( CLLineTracePass.clear_cl_trace_func ):
+    if hooks and top.has_metadata( CLLineTracePass.clear_cl_trace_func ):
       ret.append( top.get_metadata( CLLineTracePass.clear_cl_trace_func ) )
 
     return ret
 
   # Simulation related APIs
   def create_sim_reset( self, top ):
-    ff = SimpleTickPass.gen_tick_function( self.collect_ff_funcs( top ) )
-    up = SimpleTickPass.gen_tick_function( top._sched.update_schedule )
+    ff = self.gen_schedule_function( top, "ff", self.collect_ff_funcs( top ) )
+    up = self.gen_schedule_function( top, "up", top._sim.update_schedule )
 
     print_line_trace = self.print_line_trace and hasattr( top, 'line_trace' )
     active_high      = self.reset_active_high
@@ -141,6 +242,19 @@ class PrepareSimPass( BasePass ):
 
     top.sim_reset = sim_reset
 
+  def create_partitioned_sim( self, top ):
+    # The simulation functions of the main process send every command to
+    # the processes of the other partitions. sim_close() stops them.
+    # PartitionedSim imports multiprocessing, so it is only imported here.
+    from .PartitionedSim import PartitionedSim
+
+    sim = top._sim.partitioned_sim = PartitionedSim( top, self.partitions, self )
+    top.sim_eval_combinational = sim.sim_eval_combinational
+    top.sim_tick  = sim.sim_tick
+    top.sim_run   = sim.sim_run
+    top.sim_reset = sim.sim_reset
+    top.sim_close = sim.close
+
   def create_print_line_trace( self, top ):
     if self.print_line_trace and hasattr( top, 'line_trace' ):
       def print_line_trace():
@@ -160,6 +274,70 @@ class PrepareSimPass( BasePass ):
       return top._sim.simulated_cycles
     top.sim_cycle_count = sim_cycle_count
 
+  @staticmethod
+  def alias_field_nets( top, signal_object_mapping ):
+    """ Point all signals of every net that only consists of top-level
+    signals and fields of unpacked bitstructs to the same object, and add
+    the net blocks of these nets to top._sim.aliased_genblks. """
+
+    def is_aliasable( x ):
+      if isinstance( x, Const ):
+        return type(x._dsl.const) is not int
+      while not x.is_top_level_signal():
+        if x.is_sliced_signal() or x._dsl._my_indices:
+          return False
+        x = x.get_parent_object()
+        if is_packed_bitstruct_class( x._dsl.Type ):
+          return False
+      return True
+
+    nets = {}
+    reader_net = {}
+    for blk, (writer, readers) in top._dag.genblk_nets.items():
+      if top._dag.genblk_src[ blk ] and is_aliasable( writer ) and \
+         all( is_aliasable( x ) for x in readers ):
+        nets[ blk ] = (writer, readers)
+        for x in readers:
+          reader_net[ x ] = blk
+
+    def get_value( x ):
+      if isinstance( x, Const ):
+        return x._dsl.const
+      if x.is_top_level_signal():
+        return signal_object_mapping[ x ][-1]
+      return getattr( get_value( x.get_parent_object() ), x._dsl._my_name )
+
+    def set_value( x, value ):
+      if x.is_top_level_signal():
+        current_obj, i, is_list, _ = signal_object_mapping[ x ]
+        signal_object_mapping[ x ] = (current_obj, i, is_list, value)
+        if is_list: current_obj[i] = value
+        else:       setattr( current_obj, i, value )
+      else:
+        setattr( get_value( x.get_parent_object() ), x._dsl._my_name, value )
+
+    done = set()
+
+    def alias_net( blk ):
+      done.add( blk )
+      writer, readers = nets[ blk ]
+
+      # The enclosing signals have to be aliased first
+      for x in [ writer ] + readers:
+        while isinstance( x, Signal ) and not x.is_top_level_signal():
+          x = x.get_parent_object()
+          if x in reader_net and reader_net[x] not in done:
+            alias_net( reader_net[x] )
+
+      value = get_value( writer )
+      for x in readers:
+        set_value( x, value )
+      top._sim.aliased_genblks.add( blk )
+
+    for blk in nets:
+      if blk not in done:
+        alias_net( blk )
+
   @staticmethod
   def create_lock_unlock_simulation( top ):
 
@@ -254,6 +432,14 @@ class PrepareSimPass( BasePass ):
             else:
               setattr( current_obj, i, residence_value )
 
+      # Other nets consist of (nested) fields of bitstructs and possibly
+      # slices. Optionally point the readers of the nets without slices to
+      # the object of the writer too, because bitstructs update their
+      # fields in place.
+      top._sim.aliased_genblks = set()
+      if getattr( top._sim, "alias_nets", False ):
+        PrepareSimPass.alias_field_nets( top, signal_object_mapping )
+
       top._sim.signal_object_mapping = signal_object_mapping
       top._sim.locked_simulation = True
 
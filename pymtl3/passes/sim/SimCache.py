@@ -0,0 +1,218 @@
+"""
+========================================================================
+SimCache.py
+========================================================================
+An on-disk cache for the results of GenDAGPass and DynamicSchedulePass.
+
+The cache is keyed by the source files of all component classes, struct
+types, the modules that their construct() refers to, the DSL and the
+simulation passes, by the versions of pymtl3 and Python, and by the
+construction arguments of every component in the hierarchy. A design is
+not cached if an argument has no repr that identifies its value, like
+the default repr of objects that contains their address.
+
+The update blocks themselves are closures created at elaboration and
+cannot be stored, so the cache refers to every object by name: signals
+and components by their full names, update blocks by their host
+component and name, and net blocks by their generated names.
+"""
+import importlib
+import os
+import pickle
+import re
+import sys
+import types
+import warnings
+from hashlib import blake2b
+
+from pymtl3.version import __version__
+
+# Bump this when the format of the cached data changes
+_VERSION = b"2"
+
+# The repr of objects that don't define one, which changes every run
+_DEFAULT_REPR = re.compile( r"<[^<>]* at 0x[0-9a-fA-F]+>" )
+
+class _Uncacheable( Exception ):
+  pass
+
+def _arg_key( x ):
+  """ Return a string that identifies the value of the construction
+  argument x, or raise _Uncacheable. """
+  if isinstance( x, ( list, tuple ) ):
+    return f"{type(x).__name__}({', '.join( _arg_key( y ) for y in x )})"
+  if isinstance( x, dict ):
+    items = sorted( ( _arg_key( k ), _arg_key( v ) ) for k, v in x.items() )
+    return f"{{{', '.join( f'{k}: {v}' for k, v in items )}}}"
+
+  # Functions and classes are identified by name. Lambdas and closures
+  # have the same names for different objects.
+  if isinstance( x, ( types.FunctionType, type ) ):
+    if "<" in x.__qualname__:
+      raise _Uncacheable( repr(x) )
+    return f"{x.__module__}.{x.__qualname__}"
+
+  # The repr of arrays like numpy's is truncated
+  if all( hasattr( x, y ) for y in ( "tobytes", "shape", "dtype" ) ):
+    digest = blake2b( x.tobytes(), digest_size=16 ).hexdigest()
+    return f"{type(x).__qualname__}({x.dtype}, {x.shape}, {digest})"
+
+  ret = repr(x)
+  if _DEFAULT_REPR.search( ret ):
+    raise _Uncacheable( ret )
+  return ret
+
+def _get_module_file( obj ):
+  module = obj if isinstance( obj, types.ModuleType ) else \
+           sys.modules.get( getattr( obj, "__module__", None ) )
+  return getattr( module, "__file__", None )
+
+def _get_global_objects( func ):
+  """ Yield the global modules, functions and classes that func and the
+  functions nested in it refer to. """
+  codes = [ func.__code__ ]
+  while codes:
+    code = codes.pop()
+    for name in code.co_names:
+      obj = func.__globals__.get( name )
+      if isinstance( obj, ( types.ModuleType, types.FunctionType, type ) ):
+        yield obj
+    codes.extend( x for x in code.co_consts if isinstance( x, types.CodeType ) )
+
+class SimCache:
+
+  def __init__( self, top, cache_dir ):
+    self.top       = top
+    self.cache_dir = os.path.expanduser( cache_dir )
+    self.key       = self.get_key( top )
+
+    self.objs = { repr(x): x for x in top._dsl.all_named_objects }
+    self.genblks = {}
+
+  @staticmethod
+  def get( top, cache_dir ):
+    """ Return the SimCache of top that has been created by an earlier
+    pass, or a new one. """
+    try:
+      cache = top._dag.sim_cache
+    except AttributeError:
+      cache = top._dag.sim_cache = SimCache( top, cache_dir )
+    return cache
+
+  @staticmethod
+  def get_key( top ):
+    """ Return the key of top, or None if top can't be cached because a
+    construction argument has no repr that identifies its value. """
+    try:
+      args = [ f"{c!r} {type(c).__qualname__} {_arg_key( c._dsl.args )} "
+               f"{_arg_key( dict( c._dsl.kwargs ) )}\n"
+               for c in sorted( top.get_all_components(), key=repr ) ]
+    except _Uncacheable as e:
+      warnings.warn( f"The simulation of {type(top).__name__} is not cached because the "
+                     f"construction argument {e} has no repr that identifies its value." )
+      return None
+
+    files   = set()
+    classes = set()
+
+    for c in top.get_all_components():
+      classes.update( type(c).__mro__ )
+    for x in top._dsl.all_signals:
+      classes.add( x._dsl.Type )
+
+    for t in classes:
+      files.add( _get_module_file( t ) )
+
+      # The modules of the helpers that construct() uses
+      construct = t.__dict__.get( "construct" )
+      if isinstance( construct, types.FunctionType ):
+        for obj in _get_global_objects( construct ):
+          files.add( _get_module_file( obj ) )
+
+    # The cached results also depend on the DSL and the simulation passes
+    for module in ( "pymtl3.dsl", "pymtl3.passes.sim" ):
+      path = os.path.dirname( importlib.import_module( module ).__file__ )
+      files.update( os.path.join( path, x ) for x in os.listdir( path ) if x.endswith( ".py" ) )
+
+    files.discard( None )
+
+    h = blake2b( digest_size=16 )
+    h.update( _VERSION )
+    h.update( f"{__version__} {sys.version}\n".encode() )
+    for path in sorted( files ):
+      with open( path, 'rb' ) as f:
+        h.update( path.encode() )
+        h.update( f.read() )
+
+    for x in args:
+      h.update( x.encode() )
+
+    return h.hexdigest()
+
+  def _path( self, kind ):
+    return os.path.join( self.cache_dir, f"{self.key}.{kind}.pkl" )
+
+  def load( self, kind ):
+    """ Return the cached data of kind, or None. """
+    if self.key is None:
+      return None
+    try:
+      with open( self._path( kind ), 'rb' ) as f:
+        return pickle.load( f )
+    except ( OSError, pickle.UnpicklingError, EOFError ):
+      return None
+
+  def dump( self, kind, data ):
+    if self.key is None:
+      return
+    os.makedirs( self.cache_dir, exist_ok=True )
+    path = self._path( kind )
+    tmp  = f"{path}.{os.getpid()}.tmp"
+    with open( tmp, 'wb' ) as f:
+      pickle.dump( data, f, protocol=pickle.HIGHEST_PROTOCOL )
+    os.replace( tmp, path )
+
+  #-----------------------------------------------------------------------
+  # Names of objects
+  #-----------------------------------------------------------------------
+  # Fields and slices of signals are created on demand and are not named
+  # objects, so we get them from the enclosing signal.
+
+  def get_object( self, name ):
+    try:
+      return self.objs[ name ]
+    except KeyError:
+      pass
+
+    if name[-1] == ']':
+      prefix, _, idx = name[:-1].rpartition( '[' )
+      parent = self.get_object( prefix )
+      if ':' in idx:
+        start, stop = idx.split( ':' )
+        obj = parent[ int(start):int(stop) ]
+      else:
+        obj = parent[ int(idx) ]
+    else:
+      prefix, _, field = name.rpartition( '.' )
+      obj = getattr( self.get_object( prefix ), field )
+
+    self.objs[ name ] = obj
+    return obj
+
+  def block_id( self, blk ):
+    """ Return the name of an update block or a net block, or None if blk
+    is neither of them. """
+    top = self.top
+    if blk in top._dag.genblks:
+      return ( None, blk.__name__ )
+    if blk in top._dsl.all_upblk_hostobj:
+      return ( repr( top.get_update_block_host_component( blk ) ), blk.__name__ )
+    return None
+
+  def get_block( self, bid ):
+    host, name = bid
+    if host is None:
+      if not self.genblks:
+        self.genblks = { x.__name__: x for x in self.top._dag.genblks }
+      return self.genblks[ name ]
+    return self.get_object( host )._dsl.name_upblk[ name ]
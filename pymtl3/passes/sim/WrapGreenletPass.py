@@ -8,8 +8,6 @@ greenlet.
 Author : Shunning Jiang
 Date   : May 20, 2019
 """
-from greenlet import greenlet
-
 from pymtl3.dsl.errors import UpblkCyclicError
 from pymtl3.passes.BasePass import BasePass
 from pymtl3.passes.errors import PassOrderError
@@ -33,6 +31,8 @@ class WrapGreenletPass( BasePass ):
     if not greenlet_upblks:
       return
 
+    from greenlet import greenlet
+
     def wrap_greenlet( blk ):
 
       def greenlet_wrapper():
@@ -0,0 +1,187 @@
+#=========================================================================
+# BlockInliner_test.py
+#=========================================================================
+
+from pymtl3.datatypes import Bits8, Bits16, bitstruct, zext
+from pymtl3.dsl import *
+
+from ...PassGroups import DefaultPassGroup
+
+OFFSET = 3
+
+def add_offset( x ):
+  return x + OFFSET
+
+@bitstruct
+class InlineMsg:
+  a: Bits8
+  b: Bits8
+
+class Acc( Component ):
+
+  def construct( s, step ):
+    s.in_ = InPort( Bits8 )
+    s.out = OutPort( InlineMsg )
+    s.acc = Wire( Bits8 )
+
+    @update_ff
+    def up_acc():
+      if s.reset:
+        s.acc <<= 0
+      else:
+        s.acc <<= s.acc + s.in_ + step
+
+    # Locals with the same name as in other blocks, a module global that
+    # may change, and a global function
+    @update
+    def up_out():
+      tmp = s.acc + OFFSET
+      s.out.a @= tmp
+      s.out.b @= add_offset( s.in_ )
+
+class Top( Component ):
+
+  def construct( s ):
+    s.in_ = InPort( Bits8 )
+    s.out = OutPort( Bits16 )
+    s.out2 = OutPort( Bits8 )
+
+    s.acc = [ Acc( i+1 ) for i in range(2) ]
+    s.acc[0].in_ //= s.in_
+    s.acc[1].in_ //= s.acc[0].out.a
+
+    s.m = Wire( InlineMsg )
+    s.m.a //= s.acc[1].out.a
+    s.m.b //= 5
+
+    @update
+    def up_out():
+      tmp = zext( s.m.a, 16 )
+      for i in range(2):
+        tmp = tmp + zext( s.m.b, 16 )
+      s.out @= tmp
+
+    # Can't be inlined
+    @update
+    def up_out2():
+      s.out2 @= sum( [ s.in_, s.m.b ] )
+      if s.reset:
+        return
+      s.out2 @= s.out2 + 1
+
+def _run( new_offset=None, **kwargs ):
+  global OFFSET
+  A = Top()
+  A.elaborate()
+  A.apply( DefaultPassGroup( print_line_trace=False, **kwargs ) )
+  A.sim_reset()
+
+  trace = []
+  for i in range(20):
+    if i == 10 and new_offset is not None:
+      OFFSET = new_offset
+    A.in_ @= i * 13
+    A.sim_eval_combinational()
+    trace.append( ( int(A.out), int(A.out2) ) )
+    A.sim_tick()
+  return A, trace
+
+def test_inline_blocks():
+  _, ref = _run()
+
+  A, trace = _run( inline_blocks=True )
+  assert trace == ref
+
+  inliner = A._sim.inliner
+  assert inliner.num_inlined > 0
+  # up_out2 is called in sim_eval_combinational, sim_tick and sim_reset
+  assert inliner.num_called > 0
+  assert inliner.inline( A._dsl.name_upblk["up_out2"] ) is None
+  assert inliner.inline( A._dsl.name_upblk["up_out"] ) is not None
+
+def test_inline_blocks_reassigned_global():
+  global OFFSET
+  # Module globals other than functions are looked up every time
+  _, base = _run()
+  try:
+    _, ref = _run( new_offset=4 )
+    OFFSET = 3
+    _, trace = _run( new_offset=4, inline_blocks=True )
+    assert trace == ref != base
+  finally:
+    OFFSET = 3
+
+def test_inline_blocks_with_fusion_and_aliasing():
+  _, ref = _run()
+  _, trace = _run( inline_blocks=True, fuse_net_blocks=True, alias_nets=True )
+  assert trace == ref
+
+class Alu( Component ):
+
+  def construct( s ):
+    s.in0 = InPort( Bits8 )
+    s.in1 = InPort( Bits8 )
+    s.out = OutPort( Bits8 )
+
+    @update
+    def up_alu():
+      s.out @= s.in0 + s.in1
+
+class Dpath( Component ):
+
+  def construct( s ):
+    s.in_ = InPort( Bits8 )
+    s.alu = Alu()
+    s.reg0 = Wire( Bits8 )
+    s.reg1 = Wire( Bits8 )
+    s.alu.in0 //= s.in_
+    s.alu.in1 //= s.reg1
+
+    @update_ff
+    def up_regs():
+      s.reg0 <<= s.alu.out
+      s.reg1 <<= s.reg0
+
+class Deep( Component ):
+
+  def construct( s ):
+    s.in_ = InPort( Bits8 )
+    s.out = OutPort( Bits8 )
+    s.dpath = Dpath()
+    s.count = 0
+
+    @update
+    def up_dpath_in():
+      s.dpath.in_ @= s.in_ + s.count
+
+    @update
+    def up_out():
+      s.out @= s.dpath.alu.out + s.dpath.alu.in1
+
+    # A plain attribute that is reassigned every cycle
+    @update_ff
+    def up_count():
+      s.count = ( s.count + 1 ) % 64
+
+def test_hoist_attribute_chains():
+  traces = []
+  for kwargs in [ {}, { "inline_blocks": True } ]:
+    A = Deep()
+    A.elaborate()
+    A.apply( DefaultPassGroup( print_line_trace=False, **kwargs ) )
+    A.sim_reset()
+
+    trace = []
+    for i in range(20):
+      A.in_ @= i
+      A.sim_tick()
+      trace.append( ( int(A.out), A.count ) )
+    traces.append( trace )
+
+  assert traces[0] == traces[1]
+
+  # Each chain is bound once, including the prefixes, but not s.count
+  inliner = A._sim.inliner
+  inliner.gen_function( "f", A._sim.update_schedule + A._sched.schedule_ff )
+  assert sorted( x for _, x in inliner._hoisted ) == \
+         [ "alu", "dpath", "in0", "in1", "in_", "in_", "out", "out", "reg0", "reg1" ]
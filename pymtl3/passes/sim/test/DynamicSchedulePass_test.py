@@ -5,7 +5,7 @@
 # Author : Shunning Jiang
 # Date   : Apr 19, 2019
 
-from pymtl3.datatypes import Bits8, Bits32, bitstruct
+from pymtl3.datatypes import Bits8, Bits32, bitstruct, zext
 from pymtl3.dsl import *
 from pymtl3.dsl.errors import UpblkCyclicError
 
@@ -221,7 +221,7 @@ def test_const_connect_nested_struct_signal_to_struct():
   x.sim_tick()
   assert x.out == SomeMsg2(SomeMsg1(1,2),3)
 
-def test_const_connect_cannot_handle_same_name_nested_struct():
+def test_const_connect_same_name_nested_struct():
 
   class A:
     @bitstruct
@@ -251,13 +251,11 @@ def test_const_connect_cannot_handle_same_name_nested_struct():
 
   x = Top()
   x.elaborate()
-  try:
-    x.apply( GenDAGPass() )
-  except AssertionError as e:
-    print(e)
-    assert str(e).startswith("Cannot handle two subfields with the same struct name but different structs")
-    return
-  raise Exception("Should've thrown AssertionError")
+  x.apply( GenDAGPass() )
+  x.apply( DynamicSchedulePass() )
+  x.apply( PrepareSimPass() )
+  x.sim_reset()
+  assert x.out.a == SomeMsg2(A.SomeMsg1(1,2),B.SomeMsg1(3,4))
 
 def test_equal_top_level():
   class A(Component):
@@ -315,3 +313,87 @@ def test_update_once():
     print(e)
     return
   raise Exception("Should've thrown UpblkCyclicError")
+
+def test_packed_struct_false_cyclic_dependency():
+
+  @bitstruct(packed=True)
+  class SomeMsg:
+    a: Bits8
+    b: Bits32
+
+  class Top( Component ):
+    def construct( s ):
+      s.in_ = InPort( Bits8 )
+      s.out = OutPort( Bits32 )
+      s.st  = Wire( SomeMsg )
+
+      @update
+      def up1():
+        s.st.a @= s.in_
+        s.out @= s.st.b
+
+      @update
+      def up2():
+        s.st.b @= zext( s.st.a, 32 ) + 1
+
+  x = Top()
+  x.elaborate()
+  x.apply( GenDAGPass() )
+  x.apply( DynamicSchedulePass() )
+  x.apply( PrepareSimPass(print_line_trace=False) )
+  x.sim_reset()
+
+  x.in_ @= 5
+  x.sim_eval_combinational()
+  assert x.out == 6
+  assert x.st == SomeMsg( 5, 6 )
+
+def test_scc_worklist():
+
+  class Top( Component ):
+    def construct( s ):
+      s.in_ = InPort( Bits32 )
+      s.x = Wire( Bits32 )
+      s.a = Wire( Bits32 )
+      s.b = Wire( Bits32 )
+      s.c = Wire( Bits32 )
+      s.out = OutPort( Bits32 )
+      s.count_a = s.count_b = s.count_c = 0
+
+      # The SCC starts from up_a, which reads s.x
+      @update
+      def up_x():
+        s.x @= s.in_
+
+      # c doesn't affect a, but a has to be executed again after c
+      @update
+      def up_a():
+        s.count_a = s.count_a + 1
+        s.a @= s.x | ( s.c & 0 )
+
+      @update
+      def up_b():
+        s.count_b = s.count_b + 1
+        s.b @= s.a + 1
+
+      @update
+      def up_c():
+        s.count_c = s.count_c + 1
+        s.c @= s.b + 1
+        s.out @= s.c
+
+  x = Top()
+  x.elaborate()
+  x.apply( GenDAGPass() )
+  x.apply( DynamicSchedulePass() )
+  x.apply( PrepareSimPass(print_line_trace=False) )
+  assert len( x._sched.scc_upblks ) == 1
+  x.sim_reset()
+
+  x.count_a = x.count_b = x.count_c = 0
+  x.in_ @= 5
+  x.sim_eval_combinational()
+  assert x.out == 7
+
+  # Only up_a is executed again, instead of the whole SCC
+  assert ( x.count_a, x.count_b, x.count_c ) == ( 2, 1, 1 )
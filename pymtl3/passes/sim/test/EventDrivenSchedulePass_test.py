@@ -0,0 +1,240 @@
+#=========================================================================
+# EventDrivenSchedulePass_test.py
+#=========================================================================
+
+import random
+
+import pytest
+
+from pymtl3.datatypes import Bits8, Bits16, bitstruct, zext
+from pymtl3.dsl import *
+
+from ...PassGroups import DefaultPassGroup
+from ..EventDrivenSchedulePass import EventDrivenSchedulePass
+from ..GenDAGPass import GenDAGPass
+from ..PrepareSimPass import PrepareSimPass
+
+counts = {}
+
+def count( name ):
+  counts[ name ] = counts.get( name, 0 ) + 1
+
+def _test_model( cls, *args ):
+  A = cls( *args )
+  A.elaborate()
+  A.apply( GenDAGPass() )
+  A.apply( EventDrivenSchedulePass() )
+  A.apply( PrepareSimPass() )
+  A.sim_reset()
+  return A
+
+class Pipe( Component ):
+
+  def construct( s ):
+    s.in_ = InPort( Bits8 )
+    s.en  = InPort()
+    s.out = OutPort( Bits8 )
+    s.reg = Wire( Bits8 )
+    s.tmp = Wire( Bits8 )
+
+    @update_ff
+    def up_reg():
+      if s.en:
+        s.reg <<= s.in_
+
+    @update
+    def up_tmp():
+      count( 'up_tmp' )
+      s.tmp @= s.reg + 1
+
+    @update
+    def up_out():
+      count( 'up_out' )
+      s.out @= s.tmp + s.in_
+
+def test_skip_idle_blocks():
+  A = _test_model( Pipe )
+
+  A.in_ @= 3
+  A.en  @= 1
+  A.sim_eval_combinational()
+  assert A.out == 4
+  A.sim_tick()
+  assert A.out == 7
+
+  counts.clear()
+  A.en @= 0
+  for i in range(5):
+    A.sim_tick()
+    assert A.out == 7
+  # Only the enable changed, and nothing reads it combinationally
+  assert counts == {}
+
+  A.in_ @= 5
+  A.sim_eval_combinational()
+  assert A.out == 9
+  assert counts == { 'up_out': 1 }
+
+  A.en @= 1
+  A.sim_tick()
+  assert A.out == 11
+  assert counts == { 'up_out': 2, 'up_tmp': 1 }
+
+def test_impure_block_always_executes():
+
+  class Top( Component ):
+
+    def construct( s ):
+      s.in_ = InPort( Bits8 )
+      s.out = OutPort( Bits8 )
+      s.offset = 1
+
+      @update
+      def up_out():
+        s.out @= s.in_ + s.offset
+
+  A = _test_model( Top )
+  assert [ r for r, _ in A._sched.update_events ] == [ None ]
+
+  A.in_ @= 2
+  A.sim_eval_combinational()
+  assert A.out == 3
+  A.offset = 2
+  A.sim_eval_combinational()
+  assert A.out == 4
+
+def test_pure_function_call():
+
+  class Top( Component ):
+
+    def construct( s ):
+      s.in_ = InPort( Bits8 )
+      s.out = OutPort( Bits16 )
+      s.sel = InPort()
+      s.rnd = OutPort( Bits16 )
+
+      @s.func
+      def ext( x ):
+        return zext( x, 16 ) + zext( s.sel, 16 )
+
+      @update
+      def up_out():
+        s.out @= ext( s.in_ )
+
+      @update
+      def up_rand():
+        if s.sel:
+          s.rnd @= random.randint( 0, 1 )
+
+  A = _test_model( Top )
+  reads = [ r for r, _ in A._sched.update_events ]
+  assert len(reads) == 2
+  assert None in reads and any( r and len(r) == 2 for r in reads )
+
+def test_scc_and_struct():
+
+  @bitstruct
+  class Point:
+    x: Bits8
+    y: Bits8
+
+  class Top( Component ):
+
+    def construct( s ):
+      s.in_ = InPort( Bits8 )
+      s.p   = Wire( Point )
+      s.out = OutPort( Bits8 )
+
+      @update
+      def up_x():
+        s.p.x @= s.in_
+
+      @update
+      def up_y():
+        s.p.y @= s.p.x + 1
+
+      @update
+      def up_out():
+        s.out @= s.p.y
+
+  A = _test_model( Top )
+  for i in range(10):
+    A.in_ @= i
+    A.sim_eval_combinational()
+    assert A.out == i + 1
+
+def test_fallback_with_method_ports():
+
+  class Top( Component ):
+
+    def construct( s ):
+      s.out = OutPort( Bits8 )
+      s.cnt = Bits8(0)
+
+      @update_once
+      def up():
+        s.out @= s.get()
+
+    @method_port
+    def get( s ):
+      return s.cnt
+
+  with pytest.warns( UserWarning ):
+    A = _test_model( Top )
+  assert not hasattr( A._sched, 'update_events' )
+  assert A._sim.update_schedule == A._sched.update_schedule
+
+class Acc( Component ):
+
+  def construct( s ):
+    s.in_ = InPort( Bits8 )
+    s.en  = InPort()
+    s.out = OutPort( Bits16 )
+    s.acc = Wire( Bits16 )
+
+    @update_ff
+    def up_acc():
+      if s.reset:
+        s.acc <<= 0
+      elif s.en:
+        s.acc <<= s.out
+
+    @update
+    def up_out():
+      s.out @= s.acc + zext( s.in_, 16 )
+
+class Accs( Component ):
+
+  def construct( s ):
+    s.in_ = InPort( Bits8 )
+    s.en  = [ InPort() for _ in range(3) ]
+    s.out = OutPort( Bits16 )
+    s.acc = [ Acc() for _ in range(3) ]
+
+    s.acc[0].in_ //= s.in_
+    for i in range(3):
+      s.acc[i].en //= s.en[i]
+    for i in range(2):
+      s.acc[i+1].in_ //= s.acc[i].out[0:8]
+    s.out //= s.acc[2].out
+
+def _run_accs( event_driven ):
+  rng = random.Random( 0xdeadbeef )
+
+  A = Accs()
+  A.elaborate()
+  A.apply( DefaultPassGroup( event_driven=event_driven ) )
+  A.sim_reset()
+
+  trace = []
+  for i in range( 200 ):
+    A.in_ @= rng.randint( 0, 0xff ) if rng.randint( 0, 3 ) == 0 else A.in_
+    for j in range(3):
+      A.en[j] @= rng.randint( 0, 3 ) == 0
+    A.sim_eval_combinational()
+    trace.append( int(A.out) )
+    A.sim_tick()
+  return trace
+
+def test_same_as_full_schedule():
+  assert _run_accs( True ) == _run_accs( False )
@@ -0,0 +1,122 @@
+#=========================================================================
+# GenDAGPass_test.py
+#=========================================================================
+
+from pymtl3.datatypes import Bits8, Bits16, bitstruct, mk_bits, zext
+from pymtl3.dsl import *
+
+from ...PassGroups import DefaultPassGroup
+from ..GenDAGPass import GenDAGPass
+
+
+def _mk_structs( nbits ):
+  # Different structs with the same names
+
+  @bitstruct
+  class Msg:
+    x: mk_bits( nbits )
+    y: Bits8
+
+  @bitstruct
+  class Outer:
+    m: Msg
+    z: Bits8
+
+  return Msg, Outer
+
+Msg8,  Outer8  = _mk_structs( 8 )
+Msg16, Outer16 = _mk_structs( 16 )
+
+class Sub( Component ):
+
+  def construct( s, T ):
+    s.in_ = InPort( T )
+    s.out = OutPort( Bits16 )
+
+    @update
+    def up():
+      s.out @= zext( s.in_.m.x, 16 ) + zext( s.in_.m.y, 16 ) + zext( s.in_.z, 16 )
+
+class Top( Component ):
+
+  def construct( s ):
+    s.in_  = InPort( Bits8 )
+    s.out0 = OutPort( Bits16 )
+    s.out1 = OutPort( Bits16 )
+    s.out2 = OutPort( Bits8 )
+
+    s.a = Sub( Outer8 )
+    s.b = Sub( Outer16 )
+    s.a.in_.m //= Msg8( 1, 2 )
+    s.a.in_.z //= s.in_
+    s.b.in_.m //= Msg16( 3, 4 )
+    s.b.in_.z //= 0
+    s.out0 //= s.a.out
+    s.out1 //= s.b.out
+
+    s.tmp = Wire( Bits16 )
+    s.tmp //= s.a.out
+    s.out2 //= s.tmp[0:8]
+
+def _run( **kwargs ):
+  A = Top()
+  A.elaborate()
+  A.apply( DefaultPassGroup( **kwargs ) )
+  A.sim_reset()
+
+  trace = []
+  for i in range(10):
+    A.in_ @= i
+    A.sim_eval_combinational()
+    trace.append( ( int(A.out0), int(A.out1), int(A.out2) ) )
+    A.sim_tick()
+  return A, trace
+
+def test_structs_with_same_name():
+  A, trace = _run()
+  assert trace == [ ( 3+i, 7, 3+i ) for i in range(10) ]
+
+def test_fuse_net_blocks():
+  A, trace = _run( fuse_net_blocks=True )
+  assert trace == _run()[1]
+
+  genblks = A._dag.genblks
+  assert not any( x in genblks for x in A._sim.update_schedule )
+  assert A._dag.fused_genblks
+  for blk in A._dag.fused_genblks:
+    assert blk in A._sim.update_schedule
+
+  # No two fused blocks are adjacent
+  schedule = A._sim.update_schedule
+  fused = set( A._dag.fused_genblks )
+  for x, y in zip( schedule, schedule[1:] ):
+    assert not ( x in fused and y in fused )
+
+def test_same_net_block_names():
+
+  class Child( Component ):
+
+    def construct( s ):
+      s.b = OutPort( Bits8 )
+
+      @update
+      def up():
+        s.b @= 1
+
+  class Top( Component ):
+
+    def construct( s ):
+      s.a   = Child()
+      s.a_b = Wire( Bits8 )
+      s.x   = [ OutPort( Bits8 ) for _ in range(2) ]
+      s.x[0] //= s.a.b
+      s.x[1] //= s.a_b
+
+      @update
+      def up():
+        s.a_b @= 2
+
+  A = Top()
+  A.elaborate()
+  A.apply( GenDAGPass() )
+  assert len( { x.__name__ for x in A._dag.genblks } ) == len( A._dag.genblks ) == 4
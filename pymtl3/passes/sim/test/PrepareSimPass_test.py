@@ -0,0 +1,323 @@
+#=========================================================================
+# PrepareSimPass_test.py
+#=========================================================================
+
+from pymtl3.datatypes import Bits8, Bits16, Bits80, bitstruct, concat, trunc, zext
+from pymtl3.dsl import *
+
+from ...mamba import HeuTopoUnrollSim, Mamba2020, UnrollSim
+from ...PassGroups import DefaultPassGroup
+
+
+@bitstruct
+class Msg:
+  x: Bits8
+  y: Bits8
+
+@bitstruct
+class Outer:
+  m: Msg
+  z: Bits8
+
+@bitstruct( packed=True )
+class PackedMsg:
+  x: Bits8
+  y: Bits8
+
+class Producer( Component ):
+
+  def construct( s ):
+    s.in_ = InPort( Bits8 )
+    s.out = OutPort( Outer )
+
+    @update
+    def up():
+      s.out.m.x @= s.in_
+      s.out.m.y @= s.in_ + 1
+      s.out.z   @= s.in_ + 2
+
+class Consumer( Component ):
+
+  def construct( s ):
+    s.in_ = InPort( Outer )
+    s.out = OutPort( Bits16 )
+
+    @update
+    def up():
+      s.out @= zext( s.in_.m.x, 16 ) + zext( s.in_.m.y, 16 ) + zext( s.in_.z, 16 )
+
+class Top( Component ):
+
+  def construct( s ):
+    s.in_  = InPort( Bits8 )
+    s.out0 = OutPort( Bits16 )
+    s.out1 = OutPort( Bits8 )
+    s.out2 = OutPort( Bits8 )
+    s.out3 = OutPort( Bits8 )
+
+    s.prod = Producer()
+    s.prod.in_ //= s.in_
+
+    # Field to field, and a slice that can't be aliased
+    s.cons = Consumer()
+    s.cons.in_.m //= s.prod.out.m
+    s.cons.in_.z[0:4] //= s.in_[0:4]
+    s.cons.in_.z[4:8] //= 0
+    s.out0 //= s.cons.out
+
+    # Field to top-level signal, whose field drives another net
+    s.w = Wire( Msg )
+    s.w //= s.prod.out.m
+    s.out1 //= s.w.y
+
+    # Fields of packed bitstructs are not objects
+    s.p = Wire( PackedMsg )
+    s.p.x //= s.prod.out.z
+    s.p.y //= s.in_
+
+    @update
+    def up():
+      s.out2 @= s.p.x + s.p.y
+
+    # Constant struct to a field
+    s.v = Wire( Outer )
+    s.v.m //= Msg( 3, 4 )
+    s.v.z //= s.in_
+
+    @update
+    def up_v():
+      s.out3 @= s.v.m.x + s.v.m.y + s.v.z
+
+def _run( **kwargs ):
+  A = Top()
+  A.elaborate()
+  A.apply( DefaultPassGroup( print_line_trace=False, **kwargs ) )
+  A.sim_reset()
+
+  trace = []
+  for i in range(20):
+    A.in_ @= i * 13
+    A.sim_eval_combinational()
+    trace.append( ( int(A.out0), int(A.out1), int(A.out2), int(A.out3) ) )
+    A.sim_tick()
+  return A, trace
+
+def test_alias_nets():
+  A, trace = _run( alias_nets=True )
+  B, ref   = _run()
+  assert trace == ref
+
+  # s.in_ also drives a field of a packed bitstruct
+  assert len( A._sim.aliased_genblks ) == 3
+  assert len( A._sim.update_schedule ) < len( B._sim.update_schedule )
+  for blk in A._sim.aliased_genblks:
+    assert blk not in A._sim.update_schedule
+
+  assert A.cons.in_.m is A.prod.out.m
+  assert A.w is A.prod.out.m
+  assert A.v.m is not A.cons.in_.m
+
+def test_alias_nets_with_fusion():
+  _, trace = _run( alias_nets=True, fuse_net_blocks=True )
+  assert trace == _run()[1]
+
+def test_alias_nets_event_driven():
+  A, trace = _run( alias_nets=True, event_driven=True )
+  assert trace == _run()[1]
+
+class Counter( Component ):
+
+  def construct( s ):
+    s.en    = InPort()
+    s.count = OutPort( Bits16 )
+
+    @update_ff
+    def up_count():
+      if s.reset:
+        s.count <<= 0
+      elif s.en:
+        s.count <<= s.count + 1
+
+  def done( s ):
+    return s.count >= 10
+
+def _counter( PassGroup=DefaultPassGroup, **kwargs ):
+  A = Counter()
+  A.elaborate()
+  A.apply( PassGroup( print_line_trace=False, **kwargs ) )
+  A.sim_reset()
+  A.en @= 1
+  return A
+
+def test_sim_run():
+  for PassGroup, kwargs in [ ( DefaultPassGroup, {} ),
+                             ( DefaultPassGroup, { "inline_blocks": True } ),
+                             ( UnrollSim, {} ),
+                             ( HeuTopoUnrollSim, {} ),
+                             ( Mamba2020, {} ),
+                             # Repartitions in the middle of a sim_run
+                             ( Mamba2020, { "profile_cycles": 3 } ) ]:
+    A = _counter( PassGroup, **kwargs )
+    start = A.sim_cycle_count()
+    assert A.sim_run( 5 ) == 5
+    assert A.count == 5
+    assert A.sim_cycle_count() == start + 5
+
+    # Stops before the tick once until() is True
+    assert A.sim_run( 100, until=A.done ) == 5
+    assert A.count == 10
+    assert A.sim_run( 100, until=A.done ) == 0
+
+    A.en @= 0
+    assert A.sim_run( 0 ) == 0
+    assert A.sim_run( 3 ) == 3
+    assert A.count == 10
+
+def test_sim_run_check_every():
+  A = _counter()
+  # until() is checked at cycles 0, 4, 8 and 12
+  assert A.sim_run( 100, until=A.done, check_every=4 ) == 12
+  assert A.count == 12
+
+  B = _counter()
+  assert B.sim_run( 7, until=B.done, check_every=4 ) == 7
+  assert B.count == 7
+
+  try:
+    B.sim_run( 7, until=B.done, check_every=0 )
+  except ValueError as e:
+    print("{} is thrown\n{}".format( e.__class__.__name__, e ))
+    return
+  raise Exception("Should've thrown ValueError.")
+
+class Tile( Component ):
+
+  def construct( s ):
+    s.inc    = InPort( Bits16 )
+    s.in_    = InPort( Bits16 )
+    s.msg_in = InPort( Msg )
+    s.big_in = InPort( Bits80 )
+    s.out    = OutPort( Bits16 )
+    s.msg    = OutPort( Msg )
+    s.big    = OutPort( Bits80 )
+
+    s.nxt = Wire( Bits16 )
+
+    @update
+    def up_nxt():
+      s.nxt @= s.out + s.in_ + s.inc + zext( s.msg_in.x, 16 ) + trunc( s.big_in >> 64, 16 )
+
+    @update_ff
+    def up_regs():
+      if s.reset:
+        s.out <<= 0
+        s.msg <<= Msg( 0, 0 )
+        s.big <<= 0
+      else:
+        s.out <<= s.nxt
+        s.msg <<= Msg( trunc( s.nxt, 8 ), 1 )
+        s.big <<= concat( s.nxt, s.in_, s.inc, s.nxt, s.out )
+
+  def line_trace( s ):
+    return f"{s.out}"
+
+class Tiles( Component ):
+
+  def construct( s, n=4, last=Tile ):
+    s.inc  = InPort( Bits16 )
+    s.out  = [ OutPort( Bits16 ) for _ in range(n) ]
+    s.sum  = OutPort( Bits16 )
+    s.tiles = [ Tile() for _ in range(n-1) ] + [ last() ]
+
+    for i in range(n):
+      s.tiles[i].inc    //= s.inc
+      s.tiles[i].in_    //= s.tiles[i-1].out
+      s.tiles[i].msg_in //= s.tiles[i-1].msg
+      s.tiles[i].big_in //= s.tiles[i-1].big
+      s.out[i] //= s.tiles[i].out
+
+    # Reads the registers of all tiles
+    s.first = Wire( Bits16 )
+    s.last  = Wire( Bits16 )
+    s.first //= s.tiles[0].out
+    s.last  //= s.tiles[n-1].out
+
+    @update
+    def up_sum():
+      s.sum @= s.first + s.last
+
+  def line_trace( s ):
+    return "|".join( x.line_trace() for x in s.tiles )
+
+def _run_tiles( ncycles=20, **kwargs ):
+  A = Tiles()
+  A.elaborate()
+  A.apply( DefaultPassGroup( **kwargs ) )
+  A.sim_reset()
+
+  trace = []
+  try:
+    for i in range(ncycles):
+      A.inc @= i * 7
+      A.sim_eval_combinational()
+      trace.append( ( [ int(x) for x in A.out ], int(A.sum) ) )
+      A.sim_tick()
+    A.sim_run( 5 )
+    trace.append( ( [ int(x) for x in A.out ], int(A.sum) ) )
+  finally:
+    if hasattr( A, "sim_close" ):
+      A.sim_close()
+  return A, trace
+
+def test_partitions():
+  _, ref = _run_tiles( print_line_trace=False )
+  for kwargs in [ {}, { "event_driven": True }, { "inline_blocks": True } ]:
+    A, trace = _run_tiles( print_line_trace=False, partitions=2, **kwargs )
+    assert A._sim.partitioned_sim.nparts == 2
+    assert trace == ref
+
+  A, trace = _run_tiles( print_line_trace=False, partitions=3 )
+  assert A._sim.partitioned_sim.nparts == 3
+  assert trace == ref
+
+  # The blocks of a tile stay in the same partition
+  part_of = A._sim.partitioned_sim.part_of
+  for tile in A.tiles:
+    assert len( { part_of[x] for x in tile.get_update_block_order() if x in part_of } ) == 1
+
+def test_partitions_line_trace( capsys ):
+  _run_tiles( ncycles=5 )
+  ref = capsys.readouterr().out
+  _run_tiles( ncycles=5, partitions=4 )
+  assert capsys.readouterr().out == ref
+
+class BadTile( Tile ):
+
+  def construct( s ):
+    super().construct()
+
+    @update
+    def up_check():
+      assert s.out < 100
+
+def test_partitions_error():
+  A = Tiles( last=BadTile )
+  A.elaborate()
+  A.apply( DefaultPassGroup( print_line_trace=False, partitions=2 ) )
+  A.sim_reset()
+  A.inc @= 50
+  try:
+    A.sim_run( 10 )
+  except RuntimeError as e:
+    print("{} is thrown\n{}".format( e.__class__.__name__, e ))
+    assert "Partition 1" in str(e) and "AssertionError" in str(e)
+  else:
+    raise Exception("Should've thrown RuntimeError.")
+  finally:
+    A.sim_close()
+
+  try:
+    A.sim_tick()
+  except RuntimeError:
+    return
+  raise Exception("Should've thrown RuntimeError.")
@@ -0,0 +1,171 @@
+#=========================================================================
+# SimCache_test.py
+#=========================================================================
+
+import os
+
+import pytest
+
+from pymtl3.datatypes import Bits8, Bits16, bitstruct, zext
+from pymtl3.dsl import *
+
+from ...PassGroups import DefaultPassGroup
+from ..SimCache import SimCache
+
+
+@bitstruct
+class XY:
+  x: Bits8
+  y: Bits8
+
+class Stage( Component ):
+
+  def construct( s, offset ):
+    s.in_ = InPort( Bits8 )
+    s.out = OutPort( XY )
+    s.reg = Wire( Bits8 )
+
+    @update_ff
+    def up_reg():
+      s.reg <<= s.in_
+
+    @update
+    def up_out():
+      s.out.x @= s.reg + offset
+      s.out.y @= s.in_
+
+class Top( Component ):
+
+  def construct( s, offset=1 ):
+    s.in_ = InPort( Bits8 )
+    s.out = OutPort( Bits16 )
+    s.p   = Wire( XY )
+
+    s.st = [ Stage( offset ) for _ in range(2) ]
+    s.st[0].in_ //= s.in_
+    s.st[1].in_ //= s.st[0].out.x
+    s.x = Wire( Bits8 )
+    s.y = Wire( Bits8 )
+    s.x //= s.st[1].out.x
+    s.y //= s.st[0].out.y
+
+    # A constant field and an SCC through the fields of a struct
+    s.q = Wire( XY )
+    s.q.y //= 7
+
+    @update
+    def up_px():
+      s.p.x @= s.x + s.q.y + ( s.q.x & 0 )
+
+    @update
+    def up_py():
+      s.p.y @= s.p.x + s.y
+
+    @update
+    def up_out():
+      s.out @= zext( s.p.y, 16 ) + zext( s.q.x, 16 )
+
+    @update
+    def up_qx():
+      s.q.x @= s.p.y
+
+def _run( cache_dir, **kwargs ):
+  A = Top( **kwargs )
+  A.elaborate()
+  A.apply( DefaultPassGroup( print_line_trace=False, cache_dir=cache_dir ) )
+  A.sim_reset()
+
+  trace = []
+  for i in range(20):
+    A.in_ @= i * 7
+    A.sim_eval_combinational()
+    trace.append( int(A.out) )
+    A.sim_tick()
+  return A, trace
+
+def test_load_from_cache( tmpdir ):
+  cache_dir = str(tmpdir)
+  _, ref = _run( None )
+
+  A, trace = _run( cache_dir )
+  assert trace == ref
+  files = sorted( os.listdir( cache_dir ) )
+  assert len(files) == 2
+  mtimes = [ os.stat( os.path.join( cache_dir, x ) ).st_mtime_ns for x in files ]
+
+  # Nothing is dumped again on a hit
+  B, trace = _run( cache_dir )
+  assert trace == ref
+  assert sorted( os.listdir( cache_dir ) ) == files
+  assert [ os.stat( os.path.join( cache_dir, x ) ).st_mtime_ns for x in files ] == mtimes
+
+  assert len( B._dag.genblks ) == len( A._dag.genblks )
+  assert len( B._sched.scc_upblks ) == len( A._sched.scc_upblks ) == 1
+  assert [ x.__name__ for x in B._sched.update_schedule ] == \
+         [ x.__name__ for x in A._sched.update_schedule ]
+
+def test_parameters_change_key( tmpdir ):
+  A = Top()
+  A.elaborate()
+  B = Top( offset=2 )
+  B.elaborate()
+  C = Top()
+  C.elaborate()
+  assert SimCache.get_key( A ) != SimCache.get_key( B )
+  assert SimCache.get_key( A ) == SimCache.get_key( C )
+
+  _, ref = _run( None, offset=2 )
+  _run( str(tmpdir) )
+  _, trace = _run( str(tmpdir), offset=2 )
+  assert trace == ref
+  assert len( os.listdir( str(tmpdir) ) ) == 4
+
+class Offset:
+  pass
+
+def _offset( x ):
+  return x
+
+class FuncStage( Component ):
+
+  def construct( s, func, offset ):
+    s.out = OutPort( Bits8 )
+
+    @update
+    def up_out():
+      s.out @= func( offset )
+
+def test_uncacheable_args( tmpdir ):
+  # Module-level functions are identified by name
+  A = FuncStage( _offset, 3 )
+  A.elaborate()
+  B = FuncStage( _offset, 3 )
+  B.elaborate()
+  assert SimCache.get_key( A ) == SimCache.get_key( B )
+
+  # The default repr contains the address of the object
+  for args in [ ( _offset, Offset() ), ( lambda x: x, 3 ) ]:
+    C = FuncStage( *args )
+    C.elaborate()
+    with pytest.warns( UserWarning, match="not cached" ):
+      assert SimCache.get_key( C ) is None
+
+  C = FuncStage( lambda x: 5, 3 )
+  C.elaborate()
+  with pytest.warns( UserWarning ):
+    C.apply( DefaultPassGroup( print_line_trace=False, cache_dir=str(tmpdir) ) )
+  C.sim_reset()
+  assert C.out == 5
+  assert os.listdir( str(tmpdir) ) == []
+
+def test_invalid_cache( tmpdir ):
+  cache_dir = str(tmpdir)
+  _, ref = _run( None )
+  _run( cache_dir )
+
+  for name in os.listdir( cache_dir ):
+    with open( os.path.join( cache_dir, name ), 'wb' ) as f:
+      f.write( b"garbage" )
+
+  _, trace = _run( cache_dir )
+  assert trace == ref
@@ -13,7 +13,6 @@ import re
 
 from pymtl3 import *
 from pymtl3.datatypes import is_bitstruct_class
-from pymtl3.passes.backends.verilog import *
 from pymtl3.passes.tracing import VcdGenerationPass
 
 #-------------------------------------------------------------------------
@@ -50,7 +49,16 @@ def finalize_verilator( model ):
   if hasattr( model, 'finalize' ):
     model.finalize()
 
+# The verilog backend is only imported when a model is configured, so
+# that importing the test utilities doesn't pay for it.
+
 def _recursive_set_vl_trace( m, dump_vcd ):
+  from pymtl3.passes.backends.verilog import (
+      VerilogPlaceholder,
+      VerilogTranslationImportPass,
+      VerilogVerilatorImportPass,
+  )
+
   if ( m.has_metadata( VerilogTranslationImportPass.enable ) and \
        m.get_metadata( VerilogTranslationImportPass.enable ) ) or \
       isinstance( m, VerilogPlaceholder ):
@@ -62,6 +70,12 @@ def _recursive_set_vl_trace( m, dump_vcd ):
       _recursive_set_vl_trace( child, dump_vcd )
 
 def config_model_with_cmdline_opts( top, cmdline_opts, duts ):
+  from pymtl3.passes.backends.verilog import (
+      VerilogPlaceholderPass,
+      VerilogTBGenPass,
+      VerilogTranslationImportPass,
+      VerilogVerilatorImportPass,
+  )
 
   test_verilog = cmdline_opts[ 'test_verilog' ]
   dump_vcd     = cmdline_opts[ 'dump_vcd'     ]
@@ -177,8 +191,7 @@ def run_sim( model, cmdline_opts=None, line_trace=True, duts=None ):
     model.sim_reset()
 
     # Run simulation
-    while not model.done() and model.sim_cycle_count() < max_cycles:
-      model.sim_tick()
+    model.sim_run( max_cycles - model.sim_cycle_count(), until=model.done )
 
     # Force a test failure if we timed out
     assert model.sim_cycle_count() < max_cycles
@@ -34,6 +34,9 @@ def pytest_addoption(parser):
                     default=None, help="dump verilog test bench for each test" )
   group.addoption( "--max-cycles", dest="max_cycles", action="store",
                     default=None, help="max cycles of simulation" )
+  group.addoption( "--func-cache-dir", dest="func_cache_dir", action="store",
+                    default=None, help="cache the parsed update blocks on disk "
+                                       "in this directory across test runs" )
 
 @pytest.fixture
 def cmdline_opts( request ):
@@ -56,7 +59,10 @@ def no_translation( request ):
     pytest.skip("skipping untranslatable test cases with --test-verilog")
 
 def pytest_configure(config):
-  pass
+  func_cache_dir = config.getoption("func_cache_dir")
+  if func_cache_dir:
+    from pymtl3.dsl.ComponentLevel2 import set_func_cache_dir
+    set_func_cache_dir( os.path.abspath( func_cache_dir ) )
 
 def pytest_unconfigure(config):
   pass
@@ -9,7 +9,7 @@ https://github.com/pypa/sampleproject/blob/master/setup.py
 
 from os import path
 
-from setuptools import find_packages, setup
+from setuptools import Extension, find_packages, setup
 
 #-------------------------------------------------------------------------
 # get_version
@@ -81,6 +81,12 @@ setup(
     ],
   },
 
+  # The native Bits implementation (PYMTL_BITS=c) is optional. Failing to
+  # build it doesn't fail the installation.
+  ext_modules = [
+    Extension( 'pymtl3.datatypes.CBits', [ 'pymtl3/datatypes/CBits.c' ], optional=True ),
+  ],
+
   install_requires = [
     'pytest',
     'hypothesis >= 4.18.1',